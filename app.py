@@ -1,31 +1,682 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, make_response
+from flask import Flask, Blueprint, current_app, has_request_context, render_template, request, redirect, url_for, flash, session, make_response, jsonify, send_file, abort, Response, stream_with_context
+from flask.cli import with_appcontext
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from datetime import datetime, date, timedelta, time  # Added time here
-from functools import wraps
+from functools import wraps, cached_property
+from itertools import groupby, chain
+from collections import deque, OrderedDict
+from contextlib import contextmanager
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import safe_join
+from jinja2 import nodes, FileSystemBytecodeCache
+from jinja2.ext import Extension
+from markupsafe import Markup
 import os
 from io import StringIO
 import csv
-from sqlalchemy import func
+from sqlalchemy import func, event, create_engine, select, update, literal, tuple_, case, or_, text, true
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.exc import OperationalError, IntegrityError
 import random
 import time as time_module  # Rename the time module to avoid conflicts
+import click
+import math
+import queue
+import sqlite3
+import sys
+import threading
+import uuid
+import json
+import gzip
+import hashlib
+import heapq
+import mimetypes
+import zlib
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///medical_store.db'
-app.config['SECRET_KEY'] = 'your-secret-key-here'
-db = SQLAlchemy(app)
+# Extensions are created unbound and attached to an app in create_app(),
+# so importing this module does not touch the database
+db = SQLAlchemy()
 
 # Initialize Flask-Login
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'main.login'
+
+# All routes live on this blueprint so every app built by create_app() gets them
+main = Blueprint('main', __name__)
+
+# SQLite connection profile applied to every new connection. WAL lets report
+# reads run alongside till writes, and busy_timeout makes a writer wait for
+# the lock instead of failing straight away with "database is locked".
+DEFAULT_SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,           # milliseconds to wait for a lock
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',        # safe with WAL, one fsync per checkpoint
+    'cache_size': -20000,           # negative means KiB, so ~20 MB page cache
+    'mmap_size': 268435456,         # 256 MB memory-mapped reads
+    'temp_store': 'MEMORY',
+}
+
+def configure_sqlite_engine(engine, pragmas):
+    """Register a connect listener that applies the PRAGMA profile to the engine."""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+def register_sql_functions(engine):
+    """Register a connect listener that adds SQL functions queries rely on but SQLite may lack.
+
+    Kept apart from the PRAGMA profile, which can be turned off entirely.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def add_sql_functions(dbapi_connection, connection_record):
+        # Builds without SQLite's math functions get pow() for the demand forecast
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute('SELECT pow(1, 1)')
+        except sqlite3.OperationalError:
+            dbapi_connection.create_function('pow', 2, math.pow, deterministic=True)
+        cursor.close()
+
+# Sales older than SALES_ARCHIVE_DAYS move to a second SQLite file, attached
+# to every connection under this schema name
+ARCHIVE_SCHEMA = 'archive'
+
+def attach_sales_archive(engine, path, pragmas, read_only=False):
+    """Register a connect listener that attaches the sales archive file to the engine.
+
+    The archive gets the main database's journal mode and synchronous
+    setting, so archiving and report reads don't block each other either.
+    A read-only engine attaches it read-only.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def attach_archive(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if read_only and path != ':memory:':
+            # Read-only engines open their connections with URI filenames
+            cursor.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (f'file:{path}?mode=ro',))
+        else:
+            cursor.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (path,))
+            for name in ('journal_mode', 'synchronous'):
+                if name in pragmas:
+                    cursor.execute(f'PRAGMA {ARCHIVE_SCHEMA}.{name}={pragmas[name]}')
+        cursor.close()
+
+def is_lock_error(error):
+    """True if an OperationalError is SQLite reporting a busy or locked database."""
+    message = str(getattr(error, 'orig', error)).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+def run_with_lock_retry(unit_of_work):
+    """Run a write-and-commit callable, retrying with backoff on SQLite lock errors.
+
+    The session is rolled back before each retry, so the callable must
+    re-apply its changes every time it is called.
+
+    Returns:
+        Whatever the callable returns
+    """
+    retries = current_app.config['SQLITE_LOCK_RETRIES']
+    delay = current_app.config['SQLITE_LOCK_RETRY_DELAY']
+    for attempt in range(retries + 1):
+        try:
+            return unit_of_work()
+        except OperationalError as e:
+            db.session.rollback()
+            if not is_lock_error(e) or attempt == retries:
+                raise
+            # Exponential backoff with jitter so competing tills don't retry in lockstep
+            time_module.sleep(delay * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+def create_reports_engine(app):
+    """Build a read-only engine on the same SQLite file for reports and exports.
+
+    Returns:
+        The engine, or None when the database is not a SQLite file (for
+        example an in-memory test database), in which case reports share
+        the main session.
+    """
+    if app.config.get('REPORTS_DATABASE_URI'):
+        url = make_url(app.config['REPORTS_DATABASE_URI'])
+    else:
+        url = db.engine.url
+        if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:') \
+                or url.database.startswith('file:'):
+            return None
+        url = url.set(database=f'file:{url.database}', query={'mode': 'ro', 'uri': 'true'})
+
+    engine = create_engine(url)
+    # journal_mode is a write, and the writer connections have already set it
+    pragmas = {name: value for name, value in app.config['SQLITE_PRAGMAS'].items()
+               if name != 'journal_mode'}
+    configure_sqlite_engine(engine, pragmas)
+    register_sql_functions(engine)
+
+    # pysqlite never issues BEGIN before a SELECT, so take over transaction
+    # control and start every read transaction explicitly. In WAL mode this
+    # pins one snapshot for the whole report without blocking writers.
+    @event.listens_for(engine, 'connect')
+    def disable_driver_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin_read_transaction(connection):
+        connection.exec_driver_sql('BEGIN')
+
+    attach_sales_archive(engine, app.config['SALES_ARCHIVE_PATH'], pragmas,
+                         read_only=url.query.get('uri') == 'true')
+    return engine
+
+@contextmanager
+def report_session():
+    """Yield a session for report queries that sees one consistent snapshot.
+
+    Queries run on the read-only reports engine inside a single read
+    transaction, so long reports never hold locks that delay sales.
+    """
+    engine = current_app.extensions.get('reports_engine')
+    if engine is None:
+        yield db.session
+        return
+    with Session(engine, expire_on_commit=False) as session, session.begin():
+        yield session
+
+def commit_write(apply):
+    """Apply a write and commit it, returning whatever apply() returns.
+
+    apply() changes rows through db.session without committing. With
+    SINGLE_WRITER it runs on the writer thread, in a transaction shared
+    with other queued writes, so it must load the rows it changes itself
+    and return plain values rather than ORM objects. Either way it may run
+    more than once when the database is locked.
+    """
+    writer = current_app.extensions.get('write_queue')
+    if writer is not None:
+        return writer.submit(apply)
+
+    def unit_of_work():
+        result = apply()
+        db.session.commit()
+        return result
+
+    return run_with_lock_retry(unit_of_work)
+
+class PendingWrite:
+    """One write waiting in the WriteQueue, and its outcome once committed."""
+
+    __slots__ = ('apply', 'result', 'error', 'done')
+
+    def __init__(self, apply):
+        self.apply = apply
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+class WriteQueue:
+    """Single writer thread that commits queued writes in batches.
+
+    Request threads hand their writes to submit() and wait. The writer takes
+    everything queued, up to `max_batch` writes, and applies each inside its
+    own SAVEPOINT of one BEGIN IMMEDIATE transaction, so a failing write is
+    rolled back alone while the rest share a single commit.
+    """
+
+    name = 'write-queue'
+
+    def __init__(self, app, max_batch, timeout):
+        self.app = app
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.is_running:
+                return
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, apply):
+        """Queue a write and wait for its batch to commit.
+
+        Raises:
+            Whatever apply() raised, or TimeoutError if no answer came in time
+        """
+        self.start()
+        write = PendingWrite(apply)
+        self._queue.put(write)
+        if not write.done.wait(self.timeout):
+            raise TimeoutError(f'The write queue did not commit within {self.timeout} seconds')
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def _run(self):
+        while True:
+            write = self._queue.get()
+            if write is None:
+                return
+            batch = [write]
+            stopping = False
+            while len(batch) < self.max_batch:
+                try:
+                    write = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if write is None:
+                    stopping = True
+                    break
+                batch.append(write)
+            with self.app.app_context():
+                try:
+                    self._commit_batch(batch)
+                finally:
+                    db.session.remove()
+            if stopping:
+                return
+
+    def _commit_batch(self, batch):
+        def apply_batch():
+            # Taking the write lock up front also stops pysqlite from letting
+            # the first SAVEPOINT start, and on release commit, the transaction
+            db.session.execute(text('BEGIN IMMEDIATE'))
+            outcomes = []
+            for write in batch:
+                try:
+                    with db.session.begin_nested():
+                        outcomes.append((write.apply(), None))
+                except OperationalError as e:
+                    if is_lock_error(e):
+                        raise
+                    outcomes.append((None, e))
+                except Exception as e:
+                    outcomes.append((None, e))
+            db.session.commit()
+            return outcomes
+
+        try:
+            outcomes = run_with_lock_retry(apply_batch)
+        except Exception as e:
+            db.session.rollback()
+            self.app.logger.exception('%s failed to commit a batch of %d writes', self.name, len(batch))
+            outcomes = [(None, e)] * len(batch)
+        for write, (result, error) in zip(batch, outcomes):
+            write.result, write.error = result, error
+            write.done.set()
+
+class EventBroker:
+    """Fan-out of live events to open Server-Sent Events streams.
+
+    Events are LiveEvent rows committed together with the change behind
+    them, so streams see what every worker process writes, not just their
+    own. Every `poll_interval` seconds, or at once when a write in this
+    process commits, one waiting stream reads the new rows into a bounded
+    ring buffer for all of them; the others park on one Condition. Timed
+    polls first check PRAGMA data_version and skip the query when no other
+    connection has committed. A stream that falls more than `history`
+    events behind is told to resync instead of buffering without bound.
+    """
+
+    def __init__(self, app, poll_interval=1.0, history=256):
+        self.app = app
+        self.poll_interval = poll_interval
+        self._condition = threading.Condition()
+        self._events = deque(maxlen=history)
+        self._last_id = None  # newest id read; None until the first poll
+        self._next_poll = 0
+        self._polling = False
+        self._query_due = True
+        self._data_version = None
+        self._version_connection = None
+
+    @property
+    def last_id(self):
+        with self.app.app_context(), report_session() as reports:
+            return reports.query(func.max(LiveEvent.id)).scalar() or 0
+
+    def publish(self, name, data, store_id=None):
+        """Commit one event on its own, for events not tied to a model change."""
+        with self.app.app_context(), db.engine.begin() as connection:
+            connection.execute(LiveEvent.__table__.insert(), [live_event_row(name, data, store_id)])
+        self.notify()
+
+    def notify(self):
+        """Poll at once; called when a write in this process commits."""
+        with self._condition:
+            self._next_poll = 0
+            self._query_due = True
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            if self._version_connection is not None:
+                self._version_connection.close()
+                self._version_connection = None
+
+    def _database_changed(self):
+        # Only the polling thread gets here, so the connection is never shared
+        if self._version_connection is None:
+            with self.app.app_context():
+                url = db.engine.url
+            if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:') \
+                    or url.database.startswith('file:'):
+                return True
+            self._version_connection = sqlite3.connect(url.database, check_same_thread=False)
+        version = self._version_connection.execute('PRAGMA data_version').fetchone()[0]
+        changed = version != self._data_version
+        self._data_version = version
+        return changed
+
+    def _poll(self):
+        with self._condition:
+            query_due, self._query_due = self._query_due, False
+        # Read data_version before querying, so a commit in between is seen next time
+        if not self._database_changed() and not query_due:
+            with self._condition:
+                self._next_poll = time_module.monotonic() + self.poll_interval
+            return
+        history = self._events.maxlen
+        with self.app.app_context(), report_session() as reports:
+            query = reports.query(LiveEvent.id, LiveEvent.name, LiveEvent.data, LiveEvent.store_id)
+            if self._last_id is None:
+                rows = query.order_by(LiveEvent.id.desc()).limit(history).all()[::-1]
+            else:
+                rows = query.filter(LiveEvent.id > self._last_id).order_by(LiveEvent.id).limit(history).all()
+        with self._condition:
+            self._events.extend((event_id, name, json.loads(data), store_id)
+                                for event_id, name, data, store_id in rows)
+            if rows:
+                self._last_id = rows[-1][0]
+            elif self._last_id is None:
+                self._last_id = 0
+            # A full page may have more behind it
+            if len(rows) == history:
+                self._next_poll, self._query_due = 0, True
+            else:
+                self._next_poll = time_module.monotonic() + self.poll_interval
+
+    def wait(self, after_id, timeout):
+        """Events committed after `after_id`, waiting up to `timeout` seconds for one.
+
+        Returns:
+            Tuple of (events, missed); missed means events after `after_id`
+            have already left the buffer
+        """
+        deadline = time_module.monotonic() + timeout
+        while True:
+            with self._condition:
+                events = [event for event in self._events if event[0] > after_id]
+                missed = bool(self._events) and self._events[0][0] > after_id + 1
+                if events or missed:
+                    return events, missed
+                now = time_module.monotonic()
+                if self._polling or now < self._next_poll:
+                    if now >= deadline:
+                        return [], False
+                    wake_at = deadline if self._polling else min(deadline, self._next_poll)
+                    self._condition.wait(wake_at - now)
+                    continue
+                self._polling = True
+            try:
+                self._poll()
+            finally:
+                with self._condition:
+                    self._polling = False
+                    self._condition.notify_all()
+
+class FragmentCache:
+    """Thread-safe LRU of rendered template fragments.
+
+    Keys carry the version of whatever the fragment shows, so entries are
+    never invalidated; outdated ones simply stop being asked for and age out.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return fragment
+
+    def set(self, key, fragment):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = fragment
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class ChartCache:
+    """Thread-safe cache of report chart series that expire after `ttl` seconds.
+
+    Entries are keyed by series name and branch. Commits that touch sales
+    or medicines drop the affected entries at once; the TTL bounds how
+    stale a series can get from writes this process does not see.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._generation = 0
+
+    def get(self, key, compute):
+        now = time_module.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            generation = self._generation
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        value = compute()
+        with self._lock:
+            # A series computed across an invalidation may already be out of date
+            if self.ttl > 0 and generation == self._generation:
+                self._entries[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self, names, store_id=None):
+        """Drop the named series for one branch and head office, or for every branch when store_id is None."""
+        with self._lock:
+            self._generation += 1
+            for key in [key for key in self._entries if key[0] in names]:
+                if store_id is None or key[1] in (store_id, None):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+class FragmentCacheExtension(Extension):
+    """Adds {% cache key, ... %}...{% endcache %} to templates.
+
+    The block body only renders when the environment's fragment_cache has
+    nothing under the template name and key values; otherwise the stored
+    output is reused without running its loops.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [nodes.Const(parser.name), parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_cached', [nodes.Tuple(key_parts, 'load')]),
+                               [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, key, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = Markup(caller())
+            cache.set(key, fragment)
+        return fragment
+
+class LazyBytecodeCache(FileSystemBytecodeCache):
+    """FileSystemBytecodeCache that creates its directory on first template load.
+
+    The stock class picks, creates and chmods its directory as soon as it
+    is built, which would happen when the app is imported.
+    """
+
+    def __init__(self, directory=None, pattern='__jinja2_%s.cache'):
+        self._directory = directory
+        self.pattern = pattern
+
+    @cached_property
+    def directory(self):
+        if self._directory is None:
+            return self._get_default_cache_dir()
+        os.makedirs(self._directory, exist_ok=True)
+        return self._directory
+
+# Stylesheets and scripts shared by every page. They are served under
+# content-hashed names, so browsers may keep them for a year.
+ASSET_FILES = ('css/base.css', 'js/base.js', 'js/charts.js', 'js/live-events.js')
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+def fingerprinted_name(name, content):
+    """Insert a hash of `content` before the extension, e.g. css/base.1a2b3c4d5e6f.css."""
+    root, extension = os.path.splitext(name)
+    return f'{root}.{hashlib.sha256(content).hexdigest()[:12]}{extension}'
+
+def build_assets(static_dir, build_dir):
+    """Write fingerprinted copies of ASSET_FILES, their gzip variants and manifest.json.
+
+    Earlier builds are left in place, so pages rendered before a deploy
+    can still load the files they name.
+
+    Returns:
+        The manifest, mapping each asset name to its fingerprinted name
+    """
+    files = {}
+    for name in ASSET_FILES:
+        with open(os.path.join(static_dir, name), 'rb') as source:
+            content = source.read()
+        hashed_name = fingerprinted_name(name, content)
+        path = os.path.join(build_dir, hashed_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as target:
+            target.write(content)
+        # mtime=0 keeps rebuilds of an unchanged file byte-identical
+        with open(path + '.gz', 'wb') as target:
+            target.write(gzip.compress(content, 9, mtime=0))
+        files[name] = hashed_name
+    with open(os.path.join(build_dir, 'manifest.json'), 'w') as manifest_file:
+        json.dump(files, manifest_file, indent=2, sort_keys=True)
+    return files
+
+class AssetManifest:
+    """Maps asset names to fingerprinted names and back to files to serve.
+
+    Uses the manifest.json written by `flask build-assets` when there is
+    one. Otherwise fingerprints are computed from the sources, and the
+    uncompressed sources are served under them. Either way the files are
+    read once, on first use, so building the app touches no static files.
+    """
+
+    def __init__(self, static_dir, build_dir):
+        self.static_dir = static_dir
+        self.build_dir = build_dir
+
+    @cached_property
+    def built(self):
+        return os.path.exists(os.path.join(self.build_dir, 'manifest.json'))
+
+    @cached_property
+    def files(self):
+        if self.built:
+            with open(os.path.join(self.build_dir, 'manifest.json')) as manifest_file:
+                return json.load(manifest_file)
+        files = {}
+        for name in ASSET_FILES:
+            with open(os.path.join(self.static_dir, name), 'rb') as source:
+                files[name] = fingerprinted_name(name, source.read())
+        return files
+
+    @cached_property
+    def _names(self):
+        return {hashed_name: name for name, hashed_name in self.files.items()}
+
+    def resolve(self, hashed_name, accepts_gzip=False):
+        """Find the file behind a fingerprinted name.
+
+        Returns:
+            (path, content_encoding), or (None, None) for unknown names
+        """
+        if not self.built:
+            name = self._names.get(hashed_name)
+            return (os.path.join(self.static_dir, name), None) if name else (None, None)
+        path = safe_join(self.build_dir, hashed_name)
+        if path is None or not os.path.isfile(path):
+            return None, None
+        if accepts_gzip and os.path.isfile(path + '.gz'):
+            return path + '.gz', 'gzip'
+        return path, None
 
 # Add the user loader function
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+# A pharmacy branch. Medicines and sales belong to exactly one; users without
+# a store work at head office and can see every branch.
+class Store(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(20), unique=True, nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+
+DEFAULT_STORE_ID = 1
+
 # User Model
 class User(UserMixin, db.Model):
     __tablename__ = 'user'  # Explicitly set the table name
@@ -34,14 +685,34 @@ class User(UserMixin, db.Model):
     password = db.Column(db.String(120), nullable=False)
     user_type = db.Column(db.String(20), nullable=False)  # 'pharmacist', 'store_manager', or 'cashier'
     email = db.Column(db.String(120), nullable=True)  # Making email nullable for backward compatibility
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), nullable=True)  # None for head office
 
     # Add property to make templates work
     @property
     def role(self):
         return self.user_type
 
-class Medicine(db.Model):
+# Status helpers shared by Medicine and the read-only MedicineSnapshot
+def stock_status_of(quantity, min_stock_level):
+    if quantity <= 0:
+        return 'out_of_stock'
+    elif quantity < min_stock_level:
+        return 'low_stock'
+    return 'well_stocked'
+
+class MedicineStatusMixin:
+    __slots__ = ()
+
+    def is_expired(self):
+        return self.expiry_date < datetime.now().date()
+    
+    def stock_status(self):
+        return stock_status_of(self.quantity, self.min_stock_level)
+
+class Medicine(MedicineStatusMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), nullable=False,
+                         default=DEFAULT_STORE_ID, server_default=str(DEFAULT_STORE_ID))
     name = db.Column(db.String(100), nullable=False)
     category = db.Column(db.String(50), nullable=False)
     price = db.Column(db.Float, nullable=False)
@@ -51,32 +722,317 @@ class Medicine(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    def is_expired(self):
-        return self.expiry_date < datetime.now().date()
-    
-    def stock_status(self):
-        if self.quantity <= 0:
-            return "out_of_stock"
-        elif self.quantity < self.min_stock_level:
-            return "low_stock"
-        else:
-            return "well_stocked"
+    # Branch views list, filter and page one store's medicines by name, and
+    # the inventory snapshot picks up rows changed elsewhere by updated_at
+    __table_args__ = (
+        db.Index('ix_medicine_store_name', 'store_id', 'name', 'id'),
+        db.Index('ix_medicine_store_category', 'store_id', 'category'),
+        db.Index('ix_medicine_updated_at', 'updated_at'),
+    )
+
+# Writes that bypass the ORM, such as another tool's UPDATE, still move
+# updated_at, in the format SQLAlchemy stores it in
+MEDICINE_TOUCH_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS medicine_touch_on_update AFTER UPDATE ON medicine
+       WHEN NEW.updated_at IS OLD.updated_at
+       BEGIN UPDATE medicine SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000' WHERE id = NEW.id; END""",
+    """CREATE TRIGGER IF NOT EXISTS medicine_touch_on_insert AFTER INSERT ON medicine
+       WHEN NEW.updated_at IS NULL
+       BEGIN UPDATE medicine SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') || '000' WHERE id = NEW.id; END""",
+]
+
+@event.listens_for(Medicine.__table__, 'after_create')
+def create_medicine_triggers(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        for trigger in MEDICINE_TOUCH_TRIGGERS:
+            connection.exec_driver_sql(trigger)
+
+# A named customer, shared by every branch. Sales link to it when they are
+# flushed, and the lifetime columns are kept up to date in the same
+# transaction. NOCASE makes the unique name index serve case-insensitive
+# lookups and prefix searches.
+class Customer(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100, collation='NOCASE'), nullable=False, unique=True)
+    lifetime_purchases = db.Column(db.Integer, nullable=False, default=0)
+    lifetime_units = db.Column(db.Integer, nullable=False, default=0)
+    lifetime_revenue = db.Column(db.Float, nullable=False, default=0.0, index=True)
+    first_purchase_at = db.Column(db.DateTime, nullable=True)
+    last_purchase_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'lifetime_purchases': self.lifetime_purchases,
+            'lifetime_units': self.lifetime_units,
+            'lifetime_revenue': round(self.lifetime_revenue, 2),
+            'first_purchase_at': self.first_purchase_at.strftime('%Y-%m-%d %H:%M') if self.first_purchase_at else None,
+            'last_purchase_at': self.last_purchase_at.strftime('%Y-%m-%d %H:%M') if self.last_purchase_at else None,
+        }
 
 # Modified Sale model
 class Sale(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     medicine_id = db.Column(db.Integer)  # Just store the ID without a foreign key constraint
+    store_id = db.Column(db.Integer, nullable=False, default=DEFAULT_STORE_ID, server_default=str(DEFAULT_STORE_ID))
     medicine_name = db.Column(db.String(100), nullable=False)  # Store medicine name at time of sale
     medicine_category = db.Column(db.String(50), nullable=False)  # Store category at time of sale
     quantity = db.Column(db.Integer, nullable=False)
     sale_price = db.Column(db.Float, nullable=False)
     customer_name = db.Column(db.String(100), nullable=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=True)
     sale_date = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # The first two indexes serve the newest-first keyset pagination of the
+    # sales history across all branches and within one, the others a single
+    # medicine's ledger and velocity and a single customer's history
+    __table_args__ = (
+        db.Index('ix_sale_sale_date_id', 'sale_date', 'id'),
+        db.Index('ix_sale_store_sale_date', 'store_id', 'sale_date', 'id'),
+        db.Index('ix_sale_medicine_id_sale_date', 'medicine_id', 'sale_date', 'id'),
+        db.Index('ix_sale_customer_sale_date', 'customer_id', 'sale_date', 'id'),
+    )
     
     @property
     def total_price(self):
         return self.quantity * self.sale_price
 
+# Archived sales: the same columns and indexes as sale, in the attached
+# archive file. archive_sales() moves old rows here so the hot table and its
+# indexes stay small. Reads map the rows back onto Sale through ArchivedSale.
+archived_sale_table = db.Table(
+    'sale',
+    *(db.Column(column.name, column.type, primary_key=column.primary_key, autoincrement=False,
+                nullable=column.nullable) for column in Sale.__table__.columns),
+    *(db.Index(index.name, *(column.name for column in index.columns)) for index in Sale.__table__.indexes),
+    schema=ARCHIVE_SCHEMA,
+)
+ArchivedSale = aliased(Sale, archived_sale_table, adapt_on_names=True, name='archived_sale')
+
+def newest_archived_sale_date(session):
+    return session.execute(select(func.max(archived_sale_table.c.sale_date))).scalar()
+
+def sale_sources(session, start=None):
+    """The Sale entities holding sales on or after `start`, or any sales when start is None.
+
+    The hot table always, and ArchivedSale only once the archive reaches
+    back that far, so recent ranges never touch the archive.
+    """
+    newest_archived = newest_archived_sale_date(session)
+    if newest_archived is None or (start is not None and newest_archived < start):
+        return [Sale]
+    return [Sale, ArchivedSale]
+
+def sales_since(session, start=None):
+    """One Sale entity to aggregate sales on or after `start` from.
+
+    Either the hot table, or both tables through a UNION ALL; SQLite pushes
+    the query's conditions into each side, so both use their own indexes.
+    A sale in the middle of being archived is briefly in both tables, so
+    the archive side skips ids the hot table still has.
+    """
+    if len(sale_sources(session, start)) == 1:
+        return Sale
+    hot_ids = select(Sale.__table__.c.id).where(Sale.__table__.c.id == archived_sale_table.c.id)
+    archived = select(archived_sale_table).where(~hot_ids.exists())
+    return aliased(Sale, select(Sale.__table__).union_all(archived).subquery('all_sales'))
+
+def sale_order_key(sale):
+    return sale.sale_date, sale.id
+
+def merge_sales(*streams):
+    """Merge streams of sales ordered newest first, as (sale_date, id) descending.
+
+    A sale in the middle of being archived is briefly in both tables; it is
+    yielded once.
+    """
+    previous_id = None
+    for sale in heapq.merge(*streams, key=sale_order_key, reverse=True):
+        if sale.id != previous_id:
+            yield sale
+        previous_id = sale.id
+
+# Running sales totals per medicine, updated in the same transaction as each
+# sale. The window columns cover the last SALES_COUNTER_WINDOW_DAYS days.
+class MedicineSalesCounter(db.Model):
+    medicine_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    store_id = db.Column(db.Integer, nullable=False, default=DEFAULT_STORE_ID, server_default=str(DEFAULT_STORE_ID))
+    medicine_name = db.Column(db.String(100), nullable=False)
+    medicine_category = db.Column(db.String(50), nullable=False)
+    lifetime_units = db.Column(db.Integer, nullable=False, default=0, index=True)
+    lifetime_revenue = db.Column(db.Float, nullable=False, default=0.0, index=True)
+    window_units = db.Column(db.Integer, nullable=False, default=0, index=True)
+    window_revenue = db.Column(db.Float, nullable=False, default=0.0, index=True)
+    last_sale_at = db.Column(db.DateTime, nullable=True)
+
+    # Top-N within one branch seeks on store_id before the ranking column
+    __table_args__ = (
+        db.Index('ix_sales_counter_store_lifetime_units', 'store_id', 'lifetime_units'),
+        db.Index('ix_sales_counter_store_lifetime_revenue', 'store_id', 'lifetime_revenue'),
+        db.Index('ix_sales_counter_store_window_units', 'store_id', 'window_units'),
+        db.Index('ix_sales_counter_store_window_revenue', 'store_id', 'window_revenue'),
+    )
+
+# Units and revenue per medicine per day; the source for the rolling window
+class MedicineDailySales(db.Model):
+    medicine_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    sale_day = db.Column(db.Date, primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+    # Covers the demand forecast, which reads every bucket in medicine order
+    # without visiting the table
+    __table_args__ = (
+        db.Index('ix_medicine_daily_sales_forecast', 'medicine_id', 'sale_day', 'units'),
+    )
+
+# Suggested min_stock_level from the latest demand forecast, waiting for a
+# pharmacist to accept it
+class ReorderSuggestion(db.Model):
+    medicine_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    current_min_stock_level = db.Column(db.Integer, nullable=False)
+    suggested_min_stock_level = db.Column(db.Integer, nullable=False)
+    daily_demand = db.Column(db.Float, nullable=False)
+    demand_std = db.Column(db.Float, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+# Result of one background stock and expiry check
+class StockCheck(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    checked_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    low_stock_count = db.Column(db.Integer, nullable=False, default=0)
+    out_of_stock_count = db.Column(db.Integer, nullable=False, default=0)
+    expired_count = db.Column(db.Integer, nullable=False, default=0)
+    expiring_soon_count = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def notification_count(self):
+        return self.low_stock_count + self.out_of_stock_count
+
+# One flagged medicine within a stock check
+class StockAlert(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    check_id = db.Column(db.Integer, db.ForeignKey('stock_check.id'), nullable=False, index=True)
+    store_id = db.Column(db.Integer, nullable=False, default=DEFAULT_STORE_ID, server_default=str(DEFAULT_STORE_ID))
+    medicine_id = db.Column(db.Integer, nullable=False)
+    medicine_name = db.Column(db.String(100), nullable=False)
+    medicine_category = db.Column(db.String(50), nullable=False)
+    alert_type = db.Column(db.String(20), nullable=False)  # 'out_of_stock', 'low_stock', 'expired' or 'expiring_soon'
+    quantity = db.Column(db.Integer, nullable=False)
+    min_stock_level = db.Column(db.Integer, nullable=False)
+    expiry_date = db.Column(db.Date, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_stock_alert_check_store', 'check_id', 'store_id'),
+    )
+
+# Report or export generated in the background and downloaded later
+class ReportJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(30), nullable=False)  # a key of REPORT_JOB_TYPES
+    params = db.Column(db.Text, nullable=False, default='{}')  # canonical JSON
+    dedupe_key = db.Column(db.String(200), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)  # 'pending', 'running', 'done' or 'failed'
+    progress = db.Column(db.Integer, nullable=False, default=0)  # percent complete
+    artifact_path = db.Column(db.String(300), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    requested_by = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    # At most one pending or running job per distinct request, so duplicate
+    # submissions attach to the job that is already queued
+    __table_args__ = (
+        db.Index('ix_report_job_active_key', 'dedupe_key', unique=True,
+                 sqlite_where=db.text("status IN ('pending', 'running')")),
+    )
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'job_type': self.job_type,
+            'params': json.loads(self.params),
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None,
+            'finished_at': self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None,
+        }
+
+# Last run and current lease of a periodic maintenance job. Every process
+# on the database shares it, so a restart doesn't rerun a job that is not
+# due yet and two processes never run the same job at once.
+class JobRun(db.Model):
+    name = db.Column(db.String(50), primary_key=True)  # the worker's name
+    last_run_at = db.Column(db.DateTime, nullable=True)
+    holder = db.Column(db.String(50), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+
+# Sale and stock alert events for the live event streams, committed with
+# the change behind them so every worker process can deliver them.
+# AUTOINCREMENT keeps ids increasing after old events are pruned.
+class LiveEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20), nullable=False)  # 'sale', 'alert' or 'resync'
+    data = db.Column(db.Text, nullable=False)  # JSON
+    store_id = db.Column(db.Integer, nullable=True)  # None for events every branch receives
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    __table_args__ = {'sqlite_autoincrement': True}
+
+# Append-only log of Medicine and Sale inserts, updates and deletes for
+# downstream systems. AUTOINCREMENT keeps seq increasing even after
+# compaction deletes the oldest entries.
+class ChangeLogEntry(db.Model):
+    __tablename__ = 'change_log'
+    seq = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(20), nullable=False)  # 'medicine' or 'sale'
+    row_id = db.Column(db.Integer, nullable=False)
+    store_id = db.Column(db.Integer)  # branch of the changed row, so branch managers only follow their own
+    operation = db.Column(db.String(10), nullable=False)  # 'insert', 'update' or 'delete'
+    payload = db.Column(db.Text, nullable=False)  # JSON image of the row after the change, or before a delete
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    __table_args__ = (
+        db.Index('ix_change_log_store_seq', 'store_id', 'seq'),
+        {'sqlite_autoincrement': True},
+    )
+
+    def to_dict(self):
+        return {
+            'seq': self.seq,
+            'table': self.table_name,
+            'id': self.row_id,
+            'op': self.operation,
+            'row': json.loads(self.payload),
+            'changed_at': self.changed_at.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+# Branch scoping
+def current_store_id():
+    """Store the current request works in, or None for every branch.
+
+    Branch staff are always scoped to their own store. Head-office users
+    pick a branch with /store/select and see all of them until they do.
+    """
+    if current_user.is_authenticated and current_user.store_id is not None:
+        return current_user.store_id
+    return session.get('store_id') if has_request_context() else None
+
+def store_condition(column, store_id):
+    """Restrict `column` to one store, or match everything for head office (store_id None)."""
+    return true() if store_id is None else column == store_id
+
+def get_store_medicine_or_404(medicine_id):
+    """Load a medicine of the current store; other branches' medicines are 404."""
+    medicine = db.session.get(Medicine, medicine_id)
+    store_id = current_store_id()
+    if medicine is None or (store_id is not None and medicine.store_id != store_id):
+        abort(404)
+    return medicine
+
 # Add this list near the top of your file, after imports
 MEDICINE_CATEGORIES = [
     'Antibiotics',
@@ -99,462 +1055,1038 @@ MEDICINE_CATEGORIES = [
     'Other'
 ]
 
-# Create database directory if it doesn't exist
-if not os.path.exists('instance'):
-    os.makedirs('instance')
+# Shared inventory snapshot
+class MedicineSnapshot(MedicineStatusMixin):
+    """Read-only copy of one Medicine row held by the InventorySnapshot."""
 
-# Check if database already exists
-db_path = 'instance/medical_store.db'
-db_exists = os.path.exists(db_path)
+    __slots__ = ('id', 'store_id', 'name', 'category', 'price', 'quantity', 'min_stock_level',
+                 'expiry_date', 'created_at', 'updated_at')
 
-# Create all database tables
-with app.app_context():
-    db.create_all()
+    def __init__(self, id, store_id, name, category, price, quantity, min_stock_level,
+                 expiry_date, created_at, updated_at):
+        self.id = id
+        self.store_id = store_id
+        self.name = name
+        self.category = sys.intern(category)  # a few dozen distinct values shared by every row
+        self.price = price
+        self.quantity = quantity
+        self.min_stock_level = min_stock_level
+        self.expiry_date = expiry_date
+        self.created_at = created_at
+        self.updated_at = updated_at
 
-    # Only add default users if database is new
-    if not db_exists or User.query.count() == 0 or Medicine.query.count() == 0:
-        print("Creating new database with default users.")
-        # Create default users
-        pharmacist = User(
-            username='pharmacist',
-            password=generate_password_hash('pharmacist123'),
-            user_type='pharmacist',
-            email='pharmacist@example.com'
-        )
-        db.session.add(pharmacist)
-        
-        manager = User(
-            username='manager',
-            password=generate_password_hash('manager123'),
-            user_type='store_manager',
-            email='manager@example.com'
-        )
-        db.session.add(manager)
-        
-        cashier = User(
-            username='cashier',
-            password=generate_password_hash('cashier123'),
-            user_type='cashier',
-            email='cashier@example.com'
-        )
-        db.session.add(cashier)
-        
-        try:
-            db.session.commit()
-            print("Database initialized with default users.")
-        except Exception as e:
-            db.session.rollback()
-            print(f"Error initializing database: {e}")
-        
-        # Add comprehensive sample medicines if none exist
-        if Medicine.query.count() == 0:
-            print("Adding sample medicines...")
-            
-            # Generate a variety of medicines across categories with different stock levels
-            medicines = [
-                # Antibiotics
-                Medicine(
-                    name='Amoxicillin 500mg', category='Antibiotics',
-                    price=12.50, quantity=50, min_stock_level=15,
-                    expiry_date=datetime.now().date() + timedelta(days=365)  # One year from now
-                ),
-                Medicine(
-                    name='Azithromycin 250mg', category='Antibiotics',
-                    price=15.99, quantity=30, min_stock_level=10,
-                    expiry_date=datetime.now().date() + timedelta(days=730)  # Two years from now
-                ),
-                Medicine(
-                    name='Ciprofloxacin 500mg', category='Antibiotics',
-                    price=18.75, quantity=25, min_stock_level=10,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=6)
-                ),
-                Medicine(
-                    name='Doxycycline 100mg', category='Antibiotics',
-                    price=9.99, quantity=5, min_stock_level=15,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=3)
-                ),
-                Medicine(
-                    name='Metronidazole 400mg', category='Antibiotics',
-                    price=7.25, quantity=0, min_stock_level=10,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=9)
-                ),
-                
-                # Pain Relief
-                Medicine(
-                    name='Paracetamol 500mg', category='Pain Relief',
-                    price=5.99, quantity=120, min_stock_level=30,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 3)
-                ),
-                Medicine(
-                    name='Ibuprofen 400mg', category='Pain Relief',
-                    price=7.25, quantity=8, min_stock_level=25,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 2)
-                ),
-                Medicine(
-                    name='Aspirin 325mg', category='Pain Relief',
-                    price=4.50, quantity=90, min_stock_level=20,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=6)
-                ),
-                Medicine(
-                    name='Naproxen 500mg', category='Pain Relief',
-                    price=8.75, quantity=45, min_stock_level=15,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=8)
-                ),
-                Medicine(
-                    name='Diclofenac Gel 1%', category='Pain Relief',
-                    price=11.25, quantity=18, min_stock_level=10,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=4)
-                ),
-                
-                # Cardiovascular
-                Medicine(
-                    name='Lisinopril 10mg', category='Cardiovascular',
-                    price=14.50, quantity=60, min_stock_level=20,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=3)
-                ),
-                Medicine(
-                    name='Atorvastatin 20mg', category='Cardiovascular',
-                    price=22.99, quantity=40, min_stock_level=15,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=11)
-                ),
-                Medicine(
-                    name='Amlodipine 5mg', category='Cardiovascular',
-                    price=12.75, quantity=3, min_stock_level=15,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=7)
-                ),
-                Medicine(
-                    name='Warfarin 5mg', category='Cardiovascular',
-                    price=8.50, quantity=0, min_stock_level=10,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=10)
-                ),
-                Medicine(
-                    name='Metoprolol 50mg', category='Cardiovascular',
-                    price=10.25, quantity=35, min_stock_level=20,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=5)
-                ),
-                
-                # Antidiabetic
-                Medicine(
-                    name='Metformin 500mg', category='Antidiabetic',
-                    price=9.25, quantity=70, min_stock_level=25,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=8)
-                ),
-                Medicine(
-                    name='Glipizide 5mg', category='Antidiabetic',
-                    price=13.50, quantity=7, min_stock_level=15,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=5)
-                ),
-                Medicine(
-                    name='Insulin NPH 100IU', category='Antidiabetic',
-                    price=42.99, quantity=22, min_stock_level=10,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=2)
-                ),
-                Medicine(
-                    name='Sitagliptin 100mg', category='Antidiabetic',
-                    price=35.75, quantity=0, min_stock_level=8,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=4)
-                ),
-                
-                # Antihistamines
-                Medicine(
-                    name='Cetirizine 10mg', category='Antihistamines',
-                    price=8.99, quantity=85, min_stock_level=20,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=9)
-                ),
-                Medicine(
-                    name='Loratadine 10mg', category='Antihistamines',
-                    price=7.50, quantity=65, min_stock_level=15,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=7)
-                ),
-                Medicine(
-                    name='Diphenhydramine 25mg', category='Antihistamines',
-                    price=6.25, quantity=4, min_stock_level=20,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=10)
-                ),
-                
-                # Respiratory
-                Medicine(
-                    name='Salbutamol Inhaler', category='Respiratory',
-                    price=18.99, quantity=28, min_stock_level=15,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=9)
-                ),
-                Medicine(
-                    name='Fluticasone Nasal Spray', category='Respiratory',
-                    price=21.50, quantity=12, min_stock_level=10,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=3)
-                ),
-                Medicine(
-                    name='Montelukast 10mg', category='Respiratory',
-                    price=19.75, quantity=0, min_stock_level=12,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=5)
-                ),
-                Medicine(
-                    name='Budesonide Inhaler', category='Respiratory',
-                    price=29.99, quantity=18, min_stock_level=8,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=8)
-                ),
-                
-                # Vitamins
-                Medicine(
-                    name='Vitamin D3 2000IU', category='Vitamins',
-                    price=12.99, quantity=95, min_stock_level=25,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 3, month=1)
-                ),
-                Medicine(
-                    name='Vitamin B Complex', category='Vitamins',
-                    price=15.50, quantity=78, min_stock_level=20,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=11)
-                ),
-                Medicine(
-                    name='Vitamin C 1000mg', category='Vitamins',
-                    price=9.99, quantity=110, min_stock_level=30,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=6)
-                ),
-                Medicine(
-                    name='Multivitamin Daily', category='Vitamins',
-                    price=18.25, quantity=6, min_stock_level=15,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=8)
-                ),
-                Medicine(
-                    name='Vitamin E 400IU', category='Vitamins',
-                    price=14.50, quantity=42, min_stock_level=12,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 3, month=3)
-                ),
-                
-                # Dermatological
-                Medicine(
-                    name='Hydrocortisone Cream 1%', category='Dermatological',
-                    price=11.99, quantity=25, min_stock_level=10,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=10)
-                ),
-                Medicine(
-                    name='Clotrimazole Cream 1%', category='Dermatological',
-                    price=9.25, quantity=9, min_stock_level=12,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=6)
-                ),
-                Medicine(
-                    name='Benzoyl Peroxide Gel 2.5%', category='Dermatological',
-                    price=12.75, quantity=0, min_stock_level=8,
-                    expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=2)
-                ),
-                
-                # Some soon-to-expire medicines
-                Medicine(
-                    name='Expiring Soon Antibiotic', category='Antibiotics',
-                    price=13.99, quantity=8, min_stock_level=10,
-                    expiry_date=datetime.now().date() + timedelta(days=15)
-                ),
-                Medicine(
-                    name='Expiring This Week', category='Pain Relief',
-                    price=5.49, quantity=12, min_stock_level=10,
-                    expiry_date=datetime.now().date() + timedelta(days=5)
-                ),
-                
-                # Already expired medicines
-                Medicine(
-                    name='Expired Medication', category='Other',
-                    price=9.99, quantity=3, min_stock_level=5,
-                    expiry_date=datetime.now().date() - timedelta(days=30)
-                )
-            ]
-            
-            db.session.bulk_save_objects(medicines)
-            try:
-                db.session.commit()
-                print("Sample medicines added to database.")
-            except Exception as e:
-                db.session.rollback()
-                print(f"Error adding sample medicines: {e}")
-                
-            # Now generate sales data spanning multiple months
-            print("Adding sample sales data...")
-            
-            # Get all medicines
-            all_medicines = Medicine.query.all()
-            if all_medicines:
-                sales = []
-                
-                # Generate sales spanning the last 6 months with current year
-                end_date = datetime.now()
-                start_date = end_date - timedelta(days=180)
-                current_date = start_date
-                
-                # Customer name options
-                customer_names = [
-                    "John Smith", "Jane Doe", "Michael Johnson", "Emily Williams", 
-                    "David Brown", "Sarah Miller", "Robert Jones", "Jennifer Davis",
-                    "William Garcia", "Lisa Rodriguez", "Mark Wilson", "Patricia Martinez",
-                    "Thomas Anderson", "Nancy Thompson", "Walk-in Customer", None  # Include some None/Walk-ins
-                ]
-                
-                # Create random sales across the date range
-                while current_date <= end_date:
-                    # Generate between 0-8 sales per day with higher volume on weekdays
-                    if current_date.weekday() < 5:  # Weekday (0-4)
-                        num_sales = random.randint(3, 8)
-                    else:  # Weekend (5-6)
-                        num_sales = random.randint(0, 5)
-                    
-                    for _ in range(num_sales):
-                        # Choose random medicine and quantity
-                        medicine = random.choice(all_medicines)
-                        
-                        # Make popular medicines sell more
-                        is_popular = medicine.category in ['Pain Relief', 'Antibiotics', 'Vitamins']
-                        
-                        if is_popular:
-                            max_qty = 5
-                        else:
-                            max_qty = 3
-                            
-                        quantity = random.randint(1, max_qty)
-                        
-                        # Create sale with slight price variation sometimes
-                        price_variation = random.uniform(0.95, 1.05)
-                        sale_price = medicine.price * price_variation
-                        
-                        # Random time during business hours (8 AM - 8 PM)
-                        hour = random.randint(8, 20)
-                        minute = random.randint(0, 59)
-                        second = random.randint(0, 59)
-                        sale_datetime = datetime.combine(
-                            current_date.date(), 
-                            time(hour, minute, second)
-                        )
-                        
-                        # Random customer name or None
-                        customer = random.choice(customer_names)
-                        
-                        # Create a sale record with all medicine information captured at sale time
-                        sale = Sale(
-                            medicine_id=medicine.id,  # Still store the ID for reference
-                            medicine_name=medicine.name,  # Store the name at time of sale
-                            medicine_category=medicine.category,  # Store the category at time of sale
-                            quantity=quantity,
-                            sale_price=round(sale_price, 2),
-                            customer_name=customer,
-                            sale_date=sale_datetime
-                        )
-                        
-                        sales.append(sale)
-                    
-                    # Move to next day
-                    current_date += timedelta(days=1)
-                
-                # Add special sales patterns
-                # 1. Holiday/promotion spike (within the last 30 days)
-                holiday_date = end_date - timedelta(days=random.randint(7, 30))
-                for _ in range(25):  # Extra sales during promotion
-                    medicine = random.choice(all_medicines)
-                    quantity = random.randint(1, 5)
-                    hour = random.randint(8, 20)
-                    minute = random.randint(0, 59)
-                    holiday_datetime = datetime.combine(
-                        holiday_date.date(), 
-                        time(hour, minute, random.randint(0, 59))
-                    )
-                    
-                    sale = Sale(
-                        medicine_id=medicine.id,
-                        medicine_name=medicine.name,  # Store name at time of sale
-                        medicine_category=medicine.category,  # Store category at time of sale
-                        quantity=quantity,
-                        sale_price=round(medicine.price * 0.9, 2),  # 10% discount
-                        customer_name=random.choice(customer_names),
-                        sale_date=holiday_datetime
-                    )
-                    sales.append(sale)
-                
-                db.session.bulk_save_objects(sales)
-                try:
-                    db.session.commit()
-                    print(f"Added {len(sales)} sample sales spanning multiple months.")
-                except Exception as e:
-                    db.session.rollback()
-                    print(f"Error adding sample sales: {e}")
+SNAPSHOT_COLUMNS = [Medicine.id, Medicine.store_id, Medicine.name, Medicine.category, Medicine.price, Medicine.quantity,
+                    Medicine.min_stock_level, Medicine.expiry_date, Medicine.created_at, Medicine.updated_at]
 
-    
+class InventorySnapshot:
+    """Process-wide list of MedicineSnapshot rows shared by the read-only views.
 
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    if request.method == 'POST':
-        username = request.form['username']
-        password = request.form['password']
-        
-        user = User.query.filter_by(username=username).first()
-        
-        if user and check_password_hash(user.password, password):
-            # Use Flask-Login's login_user function
-            login_user(user)
-            
-            # Still set session variables if your code needs them elsewhere
-            session['user_type'] = user.user_type
+    Commits made through db.session mark the medicines they touched, and the
+    next read reloads just those rows. Whenever PRAGMA data_version shows
+    that any connection committed, the next read also reloads rows whose
+    updated_at is after the previous check, less CATCH_UP_MARGIN for writes
+    that flushed well before they committed; a row count that no
+    longer matches means a delete and a full reload. Bulk UPDATE/DELETE
+    statements and a snapshot older than `max_age` seconds reload everything.
+
+    The list returned by medicines() is replaced, never modified, so callers
+    can iterate it without holding the lock. Per-store lists are filtered
+    from it on first use and dropped whenever it changes.
+    """
+
+    CATCH_UP_MARGIN = timedelta(seconds=60)
+
+    def __init__(self, app, max_age):
+        self.app = app
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._rows = None
+        self._ordered = []
+        self._by_store = {}
+        self._version = 0
+        self._dirty_ids = set()
+        self._reload = True
+        self._catch_up = False
+        self._checked_at = None
+        self._loaded_at = 0.0
+        self._data_version = None
+        self._version_connection = None
+
+    def mark_changed(self, medicine_ids=(), reload=False):
+        """Record medicines changed by this process, reloaded on the next read."""
+        with self._lock:
+            self._dirty_ids.update(medicine_ids)
+            self._reload = self._reload or reload
+
+    def medicines(self, store_id=None):
+        """Every medicine, or one store's, ordered by id, refreshed first if anything changed."""
+        return self.versioned_medicines(store_id)[1]
+
+    def versioned_medicines(self, store_id=None):
+        """Like medicines(), paired with a version number that changes whenever the list does.
+
+        Returns:
+            Tuple of (version, medicines), read together so a cache keyed
+            by the version never pairs it with another version's rows
+        """
+        with self._lock:
+            if time_module.monotonic() - self._loaded_at > self.max_age:
+                self._reload = True
+            if self._database_changed():
+                self._catch_up = True
+            if self._reload or self._rows is None:
+                self._load_all()
+            elif self._dirty_ids or self._catch_up:
+                self._load_changed()
+            if store_id is None:
+                return self._version, self._ordered
+            if store_id not in self._by_store:
+                self._by_store[store_id] = [medicine for medicine in self._ordered if medicine.store_id == store_id]
+            return self._version, self._by_store[store_id]
+
+    def close(self):
+        with self._lock:
+            if self._version_connection is not None:
+                self._version_connection.close()
+                self._version_connection = None
+
+    def _database_changed(self):
+        # data_version changes whenever any other connection commits, to
+        # any table. Which medicines changed, if any, is left to updated_at.
+        connection = self._data_version_connection()
+        if connection is None:
+            return False
+        version = connection.execute('PRAGMA data_version').fetchone()[0]
+        changed = self._data_version is not None and version != self._data_version
+        self._data_version = version
+        return changed
+
+    def _data_version_connection(self):
+        if self._version_connection is None:
+            url = db.engine.url
+            if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:') \
+                    or url.database.startswith('file:'):
+                return None
+            self._version_connection = sqlite3.connect(url.database, check_same_thread=False)
+        return self._version_connection
+
+    def _load_all(self):
+        checked_at = datetime.utcnow()
+        with report_session() as reports:
+            self._rows = {row[0]: MedicineSnapshot(*row)
+                          for row in reports.execute(select(*SNAPSHOT_COLUMNS)).all()}
+        self._dirty_ids.clear()
+        self._reload = False
+        self._catch_up = False
+        self._loaded_at = time_module.monotonic()
+        self._checked_at = checked_at
+        self._ordered = sorted(self._rows.values(), key=lambda medicine: medicine.id)
+        self._by_store = {}
+        self._version += 1
+
+    def _load_changed(self):
+        changed_ids = list(self._dirty_ids)
+        rows = dict(self._rows)
+        changed = bool(changed_ids)
+        checked_at = datetime.utcnow()
+        with report_session() as reports:
+            for start in range(0, len(changed_ids), 500):
+                chunk = changed_ids[start:start + 500]
+                for medicine_id in chunk:
+                    rows.pop(medicine_id, None)
+                for row in reports.execute(select(*SNAPSHOT_COLUMNS).where(Medicine.id.in_(chunk))).all():
+                    rows[row[0]] = MedicineSnapshot(*row)
+            if self._catch_up:
+                query = select(*SNAPSHOT_COLUMNS).where(Medicine.updated_at >= self._checked_at - self.CATCH_UP_MARGIN)
+                for row in reports.execute(query).all():
+                    current = rows.get(row[0])
+                    if current is None or current.updated_at != row[-1]:
+                        rows[row[0]] = MedicineSnapshot(*row)
+                        changed = True
+                count = reports.execute(select(func.count()).select_from(Medicine)).scalar()
+        if self._catch_up and count != len(rows):
+            # Deletes leave no updated_at behind
+            self._load_all()
+            return
+        self._dirty_ids.clear()
+        if self._catch_up:
+            self._checked_at = checked_at
+            self._catch_up = False
+        if not changed:
+            return  # commits to other tables keep the version, and the caches keyed by it
+        self._rows = rows
+        self._ordered = sorted(rows.values(), key=lambda medicine: medicine.id)
+        self._by_store = {}
+        self._version += 1
+
+def inventory_snapshot():
+    return current_app.extensions['inventory_snapshot']
+
+# Track Medicine changes per session and hand them to the snapshot on commit.
+# Rolled-back changes are reloaded too, in case a read saw them before the rollback.
+def pending_inventory_changes(session):
+    return session.info.setdefault('inventory_changes', {'ids': set(), 'reload': False})
+
+@event.listens_for(db.session, 'after_flush')
+def track_medicine_changes(session, flush_context):
+    changed_ids = {obj.id for obj in (*session.new, *session.dirty, *session.deleted)
+                   if isinstance(obj, Medicine)}
+    if changed_ids:
+        pending_inventory_changes(session)['ids'].update(changed_ids)
+
+@event.listens_for(db.session, 'do_orm_execute')
+def track_bulk_medicine_changes(orm_execute_state):
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) \
+            and orm_execute_state.bind_mapper is not None \
+            and orm_execute_state.bind_mapper.class_ is Medicine:
+        pending_inventory_changes(orm_execute_state.session)['reload'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def publish_medicine_changes(session):
+    changes = session.info.pop('inventory_changes', {'ids': (), 'reload': False})
+    snapshot = current_app.extensions.get('inventory_snapshot')
+    if snapshot is not None:
+        snapshot.mark_changed(changes['ids'], changes['reload'])
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_medicine_changes(session, previous_transaction):
+    changes = session.info.pop('inventory_changes', None)
+    snapshot = current_app.extensions.get('inventory_snapshot')
+    if changes and snapshot is not None:
+        snapshot.mark_changed(changes['ids'], changes['reload'])
+
+# Write change log entries in the same transaction as the flush that made
+# them. SQLite serialises write transactions, so seq order is commit order.
+CHANGE_LOGGED_MODELS = (Medicine, Sale)
+
+def change_log_row(obj, operation, changed_at):
+    payload = {attr.key: getattr(obj, attr.key) for attr in sa_inspect(obj).mapper.column_attrs}
+    return {
+        'table_name': obj.__table__.name,
+        'row_id': obj.id,
+        'store_id': obj.store_id,
+        'operation': operation,
+        'payload': json.dumps(payload, default=str),
+        'changed_at': changed_at,
+    }
+
+def log_changes(session, objects, operation):
+    """Append change log entries for rows changed outside the unit of work, e.g. by a bulk UPDATE."""
+    changed_at = datetime.utcnow()
+    rows = [change_log_row(obj, operation, changed_at) for obj in objects]
+    if rows:
+        session.execute(ChangeLogEntry.__table__.insert(), rows)
+
+@event.listens_for(db.session, 'after_flush')
+def capture_row_changes(session, flush_context):
+    changed_at = datetime.utcnow()
+    rows = []
+    for operation, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            if not isinstance(obj, CHANGE_LOGGED_MODELS):
+                continue
+            if operation == 'update' and not session.is_modified(obj, include_collections=False):
+                continue
+            rows.append(change_log_row(obj, operation, changed_at))
+    if rows:
+        session.connection().execute(ChangeLogEntry.__table__.insert(), rows)
+
+# Write live events as rows are flushed, in the same transaction, so a
+# write that rolls back (or a SAVEPOINT the single writer rolls back)
+# takes its events with it. Streams in this process are woken once the
+# outer transaction commits; other processes pick the events up by polling.
+ALERT_STATUSES = ('low_stock', 'out_of_stock')
+
+def previous_value(state, key):
+    history = state.attrs[key].history
+    return history.deleted[0] if history.deleted else getattr(state.obj(), key)
+
+def live_event_row(name, data, store_id):
+    return {'name': name, 'data': json.dumps(data), 'store_id': store_id, 'created_at': datetime.utcnow()}
+
+def write_live_events(session, events):
+    session.connection().execute(LiveEvent.__table__.insert(), [live_event_row(*event) for event in events])
+    session.info['live_events_written'] = True
+
+@event.listens_for(db.session, 'after_flush')
+def queue_live_events(session, flush_context):
+    events = []
+    for obj in session.new:
+        if isinstance(obj, Sale):
+            events.append(('sale', {
+                'sale_id': obj.id,
+                'medicine_name': obj.medicine_name,
+                'quantity': obj.quantity,
+                'total': round(obj.total_price, 2),
+            }, obj.store_id))
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if not isinstance(obj, Medicine):
+            continue
+        state = sa_inspect(obj)
+        previous = None
+        if obj not in session.new:
+            previous = stock_status_of(previous_value(state, 'quantity'), previous_value(state, 'min_stock_level'))
+        status = 'removed' if obj in session.deleted else stock_status_of(obj.quantity, obj.min_stock_level)
+        if status != previous and (status in ALERT_STATUSES or previous in ALERT_STATUSES):
+            events.append(('alert', {
+                'medicine_id': obj.id,
+                'medicine_name': obj.name,
+                'medicine_category': obj.category,
+                'quantity': obj.quantity,
+                'min_stock_level': obj.min_stock_level,
+                'status': status,
+                'previous_status': previous,
+            }, obj.store_id))
+    if events:
+        write_live_events(session, events)
+
+@event.listens_for(db.session, 'do_orm_execute')
+def queue_bulk_resync(orm_execute_state):
+    # Bulk statements change rows without flushing them, so clients reload
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) \
+            and orm_execute_state.bind_mapper is not None \
+            and orm_execute_state.bind_mapper.class_ in (Medicine, Sale):
+        write_live_events(orm_execute_state.session, [('resync', {}, None)])
+
+@event.listens_for(db.session, 'after_commit')
+def publish_live_events(session):
+    if session.in_nested_transaction():
+        return  # a SAVEPOINT was released; the outer transaction can still roll back
+    broker = current_app.extensions.get('event_broker')
+    if session.info.pop('live_events_written', False) and broker is not None:
+        broker.notify()
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_live_events(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('live_events_written', None)
+
+def normalize_customer_name(name):
+    """Collapse whitespace in a typed customer name; blank names become None."""
+    return ' '.join((name or '').split()) or None
+
+def record_customer_sale(connection, sale):
+    """Add a sale to its customer's lifetime totals, creating the customer on first purchase.
+
+    Returns:
+        The customer's id
+    """
+    revenue = sale.quantity * sale.sale_price
+    customer_insert = sqlite_insert(Customer).values(
+        name=sale.customer_name,
+        lifetime_purchases=1,
+        lifetime_units=sale.quantity,
+        lifetime_revenue=revenue,
+        first_purchase_at=sale.sale_date,
+        last_purchase_at=sale.sale_date,
+    )
+    return connection.execute(customer_insert.on_conflict_do_update(
+        index_elements=[Customer.name],
+        set_={
+            'lifetime_purchases': Customer.lifetime_purchases + 1,
+            'lifetime_units': Customer.lifetime_units + sale.quantity,
+            'lifetime_revenue': Customer.lifetime_revenue + revenue,
+            'first_purchase_at': func.min(func.coalesce(Customer.first_purchase_at, sale.sale_date), sale.sale_date),
+            'last_purchase_at': func.max(func.coalesce(Customer.last_purchase_at, sale.sale_date), sale.sale_date),
+        }
+    ).returning(Customer.id)).scalar_one()
+
+def customer_name_starts_with(prefix):
+    """Case-insensitive prefix match on Customer.name.
+
+    The pattern is bound as one parameter so SQLite turns the LIKE into a
+    range scan of the NOCASE name index.
+    """
+    pattern = prefix.replace('/', '//').replace('%', '/%').replace('_', '/_') + '%'
+    return Customer.name.like(pattern, escape='/')
+
+@event.listens_for(db.session, 'before_flush')
+def link_sale_customers(session, flush_context, instances):
+    # Runs for every new sale whatever created it, so the link and the
+    # totals commit or roll back with the sale
+    for obj in session.new:
+        if isinstance(obj, Sale) and obj.customer_id is None:
+            obj.customer_name = normalize_customer_name(obj.customer_name)
+            if obj.customer_name is None:
+                continue
+            if obj.sale_date is None:
+                obj.sale_date = datetime.utcnow()
+            obj.customer_id = record_customer_sale(session.connection(), obj)
+
+def rebuild_customers():
+    """Create customers for unlinked named sales, archived ones included, link them and recompute every customer's totals.
+
+    Returns:
+        Number of customers
+    """
+    def rebuild():
+        sales = sales_since(db.session)
+        sale_customer_name = func.trim(sales.customer_name)
+        db.session.execute(sqlite_insert(Customer).from_select(
+            ['name'],
+            select(func.min(sale_customer_name)).where(
+                sales.customer_id.is_(None), sale_customer_name != ''
+            ).group_by(sale_customer_name.collate('NOCASE'))
+        ).on_conflict_do_nothing())
+        for table in (Sale.__table__, archived_sale_table):
+            table_customer_name = func.trim(table.c.customer_name)
+            db.session.execute(update(table).where(
+                table.c.customer_id.is_(None), table_customer_name != ''
+            ).values(customer_id=select(Customer.id).where(Customer.name == table_customer_name).scalar_subquery()))
+
+        totals = select(
+            sales.customer_id,
+            func.count().label('purchases'),
+            func.sum(sales.quantity).label('units'),
+            func.sum(sales.quantity * sales.sale_price).label('revenue'),
+            func.min(sales.sale_date).label('first_purchase_at'),
+            func.max(sales.sale_date).label('last_purchase_at'),
+        ).where(sales.customer_id.isnot(None)).group_by(sales.customer_id).subquery()
+        db.session.execute(update(Customer).values(
+            lifetime_purchases=0, lifetime_units=0, lifetime_revenue=0.0,
+            first_purchase_at=None, last_purchase_at=None))
+        db.session.execute(update(Customer).where(Customer.id == totals.c.customer_id).values(
+            lifetime_purchases=totals.c.purchases,
+            lifetime_units=totals.c.units,
+            lifetime_revenue=totals.c.revenue,
+            first_purchase_at=totals.c.first_purchase_at,
+            last_purchase_at=totals.c.last_purchase_at,
+        ), execution_options={'synchronize_session': False})
+        db.session.commit()
+
+    run_with_lock_retry(rebuild)
+    return Customer.query.count()
+
+def stale_chart_series(session):
+    return session.info.setdefault('stale_chart_series', set())
+
+@event.listens_for(db.session, 'after_flush')
+def mark_chart_series_stale(session, flush_context):
+    stale = stale_chart_series(session)
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Sale):
+            stale.add((SALES_CHART_SERIES, obj.store_id))
+        elif isinstance(obj, Medicine):
+            stale.add((INVENTORY_CHART_SERIES, obj.store_id))
+
+@event.listens_for(db.session, 'do_orm_execute')
+def mark_bulk_chart_series_stale(orm_execute_state):
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) \
+            and orm_execute_state.bind_mapper is not None:
+        model = orm_execute_state.bind_mapper.class_
+        if model in (Medicine, Sale):
+            series = SALES_CHART_SERIES if model is Sale else INVENTORY_CHART_SERIES
+            stale_chart_series(orm_execute_state.session).add((series, None))
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_chart_series(session):
+    if session.in_nested_transaction():
+        return
+    stale = session.info.pop('stale_chart_series', None)
+    chart_cache = current_app.extensions.get('chart_cache')
+    if stale and chart_cache is not None:
+        for series, store_id in stale:
+            chart_cache.invalidate(series, store_id)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_stale_chart_series(session, previous_transaction):
+    # Series marked inside a rolled-back savepoint are still dropped on
+    # commit, which costs a recomputation but is never wrong
+    if not previous_transaction.nested:
+        session.info.pop('stale_chart_series', None)
+
+@event.listens_for(db.metadata, 'after_create')
+@event.listens_for(db.metadata, 'after_drop')
+def reload_after_schema_change(target, connection, **kw):
+    snapshot = current_app.extensions.get('inventory_snapshot')
+    if snapshot is not None:
+        snapshot.mark_changed(reload=True)
+    # Row ids such as the stock check keying the alert fragment start over,
+    # and cached chart series describe the old tables
+    for name in ('fragment_cache', 'chart_cache'):
+        cache = current_app.extensions.get(name)
+        if cache is not None:
+            cache.clear()
+
+def create_missing_indexes():
+    """Create indexes that were added to existing tables after they were first created.
+
+    create_all() only builds indexes for tables it creates itself.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def add_missing_columns():
+    """Add columns that were added to existing tables after they were first created.
+
+    create_all() never alters a table that already exists. Existing rows get
+    the column's server default, e.g. the default store for store_id.
+
+    Returns:
+        The added columns as 'table.column' names
+    """
+    added = []
+    inspector = sa_inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in inspector.get_table_names(schema=table.schema):
+                continue
+            present = {column['name'] for column in inspector.get_columns(table.name, schema=table.schema)}
+            for column in table.columns:
+                if column.name in present:
+                    continue
+                ddl = (f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.quote(column.name)} '
+                       f'{column.type.compile(db.engine.dialect)}')
+                if column.server_default is not None:
+                    ddl += f" NOT NULL DEFAULT '{column.server_default.arg}'" if not column.nullable \
+                        else f" DEFAULT '{column.server_default.arg}'"
+                connection.execute(text(ddl))
+                added.append(f'{table.fullname}.{column.name}')
+    return added
+
+def init_db():
+    """Create all tables, the default store and the default user accounts if none exist yet.
+
+    Returns:
+        True if default users were created, False if users already existed
+    """
+    db.create_all()
+    added_columns = add_missing_columns()
+    create_missing_indexes()
+    with db.engine.begin() as connection:
+        create_medicine_triggers(Medicine.__table__, connection)
+    if 'sale.customer_id' in added_columns:
+        # Link the sales recorded before customers existed
+        rebuild_customers()
+    if 'change_log.store_id' in added_columns:
+        # Older entries carry the branch only inside their payload
+        ChangeLogEntry.query.update({ChangeLogEntry.store_id: func.json_extract(ChangeLogEntry.payload, '$.store_id')},
+                                    synchronize_session=False)
+        db.session.commit()
+
+    if db.session.get(Store, DEFAULT_STORE_ID) is None:
+        db.session.add(Store(id=DEFAULT_STORE_ID, code='MAIN', name='Main Branch'))
+        db.session.commit()
+
+    if User.query.count() > 0:
+        return False
+
+    # Create default users
+    pharmacist = User(
+        username='pharmacist',
+        password=generate_password_hash('pharmacist123'),
+        user_type='pharmacist',
+        email='pharmacist@example.com'
+    )
+    db.session.add(pharmacist)
+    
+    manager = User(
+        username='manager',
+        password=generate_password_hash('manager123'),
+        user_type='store_manager',
+        email='manager@example.com'
+    )
+    db.session.add(manager)
+    
+    cashier = User(
+        username='cashier',
+        password=generate_password_hash('cashier123'),
+        user_type='cashier',
+        email='cashier@example.com'
+    )
+    db.session.add(cashier)
+    
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return True
+
+def seed_sample_data():
+    """Add sample medicines and six months of sales if the inventory is empty.
+
+    Returns:
+        Tuple of (medicines_added, sales_added)
+    """
+    if Medicine.query.count() > 0:
+        return 0, 0
+
+    # Generate a variety of medicines across categories with different stock levels
+    medicines = [
+        # Antibiotics
+        Medicine(
+            name='Amoxicillin 500mg', category='Antibiotics',
+            price=12.50, quantity=50, min_stock_level=15,
+            expiry_date=datetime.now().date() + timedelta(days=365)  # One year from now
+        ),
+        Medicine(
+            name='Azithromycin 250mg', category='Antibiotics',
+            price=15.99, quantity=30, min_stock_level=10,
+            expiry_date=datetime.now().date() + timedelta(days=730)  # Two years from now
+        ),
+        Medicine(
+            name='Ciprofloxacin 500mg', category='Antibiotics',
+            price=18.75, quantity=25, min_stock_level=10,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=6)
+        ),
+        Medicine(
+            name='Doxycycline 100mg', category='Antibiotics',
+            price=9.99, quantity=5, min_stock_level=15,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=3)
+        ),
+        Medicine(
+            name='Metronidazole 400mg', category='Antibiotics',
+            price=7.25, quantity=0, min_stock_level=10,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=9)
+        ),
+
+        # Pain Relief
+        Medicine(
+            name='Paracetamol 500mg', category='Pain Relief',
+            price=5.99, quantity=120, min_stock_level=30,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 3)
+        ),
+        Medicine(
+            name='Ibuprofen 400mg', category='Pain Relief',
+            price=7.25, quantity=8, min_stock_level=25,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 2)
+        ),
+        Medicine(
+            name='Aspirin 325mg', category='Pain Relief',
+            price=4.50, quantity=90, min_stock_level=20,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=6)
+        ),
+        Medicine(
+            name='Naproxen 500mg', category='Pain Relief',
+            price=8.75, quantity=45, min_stock_level=15,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=8)
+        ),
+        Medicine(
+            name='Diclofenac Gel 1%', category='Pain Relief',
+            price=11.25, quantity=18, min_stock_level=10,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=4)
+        ),
+
+        # Cardiovascular
+        Medicine(
+            name='Lisinopril 10mg', category='Cardiovascular',
+            price=14.50, quantity=60, min_stock_level=20,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=3)
+        ),
+        Medicine(
+            name='Atorvastatin 20mg', category='Cardiovascular',
+            price=22.99, quantity=40, min_stock_level=15,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=11)
+        ),
+        Medicine(
+            name='Amlodipine 5mg', category='Cardiovascular',
+            price=12.75, quantity=3, min_stock_level=15,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=7)
+        ),
+        Medicine(
+            name='Warfarin 5mg', category='Cardiovascular',
+            price=8.50, quantity=0, min_stock_level=10,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=10)
+        ),
+        Medicine(
+            name='Metoprolol 50mg', category='Cardiovascular',
+            price=10.25, quantity=35, min_stock_level=20,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=5)
+        ),
+
+        # Antidiabetic
+        Medicine(
+            name='Metformin 500mg', category='Antidiabetic',
+            price=9.25, quantity=70, min_stock_level=25,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=8)
+        ),
+        Medicine(
+            name='Glipizide 5mg', category='Antidiabetic',
+            price=13.50, quantity=7, min_stock_level=15,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=5)
+        ),
+        Medicine(
+            name='Insulin NPH 100IU', category='Antidiabetic',
+            price=42.99, quantity=22, min_stock_level=10,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=2)
+        ),
+        Medicine(
+            name='Sitagliptin 100mg', category='Antidiabetic',
+            price=35.75, quantity=0, min_stock_level=8,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=4)
+        ),
+
+        # Antihistamines
+        Medicine(
+            name='Cetirizine 10mg', category='Antihistamines',
+            price=8.99, quantity=85, min_stock_level=20,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=9)
+        ),
+        Medicine(
+            name='Loratadine 10mg', category='Antihistamines',
+            price=7.50, quantity=65, min_stock_level=15,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=7)
+        ),
+        Medicine(
+            name='Diphenhydramine 25mg', category='Antihistamines',
+            price=6.25, quantity=4, min_stock_level=20,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=10)
+        ),
+
+        # Respiratory
+        Medicine(
+            name='Salbutamol Inhaler', category='Respiratory',
+            price=18.99, quantity=28, min_stock_level=15,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=9)
+        ),
+        Medicine(
+            name='Fluticasone Nasal Spray', category='Respiratory',
+            price=21.50, quantity=12, min_stock_level=10,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=3)
+        ),
+        Medicine(
+            name='Montelukast 10mg', category='Respiratory',
+            price=19.75, quantity=0, min_stock_level=12,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=5)
+        ),
+        Medicine(
+            name='Budesonide Inhaler', category='Respiratory',
+            price=29.99, quantity=18, min_stock_level=8,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=8)
+        ),
+
+        # Vitamins
+        Medicine(
+            name='Vitamin D3 2000IU', category='Vitamins',
+            price=12.99, quantity=95, min_stock_level=25,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 3, month=1)
+        ),
+        Medicine(
+            name='Vitamin B Complex', category='Vitamins',
+            price=15.50, quantity=78, min_stock_level=20,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=11)
+        ),
+        Medicine(
+            name='Vitamin C 1000mg', category='Vitamins',
+            price=9.99, quantity=110, min_stock_level=30,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=6)
+        ),
+        Medicine(
+            name='Multivitamin Daily', category='Vitamins',
+            price=18.25, quantity=6, min_stock_level=15,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=8)
+        ),
+        Medicine(
+            name='Vitamin E 400IU', category='Vitamins',
+            price=14.50, quantity=42, min_stock_level=12,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 3, month=3)
+        ),
+
+        # Dermatological
+        Medicine(
+            name='Hydrocortisone Cream 1%', category='Dermatological',
+            price=11.99, quantity=25, min_stock_level=10,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=10)
+        ),
+        Medicine(
+            name='Clotrimazole Cream 1%', category='Dermatological',
+            price=9.25, quantity=9, min_stock_level=12,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 1, month=6)
+        ),
+        Medicine(
+            name='Benzoyl Peroxide Gel 2.5%', category='Dermatological',
+            price=12.75, quantity=0, min_stock_level=8,
+            expiry_date=datetime.now().date().replace(year=datetime.now().year + 2, month=2)
+        ),
+
+        # Some soon-to-expire medicines
+        Medicine(
+            name='Expiring Soon Antibiotic', category='Antibiotics',
+            price=13.99, quantity=8, min_stock_level=10,
+            expiry_date=datetime.now().date() + timedelta(days=15)
+        ),
+        Medicine(
+            name='Expiring This Week', category='Pain Relief',
+            price=5.49, quantity=12, min_stock_level=10,
+            expiry_date=datetime.now().date() + timedelta(days=5)
+        ),
+
+        # Already expired medicines
+        Medicine(
+            name='Expired Medication', category='Other',
+            price=9.99, quantity=3, min_stock_level=5,
+            expiry_date=datetime.now().date() - timedelta(days=30)
+        )
+    ]
+
+    db.session.bulk_save_objects(medicines)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+        
+    # Now generate sales data spanning multiple months
+    all_medicines = Medicine.query.all()
+    sales = []
+    
+    # Generate sales spanning the last 6 months with current year
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=180)
+    current_date = start_date
+
+    # Customer name options
+    customer_names = [
+        "John Smith", "Jane Doe", "Michael Johnson", "Emily Williams", 
+        "David Brown", "Sarah Miller", "Robert Jones", "Jennifer Davis",
+        "William Garcia", "Lisa Rodriguez", "Mark Wilson", "Patricia Martinez",
+        "Thomas Anderson", "Nancy Thompson", "Walk-in Customer", None  # Include some None/Walk-ins
+    ]
+
+    # Create random sales across the date range
+    while current_date <= end_date:
+        # Generate between 0-8 sales per day with higher volume on weekdays
+        if current_date.weekday() < 5:  # Weekday (0-4)
+            num_sales = random.randint(3, 8)
+        else:  # Weekend (5-6)
+            num_sales = random.randint(0, 5)
+
+        for _ in range(num_sales):
+            # Choose random medicine and quantity
+            medicine = random.choice(all_medicines)
+
+            # Make popular medicines sell more
+            is_popular = medicine.category in ['Pain Relief', 'Antibiotics', 'Vitamins']
+
+            if is_popular:
+                max_qty = 5
+            else:
+                max_qty = 3
+
+            quantity = random.randint(1, max_qty)
+
+            # Create sale with slight price variation sometimes
+            price_variation = random.uniform(0.95, 1.05)
+            sale_price = medicine.price * price_variation
+
+            # Random time during business hours (8 AM - 8 PM)
+            hour = random.randint(8, 20)
+            minute = random.randint(0, 59)
+            second = random.randint(0, 59)
+            sale_datetime = datetime.combine(
+                current_date.date(), 
+                time(hour, minute, second)
+            )
+
+            # Random customer name or None
+            customer = random.choice(customer_names)
+
+            # Create a sale record with all medicine information captured at sale time
+            sale = Sale(
+                medicine_id=medicine.id,  # Still store the ID for reference
+                medicine_name=medicine.name,  # Store the name at time of sale
+                medicine_category=medicine.category,  # Store the category at time of sale
+                quantity=quantity,
+                sale_price=round(sale_price, 2),
+                customer_name=customer,
+                sale_date=sale_datetime
+            )
+
+            sales.append(sale)
+
+        # Move to next day
+        current_date += timedelta(days=1)
+
+    # Add special sales patterns
+    # 1. Holiday/promotion spike (within the last 30 days)
+    holiday_date = end_date - timedelta(days=random.randint(7, 30))
+    for _ in range(25):  # Extra sales during promotion
+        medicine = random.choice(all_medicines)
+        quantity = random.randint(1, 5)
+        hour = random.randint(8, 20)
+        minute = random.randint(0, 59)
+        holiday_datetime = datetime.combine(
+            holiday_date.date(), 
+            time(hour, minute, random.randint(0, 59))
+        )
+
+        sale = Sale(
+            medicine_id=medicine.id,
+            medicine_name=medicine.name,  # Store name at time of sale
+            medicine_category=medicine.category,  # Store category at time of sale
+            quantity=quantity,
+            sale_price=round(medicine.price * 0.9, 2),  # 10% discount
+            customer_name=random.choice(customer_names),
+            sale_date=holiday_datetime
+        )
+        sales.append(sale)
+
+    db.session.bulk_save_objects(sales)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    # bulk_save_objects() skips the flush hooks that link customers
+    rebuild_sales_counters()
+    rebuild_customers()
+    return len(medicines), len(sales)
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the database tables and default users."""
+    if init_db():
+        click.echo('Database initialized with default users.')
+    else:
+        click.echo('Database tables are up to date; users already exist.')
+
+@click.command('rebuild-sales-counters')
+@with_appcontext
+def rebuild_sales_counters_command():
+    """Recompute the per-medicine sales counters from the sales history."""
+    init_db()
+    count = rebuild_sales_counters()
+    click.echo(f'Rebuilt sales counters for {count} medicines.')
+
+@click.command('rebuild-customers')
+@with_appcontext
+def rebuild_customers_command():
+    """Link named sales to customers and recompute every customer's lifetime totals."""
+    init_db()
+    count = rebuild_customers()
+    click.echo(f'Rebuilt lifetime totals for {count} customers.')
+
+@click.command('add-store')
+@click.argument('code')
+@click.argument('name')
+@with_appcontext
+def add_store_command(code, name):
+    """Register a branch with a short CODE and display NAME."""
+    init_db()
+    if Store.query.filter_by(code=code).first() is not None:
+        raise click.ClickException(f'A store with code {code} already exists.')
+    store = Store(code=code, name=name)
+    db.session.add(store)
+    db.session.commit()
+    click.echo(f'Added store {code} with id {store.id}.')
+
+@click.command('assign-store')
+@click.argument('username')
+@click.argument('code', required=False)
+@with_appcontext
+def assign_store_command(username, code):
+    """Tie USERNAME to the branch CODE, or to head office when CODE is omitted."""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f'No user named {username}.')
+    store = None
+    if code:
+        store = Store.query.filter_by(code=code).first()
+        if store is None:
+            raise click.ClickException(f'No store with code {code}.')
+    user.store_id = store.id if store else None
+    db.session.commit()
+    click.echo(f"{username} now works at {store.name if store else 'head office'}.")
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Fingerprint and precompress the shared stylesheets and scripts."""
+    build_dir = current_app.config['ASSET_BUILD_DIR']
+    files = build_assets(current_app.static_folder, build_dir)
+    for name, hashed_name in sorted(files.items()):
+        click.echo(f'{name} -> {hashed_name}')
+    click.echo(f'Wrote {len(files)} assets and manifest.json to {build_dir}.')
+
+@click.command('seed-db')
+@with_appcontext
+def seed_db_command():
+    """Populate an empty inventory with sample medicines and sales."""
+    init_db()
+    medicine_count, sale_count = seed_sample_data()
+    if medicine_count:
+        click.echo(f'Added {medicine_count} sample medicines and {sale_count} sample sales.')
+    else:
+        click.echo('Inventory is not empty; skipping sample data.')
+
+def flash_stock_alert():
+    """Flash a warning from the latest stored stock check if any medicines in this branch need attention."""
+    stock_check = latest_stock_check()
+    if stock_check is None:
+        return
+    store_id = current_store_id()
+    if store_id is None:
+        low_stock_count, out_of_stock_count = stock_check.low_stock_count, stock_check.out_of_stock_count
+    else:
+        # The stored counts cover every branch, so count this branch's alerts
+        counts = dict(db.session.query(StockAlert.alert_type, func.count()).filter(
+            StockAlert.check_id == stock_check.id,
+            StockAlert.store_id == store_id,
+            StockAlert.alert_type.in_(['out_of_stock', 'low_stock'])
+        ).group_by(StockAlert.alert_type).all())
+        low_stock_count, out_of_stock_count = counts.get('low_stock', 0), counts.get('out_of_stock', 0)
+    if low_stock_count + out_of_stock_count > 0:
+        flash(f'Alert: {low_stock_count} medicines with low stock and {out_of_stock_count} out of stock! Check Stock Levels for details.', 'warning')
+
+@main.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        username = request.form['username']
+        password = request.form['password']
+        
+        user = User.query.filter_by(username=username).first()
+        
+        if user and check_password_hash(user.password, password):
+            # Use Flask-Login's login_user function
+            login_user(user)
+            
+            # Still set session variables if your code needs them elsewhere
+            session['user_type'] = user.user_type
             session['username'] = user.username
             session['user_id'] = user.id
             
             # Check for low stock and notify store managers on login
             if user.role == 'store_manager':
-                check_stock_and_notify()
-                
-                # Count low stock items to flash an alert
-                low_stock_count = Medicine.query.filter(
-                    Medicine.quantity > 0,
-                    Medicine.quantity < Medicine.min_stock_level
-                ).count()
-                
-                out_of_stock_count = Medicine.query.filter(
-                    Medicine.quantity <= 0
-                ).count()
-                
-                if low_stock_count > 0 or out_of_stock_count > 0:
-                    flash(f'Alert: {low_stock_count} medicines with low stock and {out_of_stock_count} out of stock! Check Stock Levels for details.', 'warning')
+                flash_stock_alert()
             
             flash('Logged in successfully!', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         else:
             flash('Invalid username or password', 'error')
     
     return render_template('login.html')
 
 # Replace the logout route
-@app.route('/logout')
+@main.route('/logout')
 def logout():
     logout_user()  # Call Flask-Login's logout function
     session.clear()
     flash('Logged out successfully!', 'success')
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 # Add this code at the top of your file after initialization
-@app.route('/')
+@main.route('/')
 def root():
     # Redirect to login if not authenticated
     if not current_user.is_authenticated:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     # Check for low stock and notify store managers on EVERY visit if they're a manager
     if current_user.role == 'store_manager':
-        check_stock_and_notify()
-        
-        # Count low stock items to flash an alert
-        low_stock_count = Medicine.query.filter(
-            Medicine.quantity > 0,
-            Medicine.quantity < Medicine.min_stock_level
-        ).count()
-        
-        out_of_stock_count = Medicine.query.filter(
-            Medicine.quantity <= 0
-        ).count()
-        
-        if low_stock_count > 0 or out_of_stock_count > 0:
-            flash(f'Alert: {low_stock_count} medicines with low stock and {out_of_stock_count} out of stock! Check Stock Levels for details.', 'warning')
+        flash_stock_alert()
     
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/index')
-@app.route('/inventory')
+@main.route('/index')
+@main.route('/inventory')
 @login_required
 def index():
-    medicines = Medicine.query.all()
+    store_id = current_store_id()
+    inventory_version, medicines = inventory_snapshot().versioned_medicines(store_id)
     now = datetime.now().date()
     
     # Calculate counts for the inventory overview chart
@@ -575,6 +2107,8 @@ def index():
     
     return render_template('index.html', 
                           medicines=medicines, 
+                          inventory_version=inventory_version,
+                          store_id=store_id,
                           now=now,
                           well_stocked_count=well_stocked_count,
                           low_stock_count=low_stock_count,
@@ -582,12 +2116,12 @@ def index():
                           total_inventory_value=total_inventory_value)
 
 # Add medicine route
-@app.route('/add_medicine', methods=['GET', 'POST'])
+@main.route('/add_medicine', methods=['GET', 'POST'])
 @login_required
 def add_medicine():
     if current_user.role != 'pharmacist':
         flash('Only pharmacists can add medicines.', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
     if request.method == 'POST':
         try:
@@ -644,8 +2178,12 @@ def add_medicine():
                 flash('Expiry date cannot be in the past', 'error')
                 return render_template('add_medicine.html', categories=MEDICINE_CATEGORIES)
                         
+            # Head-office users add to the selected branch, or the default one
+            store_id = current_store_id() or DEFAULT_STORE_ID
+            
             # Check for exact duplicates (same name, category, and expiry date)
             existing_medicine = Medicine.query.filter_by(
+                store_id=store_id,
                 name=name, 
                 category=category,
                 expiry_date=expiry_date
@@ -655,21 +2193,24 @@ def add_medicine():
                 flash(f'This exact medicine already exists with the same name, category, and expiry date.', 'error')
                 return render_template('add_medicine.html', categories=MEDICINE_CATEGORIES)
                 
-            # Create medicine object
-            medicine = Medicine(
-                name=name,
-                category=category,
-                price=price,
-                quantity=quantity,
-                min_stock_level=min_stock_level,
-                expiry_date=expiry_date
-            )
-            
-            db.session.add(medicine)
-            db.session.commit()
+            def save_medicine():
+                medicine = Medicine(
+                    store_id=store_id,
+                    name=name,
+                    category=category,
+                    price=price,
+                    quantity=quantity,
+                    min_stock_level=min_stock_level,
+                    expiry_date=expiry_date
+                )
+                db.session.add(medicine)
+                db.session.flush()
+                return medicine.id
+
+            commit_write(save_medicine)
             
             flash('Medicine added successfully!', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         except Exception as e:
             db.session.rollback()
             flash(f'Error adding medicine: {str(e)}', 'error')
@@ -678,14 +2219,14 @@ def add_medicine():
     return render_template('add_medicine.html', categories=MEDICINE_CATEGORIES)
 
 # Update medicine route
-@app.route('/update_medicine/<int:id>', methods=['GET', 'POST'])
+@main.route('/update_medicine/<int:id>', methods=['GET', 'POST'])
 @login_required
 def update_medicine(id):
     if current_user.role != 'pharmacist':
         flash('Access denied: Pharmacists only', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
         
-    medicine = Medicine.query.get_or_404(id)
+    medicine = get_store_medicine_or_404(id)
     if request.method == 'POST':
         medicine.name = request.form['name']
         # Add category validation
@@ -729,104 +2270,339 @@ def update_medicine(id):
             flash('Expiry date cannot be in the past', 'error')
             return render_template('update_medicine.html', medicine=medicine, MEDICINE_CATEGORIES=MEDICINE_CATEGORIES)
         
-        db.session.commit()
+        changes = {
+            'name': medicine.name,
+            'category': medicine.category,
+            'quantity': medicine.quantity,
+            'price': medicine.price,
+            'min_stock_level': medicine.min_stock_level,
+            'expiry_date': medicine.expiry_date,
+        }
+
+        def save_changes():
+            # Re-applied on retry because a rollback expires the pending changes
+            target = db.session.get(Medicine, id)
+            for field, value in changes.items():
+                setattr(target, field, value)
+
+        commit_write(save_changes)
         flash('Medicine updated successfully!', 'success')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     return render_template('update_medicine.html', medicine=medicine, MEDICINE_CATEGORIES=MEDICINE_CATEGORIES)
 
 # Fix route name to match navigation link
-@app.route('/remove_expired')
+@main.route('/remove_expired')
 @login_required
 def remove_expired():
     # Renamed from delete_expired to match navigation
     if current_user.role != 'store_manager':  # Use current_user for consistency
         flash('Only store managers can delete expired medicines.', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
     try:
-        expired_medicines = Medicine.query.filter(Medicine.expiry_date < datetime.now().date()).all()
-        count = len(expired_medicines)
-        
-        for medicine in expired_medicines:
-            db.session.delete(medicine)
-        
-        db.session.commit()
+        store_id = current_store_id()
+
+        def delete_expired():
+            expired_medicines = Medicine.query.filter(
+                store_condition(Medicine.store_id, store_id),
+                Medicine.expiry_date < datetime.now().date()
+            ).all()
+            
+            for medicine in expired_medicines:
+                db.session.delete(medicine)
+            
+            return len(expired_medicines)
+
+        count = commit_write(delete_expired)
         flash(f'{count} expired medicines removed successfully!', 'success')
 
     except Exception as e:
         db.session.rollback()
         flash('An error occurred while removing expired medicines.', 'error')
 
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 # Monitor stock levels
-@app.route('/stock_levels')
+STOCK_LEVEL_BUCKETS = ['out_of_stock', 'low_stock', 'well_stocked']
+STOCK_LEVELS_PAGE_SIZE = 50
+
+def stock_bucket_expression():
+    """SQL CASE giving each medicine exactly one of STOCK_LEVEL_BUCKETS."""
+    return case(
+        (Medicine.quantity <= 0, 'out_of_stock'),
+        (Medicine.quantity < Medicine.min_stock_level, 'low_stock'),
+        else_='well_stocked'
+    )
+
+def classify_stock_levels(session, pages=None, today=None, per_page=STOCK_LEVELS_PAGE_SIZE, store_id=None):
+    """Bucket every medicine by stock level and count expiries in one scan.
+
+    A CASE expression assigns each medicine its stock bucket, and window
+    functions number the rows within a bucket and attach the bucket and
+    expiry totals, so only the requested page of each bucket is returned.
+
+    Args:
+        session: Session to query with
+        pages: Dict of bucket name to 1-based page number, default page 1
+        today: Date the expiry buckets are measured from
+        per_page: Rows per bucket page
+        store_id: Branch to classify, or None for every branch
+
+    Returns:
+        Tuple of (buckets, expiring_data). buckets maps each of
+        STOCK_LEVEL_BUCKETS to a dict with 'items', 'total', 'page' and
+        'pages'; expiring_data has 'this_week', 'this_month' and 'expired' counts.
+    """
+    pages = pages or {}
+    today = today or datetime.now().date()
+    one_week_from_now = today + timedelta(days=7)
+    one_month_from_now = today + timedelta(days=30)
+
+    stock_bucket = stock_bucket_expression()
+
+    def count_all(condition):
+        return func.sum(case((condition, 1), else_=0)).over()
+
+    classified = select(
+        Medicine.id, Medicine.name, Medicine.category, Medicine.quantity,
+        Medicine.min_stock_level, Medicine.price,
+        stock_bucket.label('bucket'),
+        func.row_number().over(partition_by=stock_bucket, order_by=(Medicine.name, Medicine.id)).label('position'),
+        func.count().over(partition_by=stock_bucket).label('bucket_total'),
+        count_all(Medicine.expiry_date < today).label('expired'),
+        count_all(Medicine.expiry_date.between(today, one_week_from_now)).label('this_week'),
+        count_all((Medicine.expiry_date > one_week_from_now) &
+                  (Medicine.expiry_date <= one_month_from_now)).label('this_month'),
+    ).where(store_condition(Medicine.store_id, store_id)).subquery()
+
+    # The first row of every bucket is always kept so its total survives
+    # a page number past the end
+    page_ranges = {name: ((pages.get(name, 1) - 1) * per_page + 1, pages.get(name, 1) * per_page)
+                   for name in STOCK_LEVEL_BUCKETS}
+    rows = session.execute(
+        select(classified).where(or_(
+            classified.c.position == 1,
+            *[(classified.c.bucket == name) & classified.c.position.between(first, last)
+              for name, (first, last) in page_ranges.items()]
+        )).order_by(classified.c.bucket, classified.c.position)
+    ).all()
+
+    buckets = {name: {'items': [], 'total': 0, 'page': pages.get(name, 1), 'pages': 1}
+               for name in STOCK_LEVEL_BUCKETS}
+    expiring_data = {'this_week': 0, 'this_month': 0, 'expired': 0}
+    for row in rows:
+        bucket = buckets[row.bucket]
+        bucket['total'] = row.bucket_total
+        bucket['pages'] = max(1, -(-row.bucket_total // per_page))
+        first, last = page_ranges[row.bucket]
+        if first <= row.position <= last:
+            bucket['items'].append(row)
+        expiring_data = {'this_week': row.this_week, 'this_month': row.this_month, 'expired': row.expired}
+    return buckets, expiring_data
+
+@main.route('/stock_levels')
 @login_required
 def stock_levels():
     if current_user.role not in ['store_manager', 'pharmacist']:
         flash('You do not have permission to view stock levels.', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
-    # Get the current date for expiry comparison
-    now = datetime.now().date()
-    
-    # Define all the medicine categories
-    out_of_stock = Medicine.query.filter(Medicine.quantity <= 0).all()
-    low_stock = Medicine.query.filter(Medicine.quantity > 0, 
-                                    Medicine.quantity < Medicine.min_stock_level).all()
-    well_stocked = Medicine.query.filter(Medicine.quantity >= Medicine.min_stock_level).all()
-    
-    # Add this line to define the expired medicines
-    expired = Medicine.query.filter(Medicine.expiry_date < now).all()
-    
-    # Add this line to get medicines expiring soon (within 30 days)
-    expiring_soon = Medicine.query.filter(
-        Medicine.expiry_date >= now,
-        Medicine.expiry_date <= now + timedelta(days=30)
-    ).all()
-    
-    # Create simple data structure of expiring medicines for JS
-    expiring_data = {
-        'this_week': 0,
-        'this_month': 0,
-        'expired': len(expired)
-    }
-    
-    # Count medicines expiring this week and this month
-    one_week_from_now = now + timedelta(days=7)
-    one_month_from_now = now + timedelta(days=30)
+    pages = {name: max(request.args.get(f'{name}_page', 1, type=int), 1) for name in STOCK_LEVEL_BUCKETS}
+    buckets, expiring_data = classify_stock_levels(db.session, pages, store_id=current_store_id())
     
-    for medicine in expiring_soon:
-        if medicine.expiry_date <= one_week_from_now:
-            expiring_data['this_week'] += 1
-        elif medicine.expiry_date <= one_month_from_now:
-            expiring_data['this_month'] += 1
+    # Each bucket pages independently, keeping the others where they are
+    for name, bucket in buckets.items():
+        def page_url(page, name=name):
+            return url_for('main.stock_levels', **{**{f'{other}_page': number for other, number in pages.items()},
+                                                   f'{name}_page': page})
+        bucket['prev_url'] = page_url(bucket['page'] - 1) if bucket['page'] > 1 else None
+        bucket['next_url'] = page_url(bucket['page'] + 1) if bucket['page'] < bucket['pages'] else None
     
     return render_template('stock_levels.html', 
-                          well_stocked=well_stocked, 
-                          low_stock=low_stock, 
-                          out_of_stock=out_of_stock,
-                          expired=expired,
-                          expiring_soon=expiring_soon,
+                          buckets=buckets,
                           expiring_data=expiring_data,
-                          now=now)
+                          now=datetime.now().date())
+
+# Per-medicine sales counters
+def record_sale_counters(sale):
+    """Add a sale to its medicine's counters and daily bucket.
+
+    Must run inside the transaction that inserts the sale, so the counters
+    commit or roll back together with it.
+    """
+    if sale.sale_date is None:
+        sale.sale_date = datetime.utcnow()
+    revenue = sale.quantity * sale.sale_price
+
+    counter_insert = sqlite_insert(MedicineSalesCounter).values(
+        medicine_id=sale.medicine_id,
+        store_id=sale.store_id,
+        medicine_name=sale.medicine_name,
+        medicine_category=sale.medicine_category,
+        lifetime_units=sale.quantity,
+        lifetime_revenue=revenue,
+        window_units=sale.quantity,
+        window_revenue=revenue,
+        last_sale_at=sale.sale_date
+    )
+    db.session.execute(counter_insert.on_conflict_do_update(
+        index_elements=[MedicineSalesCounter.medicine_id],
+        set_={
+            'medicine_name': counter_insert.excluded.medicine_name,
+            'medicine_category': counter_insert.excluded.medicine_category,
+            'lifetime_units': MedicineSalesCounter.lifetime_units + sale.quantity,
+            'lifetime_revenue': MedicineSalesCounter.lifetime_revenue + revenue,
+            'window_units': MedicineSalesCounter.window_units + sale.quantity,
+            'window_revenue': MedicineSalesCounter.window_revenue + revenue,
+            'last_sale_at': counter_insert.excluded.last_sale_at,
+        }
+    ))
+
+    daily_insert = sqlite_insert(MedicineDailySales).values(
+        medicine_id=sale.medicine_id,
+        sale_day=sale.sale_date.date(),
+        units=sale.quantity,
+        revenue=revenue
+    )
+    db.session.execute(daily_insert.on_conflict_do_update(
+        index_elements=[MedicineDailySales.medicine_id, MedicineDailySales.sale_day],
+        set_={
+            'units': MedicineDailySales.units + sale.quantity,
+            'revenue': MedicineDailySales.revenue + revenue,
+        }
+    ))
+
+def refresh_sales_window_counters():
+    """Recompute the rolling-window columns from the daily buckets.
+
+    Sales only ever add to the window columns, so this periodically drops
+    the days that have aged out of the window.
+    """
+    cutoff = datetime.utcnow().date() - timedelta(days=current_app.config['SALES_COUNTER_WINDOW_DAYS'] - 1)
+
+    def window_sum(column):
+        return select(func.coalesce(func.sum(column), 0)).where(
+            MedicineDailySales.medicine_id == MedicineSalesCounter.medicine_id,
+            MedicineDailySales.sale_day >= cutoff
+        ).scalar_subquery()
+
+    def refresh():
+        db.session.execute(update(MedicineSalesCounter).values(
+            window_units=window_sum(MedicineDailySales.units),
+            window_revenue=window_sum(MedicineDailySales.revenue)
+        ))
+        db.session.commit()
+
+    run_with_lock_retry(refresh)
+
+def rebuild_sales_counters():
+    """Recompute every counter and daily bucket from the sales history, archive included.
+
+    Returns:
+        Number of medicines with counters
+    """
+    def rebuild():
+        MedicineDailySales.query.delete()
+        MedicineSalesCounter.query.delete()
+        sales = sales_since(db.session)
+        sale_day = func.date(sales.sale_date)
+
+        db.session.execute(MedicineDailySales.__table__.insert().from_select(
+            ['medicine_id', 'sale_day', 'units', 'revenue'],
+            select(sales.medicine_id, sale_day, func.sum(sales.quantity),
+                   func.sum(sales.quantity * sales.sale_price))
+            .where(sales.medicine_id.isnot(None))
+            .group_by(sales.medicine_id, sale_day)
+        ))
+        db.session.execute(MedicineSalesCounter.__table__.insert().from_select(
+            ['medicine_id', 'store_id', 'medicine_name', 'medicine_category', 'lifetime_units',
+             'lifetime_revenue', 'window_units', 'window_revenue', 'last_sale_at'],
+            select(sales.medicine_id, func.max(sales.store_id), func.max(sales.medicine_name),
+                   func.max(sales.medicine_category), func.sum(sales.quantity),
+                   func.sum(sales.quantity * sales.sale_price), literal(0), literal(0.0), func.max(sales.sale_date))
+            .where(sales.medicine_id.isnot(None))
+            .group_by(sales.medicine_id)
+        ))
+        db.session.commit()
+
+    run_with_lock_retry(rebuild)
+    refresh_sales_window_counters()
+    return MedicineSalesCounter.query.count()
+
+def top_selling_medicines(limit=5, by='units', window=False, session=None, store_id=None):
+    """Top-N medicines read straight off the indexed counter columns.
+
+    Args:
+        limit: Number of medicines to return
+        by: 'units' or 'revenue'
+        window: Rank by the rolling window instead of lifetime totals
+        session: Session to query with, defaults to db.session
+        store_id: Branch to rank, or None for every branch
+    """
+    prefix = 'window' if window else 'lifetime'
+    column = getattr(MedicineSalesCounter, f'{prefix}_{by}')
+    session = session or db.session
+    return session.query(MedicineSalesCounter).filter(
+        store_condition(MedicineSalesCounter.store_id, store_id), column > 0
+    ).order_by(column.desc()).limit(limit).all()
+
+def sell_medicine(medicine_id, quantity, customer_name=''):
+    """Record a sale and take its quantity out of stock in one write.
+
+    Stock is checked again inside the write, so two tills cannot sell the
+    same last units.
+
+    Returns:
+        The new sale's id
+
+    Raises:
+        ValueError: If the medicine no longer exists or has too little stock
+    """
+    def record_sale():
+        medicine = db.session.get(Medicine, medicine_id)
+        if medicine is None:
+            raise ValueError('Medicine not found')
+        if medicine.quantity < quantity:
+            raise ValueError(f"Insufficient stock. Available: {medicine.quantity} units")
+
+        # Create a sale record with all medicine information captured at sale time
+        sale = Sale(
+            medicine_id=medicine.id,
+            store_id=medicine.store_id,
+            medicine_name=medicine.name,
+            medicine_category=medicine.category,
+            quantity=quantity,
+            sale_price=medicine.price,
+            customer_name=customer_name
+        )
+        
+        # Update inventory
+        medicine.quantity -= quantity
+        
+        db.session.add(sale)
+        record_sale_counters(sale)
+        db.session.flush()
+        return sale.id
+
+    return commit_write(record_sale)
 
 # Fix route for sale creation - check for insufficient stock
-@app.route('/sale', methods=['GET', 'POST'])
+@main.route('/sale', methods=['GET', 'POST'])
 @login_required
 def create_sale():
     if current_user.role not in ['cashier', 'pharmacist']:
         flash('You do not have permission to make sales.', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
-    medicines = Medicine.query.all()
+    store_id = current_store_id()
+    medicines = inventory_snapshot().medicines(store_id)
     
     if request.method == 'POST':
         medicine_id = request.form.get('medicine_id')
         customer_name = request.form.get('customer_name', '')
         
         medicine = Medicine.query.get(medicine_id)
-        if not medicine:
+        if not medicine or (store_id is not None and medicine.store_id != store_id):
             flash('Medicine not found', 'error')
             return render_template('create_sale.html', medicines=medicines)
         
@@ -850,361 +2626,2440 @@ def create_sale():
             flash("Please enter a valid quantity", 'error')
             return render_template('create_sale.html', medicines=medicines)
         
-        # Create a sale record with all medicine information captured at sale time
-        sale = Sale(
-            medicine_id=medicine.id,
-            medicine_name=medicine.name,
-            medicine_category=medicine.category,
-            quantity=quantity,
-            sale_price=medicine.price,
-            customer_name=customer_name
-        )
-        
-        # Update inventory
-        medicine.quantity -= quantity
-        
         try:
-            db.session.add(sale)
-            db.session.commit()
+            sell_medicine(medicine.id, quantity, customer_name)
             flash('Sale completed successfully', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e), 'error')
         except Exception as e:
             db.session.rollback()
             flash('Error processing sale', 'error')
     
     return render_template('create_sale.html', medicines=medicines)
 
-# Reports dashboard
-@app.route('/reports')
-@login_required
-def reports_dashboard():
-    if current_user.role != 'store_manager':
-        flash('Only store managers can access reports.', 'error')
-        return redirect(url_for('index'))
+# Reports dashboard
+@main.route('/reports')
+@login_required
+def reports_dashboard():
+    if current_user.role != 'store_manager':
+        flash('Only store managers can access reports.', 'error')
+        return redirect(url_for('main.index'))
+
+    return render_template('reports_dashboard.html')
+
+# Inventory status report
+def inventory_by_category(today=None, store_id=None):
+    """Stock, expiry and value figures per category from one aggregate query.
+
+    Every figure is a conditional sum over the same GROUP BY, so one scan of
+    Medicine in one read transaction produces the whole report and the
+    figures always agree with each other.
+
+    Returns:
+        List of dicts, one per category, with 'category', 'count',
+        'out_of_stock', 'low_stock', 'well_stocked', 'expired',
+        'expiring_soon' and 'value'
+    """
+    today = today or datetime.now().date()
+    stock_bucket = stock_bucket_expression()
+
+    def count_where(condition):
+        return func.sum(case((condition, 1), else_=0))
+
+    with report_session() as reports:
+        rows = reports.execute(
+            select(
+                Medicine.category,
+                func.count(Medicine.id).label('count'),
+                count_where(stock_bucket == 'out_of_stock').label('out_of_stock'),
+                count_where(stock_bucket == 'low_stock').label('low_stock'),
+                count_where(stock_bucket == 'well_stocked').label('well_stocked'),
+                count_where(Medicine.expiry_date < today).label('expired'),
+                count_where(Medicine.expiry_date.between(today, today + timedelta(days=30))).label('expiring_soon'),
+                func.coalesce(func.sum(Medicine.price * Medicine.quantity), 0).label('value'),
+            ).where(store_condition(Medicine.store_id, store_id))
+            .group_by(Medicine.category).order_by(Medicine.category)
+        ).all()
+    return [dict(row._mapping, value=float(row.value)) for row in rows]
+
+@main.route('/reports/inventory_status')
+@login_required
+def inventory_status_report():
+    if current_user.role != 'store_manager':
+        flash('Only store managers can access reports.', 'error')
+        return redirect(url_for('main.index'))
+    
+    # The charts load their series from chart_data once the page is shown
+    category_rows = chart_series('inventory_by_category', current_store_id())
+    totals = {key: sum(row[key] for row in category_rows)
+              for key in ['count', 'out_of_stock', 'low_stock', 'well_stocked', 'expired', 'expiring_soon']}
+    
+    # Pass the current timestamp directly to avoid using datetime in the template
+    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    return render_template(
+        'inventory_status_report.html',
+        total_count=totals['count'],
+        expired_count=totals['expired'],
+        out_of_stock=totals['out_of_stock'],
+        low_stock=totals['low_stock'],
+        well_stocked=totals['well_stocked'],
+        categories=category_rows,
+        current_time=current_time
+    )
+
+# Head-office view across branches
+BRANCH_SUMMARY_FIELDS = ['count', 'out_of_stock', 'low_stock', 'expired', 'value',
+                         'units_sold', 'window_revenue', 'lifetime_revenue']
+
+def branch_summaries(today=None):
+    """Stock and sales figures for every branch, one GROUP BY store_id per table.
+
+    Medicine is read in a single pass, and sales come from the maintained
+    per-medicine counters, so no branch's raw sales rows are scanned at all.
+
+    Returns:
+        List of dicts, one per store ordered by name, with 'id', 'code',
+        'name' and each of BRANCH_SUMMARY_FIELDS
+    """
+    today = today or datetime.now().date()
+    stock_bucket = stock_bucket_expression()
+
+    def count_where(condition):
+        return func.sum(case((condition, 1), else_=0))
+
+    with report_session() as reports:
+        stores = reports.query(Store).order_by(Store.name).all()
+        stock = {row.store_id: row for row in reports.execute(
+            select(
+                Medicine.store_id,
+                func.count(Medicine.id).label('count'),
+                count_where(stock_bucket == 'out_of_stock').label('out_of_stock'),
+                count_where(stock_bucket == 'low_stock').label('low_stock'),
+                count_where(Medicine.expiry_date < today).label('expired'),
+                func.coalesce(func.sum(Medicine.price * Medicine.quantity), 0).label('value'),
+            ).group_by(Medicine.store_id)
+        )}
+        sales = {row.store_id: row for row in reports.execute(
+            select(
+                MedicineSalesCounter.store_id,
+                func.sum(MedicineSalesCounter.lifetime_units).label('units_sold'),
+                func.sum(MedicineSalesCounter.window_revenue).label('window_revenue'),
+                func.sum(MedicineSalesCounter.lifetime_revenue).label('lifetime_revenue'),
+            ).group_by(MedicineSalesCounter.store_id)
+        )}
+        summaries = []
+        for store in stores:
+            summary = {'id': store.id, 'code': store.code, 'name': store.name}
+            for source, fields in ((stock.get(store.id), BRANCH_SUMMARY_FIELDS[:5]),
+                                   (sales.get(store.id), BRANCH_SUMMARY_FIELDS[5:])):
+                for field in fields:
+                    summary[field] = getattr(source, field) if source is not None else 0
+            summary['value'] = float(summary['value'])
+            summaries.append(summary)
+    return summaries
+
+@main.route('/reports/branches')
+@login_required
+def branch_summary():
+    if current_user.role != 'store_manager' or current_user.store_id is not None:
+        flash('Only head-office managers can compare branches.', 'error')
+        return redirect(url_for('main.index'))
+    
+    branches = branch_summaries()
+    totals = {field: sum(branch[field] for branch in branches) for field in BRANCH_SUMMARY_FIELDS}
+    return render_template('branch_summary.html',
+                          branches=branches,
+                          totals=totals,
+                          window_days=current_app.config['SALES_COUNTER_WINDOW_DAYS'],
+                          current_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+# CSV layouts shared by the direct exports and the background report jobs
+INVENTORY_CSV_HEADER = ['ID', 'Name', 'Category', 'Price', 'Quantity', 
+                        'Minimum Stock', 'Expiry Date', 'Stock Status', 'Created At', 'Updated At']
+
+SALES_CSV_HEADER = ['Sale ID', 'Date', 'Medicine', 'Category', 'Quantity', 
+                    'Unit Price', 'Total', 'Customer']
+
+def inventory_csv_row(medicine):
+    return [
+        medicine.id,
+        medicine.name,
+        medicine.category,
+        medicine.price,
+        medicine.quantity,
+        medicine.min_stock_level,
+        medicine.expiry_date.strftime('%Y-%m-%d'),
+        medicine.stock_status(),
+        medicine.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        medicine.updated_at.strftime('%Y-%m-%d %H:%M:%S')
+    ]
+
+def sales_csv_row(sale):
+    return [
+        sale.id,
+        sale.sale_date.strftime('%Y-%m-%d %H:%M:%S'),
+        sale.medicine_name,
+        sale.medicine_category,
+        sale.quantity,
+        f"${sale.sale_price:.2f}",
+        f"${sale.total_price:.2f}",
+        sale.customer_name or 'Walk-in Customer'
+    ]
+
+# Export inventory as CSV
+@main.route('/reports/export_inventory_csv')
+@login_required
+def export_inventory_csv():
+    if current_user.role != 'store_manager':  # Changed from session to current_user
+        flash('Only store managers can access reports.', 'error')
+        return redirect(url_for('main.index'))
+    
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(INVENTORY_CSV_HEADER)
+    
+    for medicine in inventory_snapshot().medicines(current_store_id()):
+        writer.writerow(inventory_csv_row(medicine))
+    
+    response = make_response(output.getvalue())
+    response.headers['Content-Disposition'] = 'attachment; filename=inventory_report.csv'
+    response.headers['Content-type'] = 'text/csv'
+    
+    return response
+
+# Draft purchase orders
+PURCHASE_ORDER_CSV_HEADER = ['Order', 'Category', 'Medicine ID', 'Medicine', 'In Stock',
+                             'Minimum Stock', 'Order Quantity']
+
+def purchase_order_lines(session, store_id=None):
+    """Reorder lines for every medicine below its minimum stock level, in one query.
+
+    Each line tops the medicine up to PURCHASE_ORDER_TARGET_FACTOR times its
+    minimum level. Lines come back ordered by category, ready to be grouped.
+    """
+    factor = current_app.config['PURCHASE_ORDER_TARGET_FACTOR']
+    order_quantity = Medicine.min_stock_level * factor - func.max(Medicine.quantity, 0)
+    return session.query(
+        Medicine.id, Medicine.name, Medicine.category, Medicine.quantity,
+        Medicine.min_stock_level, order_quantity.label('order_quantity')
+    ).filter(
+        store_condition(Medicine.store_id, store_id),
+        Medicine.quantity < Medicine.min_stock_level
+    ).order_by(Medicine.category, Medicine.name, Medicine.id).yield_per(1000)
+
+def draft_purchase_orders(lines, today=None):
+    """Group ordered reorder lines into one draft order per category.
+
+    Yields:
+        (order_ref, category, lines) tuples, one order at a time
+    """
+    prefix = f"PO-DRAFT-{(today or datetime.now().date()).strftime('%Y%m%d')}"
+    for number, (category, order_lines) in enumerate(groupby(lines, key=lambda line: line.category), 1):
+        yield f'{prefix}-{number:02d}', category, list(order_lines)
+
+def purchase_order_to_dict(order_ref, category, lines):
+    return {
+        'order_ref': order_ref,
+        'category': category,
+        'status': 'draft',
+        'total_units': sum(line.order_quantity for line in lines),
+        'lines': [{
+            'medicine_id': line.id,
+            'medicine_name': line.name,
+            'in_stock': line.quantity,
+            'min_stock_level': line.min_stock_level,
+            'order_quantity': line.order_quantity,
+        } for line in lines]
+    }
+
+def stream_csv(header, rows, chunk_size=8192):
+    """Encode rows as CSV in chunks of about `chunk_size` characters."""
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+@main.route('/reports/purchase_orders')
+@login_required
+def export_purchase_orders():
+    if current_user.role != 'store_manager':
+        flash('Only store managers can generate purchase orders.', 'error')
+        return redirect(url_for('main.index'))
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'json'):
+        return jsonify({'error': "format must be 'csv' or 'json'"}), 400
+    store_id = current_store_id()
+    
+    def csv_rows():
+        with report_session() as reports:
+            for order_ref, category, lines in draft_purchase_orders(purchase_order_lines(reports, store_id)):
+                for line in lines:
+                    yield [order_ref, category, line.id, line.name, line.quantity,
+                           line.min_stock_level, line.order_quantity]
+    
+    def json_chunks():
+        yield '{"generated_at": %s, "orders": [' % json.dumps(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        with report_session() as reports:
+            for number, order in enumerate(draft_purchase_orders(purchase_order_lines(reports, store_id))):
+                yield (', ' if number else '') + json.dumps(purchase_order_to_dict(*order))
+        yield ']}'
+    
+    filename = f"purchase_orders_{datetime.now().strftime('%Y%m%d')}.{export_format}"
+    if export_format == 'csv':
+        body, mimetype = stream_csv(PURCHASE_ORDER_CSV_HEADER, csv_rows()), 'text/csv'
+    else:
+        body, mimetype = json_chunks(), 'application/json'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+def run_stock_check():
+    """Classify stock and expiry levels and store the result as the latest check.
+
+    Only flagged medicines are loaded, in a single query, and older checks
+    beyond STOCK_CHECK_HISTORY are pruned in the same transaction.
+
+    Returns:
+        The new StockCheck
+    """
+    today = datetime.now().date()
+    expiring_cutoff = today + timedelta(days=30)
+
+    flagged = db.session.query(
+        Medicine.id, Medicine.store_id, Medicine.name, Medicine.category, Medicine.quantity,
+        Medicine.min_stock_level, Medicine.expiry_date
+    ).filter(
+        (Medicine.quantity < Medicine.min_stock_level) | (Medicine.expiry_date <= expiring_cutoff)
+    ).all()
+
+    alert_types = []
+    for row in flagged:
+        if row.quantity <= 0:
+            alert_types.append((row, 'out_of_stock'))
+        elif row.quantity < row.min_stock_level:
+            alert_types.append((row, 'low_stock'))
+        if row.expiry_date < today:
+            alert_types.append((row, 'expired'))
+        elif row.expiry_date <= expiring_cutoff:
+            alert_types.append((row, 'expiring_soon'))
+
+    def store_check():
+        counts = {'low_stock': 0, 'out_of_stock': 0, 'expired': 0, 'expiring_soon': 0}
+        for _, alert_type in alert_types:
+            counts[alert_type] += 1
+
+        stock_check = StockCheck(
+            low_stock_count=counts['low_stock'],
+            out_of_stock_count=counts['out_of_stock'],
+            expired_count=counts['expired'],
+            expiring_soon_count=counts['expiring_soon']
+        )
+        db.session.add(stock_check)
+        db.session.flush()
+
+        db.session.bulk_save_objects([
+            StockAlert(
+                check_id=stock_check.id,
+                store_id=row.store_id,
+                medicine_id=row.id,
+                medicine_name=row.name,
+                medicine_category=row.category,
+                alert_type=alert_type,
+                quantity=row.quantity,
+                min_stock_level=row.min_stock_level,
+                expiry_date=row.expiry_date
+            )
+            for row, alert_type in alert_types
+        ])
+
+        # Keep only the most recent checks so the alerts tables stay small
+        oldest_kept = stock_check.id - current_app.config['STOCK_CHECK_HISTORY'] + 1
+        StockAlert.query.filter(StockAlert.check_id < oldest_kept).delete(synchronize_session=False)
+        StockCheck.query.filter(StockCheck.id < oldest_kept).delete(synchronize_session=False)
+
+        db.session.commit()
+        return stock_check
+
+    return run_with_lock_retry(store_check)
+
+def latest_stock_check():
+    """Return the most recent stored StockCheck, or None if no check has run yet."""
+    return StockCheck.query.order_by(StockCheck.id.desc()).first()
+
+def check_stock_and_notify(in_context=False):
+    """Run a stock check immediately and store it as the latest result.
+    
+    Args:
+        in_context: Set to True if already in an app context
+
+    Returns:
+        Tuple of (low_stock_count, out_of_stock_count)
+    """
+    # Use this approach to avoid nested contexts
+    if in_context:
+        stock_check = run_stock_check()
+    else:
+        # Original behavior with a fresh context on the current app
+        with current_app.app_context():
+            stock_check = run_stock_check()
+    return stock_check.low_stock_count, stock_check.out_of_stock_count
+
+def claim_job_run(name, interval, holder):
+    """Take the lease on a periodic job if it is due and no other process holds it.
+
+    A lease left by a process that died mid-run expires after
+    JOB_LEASE_SECONDS.
+
+    Returns:
+        None if `holder` took the lease and should run the job now,
+        otherwise the seconds to wait before trying again
+    """
+    now = datetime.utcnow()
+
+    def claim():
+        db.session.execute(sqlite_insert(JobRun).values(name=name).on_conflict_do_nothing())
+        claimed = db.session.execute(
+            update(JobRun).where(
+                JobRun.name == name,
+                or_(JobRun.lease_expires_at.is_(None), JobRun.lease_expires_at < now),
+                or_(JobRun.last_run_at.is_(None), JobRun.last_run_at <= now - timedelta(seconds=interval)),
+            ).values(holder=holder, lease_expires_at=now + timedelta(seconds=current_app.config['JOB_LEASE_SECONDS'])),
+            execution_options={'synchronize_session': False},
+        ).rowcount
+        db.session.commit()
+        return claimed
+
+    if run_with_lock_retry(claim):
+        return None
+    job = db.session.get(JobRun, name)
+    if job.lease_expires_at is not None and job.lease_expires_at >= now:
+        return interval  # another process is running it now
+    due_in = (job.last_run_at + timedelta(seconds=interval) - now).total_seconds()
+    return min(max(due_in, 1), interval)
+
+def release_job_run(name, holder, succeeded):
+    """Give up the lease taken by claim_job_run(), recording the run if it succeeded."""
+    db.session.rollback()
+    values = {'holder': None, 'lease_expires_at': None}
+    if succeeded:
+        values['last_run_at'] = datetime.utcnow()
+
+    def release():
+        db.session.execute(update(JobRun).where(JobRun.name == name, JobRun.holder == holder).values(**values),
+                           execution_options={'synchronize_session': False})
+        db.session.commit()
+
+    run_with_lock_retry(release)
+
+class BackgroundWorker:
+    """Daemon thread that calls run_once() in an app context every `interval` seconds.
+
+    wake() cuts the current wait short so newly queued work starts at once.
+    Workers with `leased` set are periodic maintenance jobs: they run only
+    when the job's JobRun says it is due and no other process holds it, so
+    restarting the app or running several processes doesn't repeat them.
+    """
+
+    name = 'background-worker'
+    leased = False
+
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        self.holder = f'{os.getpid()}-{uuid.uuid4().hex[:12]}'
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.is_running:
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wake(self):
+        self._wake_event.set()
+
+    def run_once(self):
+        raise NotImplementedError
+
+    def run_if_due(self):
+        """Call run_once(), unless the worker is leased and the job isn't due or is held elsewhere.
+
+        Returns:
+            Seconds to wait before the next attempt
+        """
+        if not self.leased:
+            self.run_once()
+            return self.interval
+        wait = claim_job_run(self.name, self.interval, self.holder)
+        if wait is not None:
+            return wait
+        succeeded = False
+        try:
+            self.run_once()
+            succeeded = True
+        finally:
+            release_job_run(self.name, self.holder, succeeded)
+        return self.interval
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            wait = self.interval
+            with self.app.app_context():
+                try:
+                    wait = self.run_if_due()
+                except Exception:
+                    self.app.logger.exception('%s failed', self.name)
+                finally:
+                    db.session.remove()
+            self._wake_event.wait(wait)
+            self._wake_event.clear()
+
+class StockCheckScheduler(BackgroundWorker):
+    """Runs run_stock_check() every `interval` seconds.
+
+    Request handlers never run the check themselves; they read the latest
+    stored StockCheck instead.
+    """
+
+    name = 'stock-check-scheduler'
+
+    def run_once(self):
+        run_stock_check()
+
+class SalesCounterRefresher(BackgroundWorker):
+    """Ages old days out of the rolling sales window every `interval` seconds."""
+
+    name = 'sales-counter-refresher'
+
+    def run_once(self):
+        refresh_sales_window_counters()
+
+# Background report jobs
+ACTIVE_JOB_STATUSES = ['pending', 'running']
+
+def write_inventory_csv(writer, on_progress, store_id=None):
+    with report_session() as reports:
+        query = reports.query(Medicine).filter(store_condition(Medicine.store_id, store_id))
+        total = query.count()
+        writer.writerow(INVENTORY_CSV_HEADER)
+        for done, medicine in enumerate(query.order_by(Medicine.id).yield_per(1000), 1):
+            writer.writerow(inventory_csv_row(medicine))
+            if done % 1000 == 0:
+                on_progress(done, total)
+
+def write_sales_csv(writer, on_progress, start_date=None, end_date=None, store_id=None):
+    start = datetime.strptime(start_date, '%Y-%m-%d') if start_date else None
+    with report_session() as reports:
+        queries = []
+        for source in sale_sources(reports, start):
+            query = reports.query(source).filter(store_condition(source.store_id, store_id))
+            if start:
+                query = query.filter(source.sale_date >= start)
+            if end_date:
+                query = query.filter(source.sale_date < datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1))
+            queries.append(query.order_by(source.sale_date.desc(), source.id.desc()))
+        total = sum(query.order_by(None).count() for query in queries)
+        writer.writerow(SALES_CSV_HEADER)
+        # The hot and archived sales stream in their own index order and are merged
+        sales = merge_sales(*(query.yield_per(1000) for query in queries))
+        for done, sale in enumerate(sales, 1):
+            writer.writerow(sales_csv_row(sale))
+            if done % 1000 == 0:
+                on_progress(done, total)
+
+# job_type -> (writer function, download file name)
+REPORT_JOB_TYPES = {
+    'inventory_csv': (write_inventory_csv, 'inventory_report.csv'),
+    'sales_csv': (write_sales_csv, 'sales_report.csv'),
+}
+
+def report_job_dir():
+    return current_app.config.get('REPORT_JOB_DIR') or os.path.join(current_app.instance_path, 'report_jobs')
+
+def submit_report_job(job_type, params, user_id=None):
+    """Queue a report job, or return the identical job that is already queued.
+
+    Returns:
+        Tuple of (job, created)
+    """
+    params_json = json.dumps(params, sort_keys=True)
+    dedupe_key = f'{job_type}:{params_json}'
+
+    def find_active():
+        return ReportJob.query.filter(
+            ReportJob.dedupe_key == dedupe_key,
+            ReportJob.status.in_(ACTIVE_JOB_STATUSES)
+        ).first()
+
+    existing = find_active()
+    if existing is not None:
+        return existing, False
+
+    def create_job():
+        job = ReportJob(job_type=job_type, params=params_json, dedupe_key=dedupe_key,
+                        requested_by=user_id)
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    try:
+        job = run_with_lock_retry(create_job)
+    except IntegrityError:
+        # Another request queued the same job between our check and insert
+        db.session.rollback()
+        return find_active(), False
+
+    for worker in current_app.extensions.get('report_job_workers', []):
+        worker.wake()
+    return job, True
+
+def claim_next_report_job():
+    """Atomically mark the oldest pending (or abandoned running) job as running.
+
+    Returns:
+        The claimed ReportJob, or None if the queue is empty
+    """
+    stale_before = datetime.utcnow() - timedelta(seconds=current_app.config['REPORT_JOB_TIMEOUT'])
+    while True:
+        candidate = ReportJob.query.filter(
+            (ReportJob.status == 'pending') |
+            ((ReportJob.status == 'running') & (ReportJob.started_at < stale_before))
+        ).order_by(ReportJob.id).first()
+        if candidate is None:
+            return None
+
+        # Conditional update so two workers never run the same job
+        claimed = ReportJob.query.filter(
+            ReportJob.id == candidate.id,
+            ReportJob.status == candidate.status,
+            ReportJob.started_at == candidate.started_at
+        ).update({'status': 'running', 'started_at': datetime.utcnow(), 'progress': 0},
+                 synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return db.session.get(ReportJob, candidate.id)
+
+def set_report_job_progress(job_id, done, total):
+    # Separate session so progress commits never disturb the report's read transaction
+    with Session(db.engine) as progress_session:
+        progress_session.query(ReportJob).filter(ReportJob.id == job_id).update(
+            {'progress': min(99, int(done * 100 / total)) if total else 0},
+            synchronize_session=False
+        )
+        progress_session.commit()
+
+def process_next_report_job():
+    """Run one queued report job to completion.
+
+    The artifact is written to a temporary file and moved into place, so a
+    download never sees a partial file.
+
+    Returns:
+        True if a job was processed, False if the queue was empty
+    """
+    job = claim_next_report_job()
+    if job is None:
+        return False
+
+    job_id = job.id
+    try:
+        write_report, _ = REPORT_JOB_TYPES[job.job_type]
+        directory = report_job_dir()
+        os.makedirs(directory, exist_ok=True)
+        artifact_path = os.path.join(directory, f'report_job_{job_id}.csv')
+        partial_path = artifact_path + '.part'
+
+        with open(partial_path, 'w', newline='') as artifact:
+            write_report(csv.writer(artifact),
+                         lambda done, total: set_report_job_progress(job_id, done, total),
+                         **json.loads(job.params))
+        os.replace(partial_path, artifact_path)
+
+        job.status = 'done'
+        job.progress = 100
+        job.artifact_path = artifact_path
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception('Report job %s failed', job_id)
+        job = db.session.get(ReportJob, job_id)
+        job.status = 'failed'
+        job.error = str(e)
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return True
+
+def expire_report_jobs(retention_hours=None):
+    """Delete finished report jobs older than REPORT_JOB_RETENTION_HOURS and their artifacts.
+
+    Files go first, so an interrupted run leaves at most a job whose
+    download is already gone, never an artifact nothing points to.
+
+    Returns:
+        Number of jobs deleted
+    """
+    if retention_hours is None:
+        retention_hours = current_app.config['REPORT_JOB_RETENTION_HOURS']
+    cutoff = datetime.utcnow() - timedelta(hours=retention_hours)
+    jobs = db.session.query(ReportJob.id, ReportJob.artifact_path).filter(
+        ReportJob.status.in_(['done', 'failed']), ReportJob.finished_at < cutoff).all()
+    db.session.rollback()
+    if not jobs:
+        return 0
+
+    directory = report_job_dir()
+    for job_id, artifact_path in jobs:
+        # A worker that died mid-write leaves its partial file behind
+        for path in (artifact_path, os.path.join(directory, f'report_job_{job_id}.csv.part')):
+            if path:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def delete_jobs():
+        count = ReportJob.query.filter(ReportJob.id.in_([job_id for job_id, _ in jobs])) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        return count
+
+    return run_with_lock_retry(delete_jobs)
+
+class ReportJobWorker(BackgroundWorker):
+    """Drains the report job queue, then sleeps until woken by a new submission."""
+
+    name = 'report-job-worker'
+
+    def run_once(self):
+        while not self._stop_event.is_set() and process_next_report_job():
+            pass
+
+# Change data capture feed
+CHANGE_FEED_PAGE_SIZE = 10000
+
+def compact_change_log(retention_days=None, chunk_size=5000):
+    """Delete change log entries older than the retention period.
+
+    Entries are deleted oldest first in chunks of `chunk_size`, each in its
+    own transaction so till writes are never held up for long. The newest
+    entry is always kept, so the feed can still tell a consumer that it
+    fell behind the compacted range.
+
+    Returns:
+        Number of entries deleted
+    """
+    if retention_days is None:
+        retention_days = current_app.config['CHANGE_LOG_RETENTION_DAYS']
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    first_seq, newest_seq = db.session.query(func.min(ChangeLogEntry.seq), func.max(ChangeLogEntry.seq)).one()
+    last_expired = db.session.query(func.max(ChangeLogEntry.seq)).filter(ChangeLogEntry.changed_at < cutoff).scalar()
+    # End the read transaction so each chunk takes the write lock on a fresh snapshot
+    db.session.rollback()
+    if last_expired is None:
+        return 0
+    last_expired = min(last_expired, newest_seq - 1)
+
+    deleted = 0
+    for start in range(first_seq, last_expired + 1, chunk_size):
+        upper = min(start + chunk_size - 1, last_expired)
+
+        def delete_chunk():
+            count = ChangeLogEntry.query.filter(ChangeLogEntry.seq <= upper).delete(synchronize_session=False)
+            db.session.commit()
+            return count
+
+        deleted += run_with_lock_retry(delete_chunk)
+    return deleted
+
+def prune_live_events(retention_hours=None):
+    """Delete live events older than LIVE_EVENT_RETENTION_HOURS.
+
+    Returns:
+        Number of events deleted
+    """
+    if retention_hours is None:
+        retention_hours = current_app.config['LIVE_EVENT_RETENTION_HOURS']
+    cutoff = datetime.utcnow() - timedelta(hours=retention_hours)
+
+    def delete_expired():
+        count = LiveEvent.query.filter(LiveEvent.created_at < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+        return count
+
+    return run_with_lock_retry(delete_expired)
+
+class ChangeLogCompactor(BackgroundWorker):
+    """Deletes expired change log entries, live events and report jobs every `interval` seconds."""
+
+    name = 'change-log-compactor'
+    leased = True
+
+    def run_once(self):
+        compact_change_log()
+        prune_live_events()
+        expire_report_jobs()
+
+@click.command('compact-change-log')
+@with_appcontext
+def compact_change_log_command():
+    """Delete change log entries older than CHANGE_LOG_RETENTION_DAYS, expired live events and report jobs."""
+    count = compact_change_log()
+    click.echo(f'Deleted {count} change log entries, {prune_live_events()} live events '
+               f'and {expire_report_jobs()} report jobs.')
+
+def archive_sales(older_than_days=None, chunk_size=None):
+    """Move sales older than SALES_ARCHIVE_DAYS from the hot sale table to the archive.
+
+    Sales move oldest first in chunks of `chunk_size`. Each chunk is copied
+    in one short transaction and deleted from the hot table in the next, so
+    the write lock is never held for long. In WAL mode the two files commit
+    separately even within one transaction, hot file first, so a single
+    transaction could briefly show readers a chunk in neither table.
+    Committing the copy first means a chunk is only ever in both, which
+    sales_since() and merge_sales() count once, and an interrupted run
+    leaves it there for the next run to finish. The newest sale always
+    stays hot, so new sales never reuse an archived id.
+
+    Returns:
+        Number of sales archived
+    """
+    if older_than_days is None:
+        older_than_days = current_app.config['SALES_ARCHIVE_DAYS']
+    if chunk_size is None:
+        chunk_size = current_app.config['SALES_ARCHIVE_CHUNK_SIZE']
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    newest_id = db.session.query(func.max(Sale.id)).scalar()
+    db.session.rollback()
+    if newest_id is None:
+        return 0
+
+    columns = [column.name for column in Sale.__table__.columns]
+    archived = 0
+    while True:
+        def copy_chunk():
+            ids = db.session.scalars(
+                select(Sale.id).where(Sale.sale_date < cutoff, Sale.id < newest_id)
+                .order_by(Sale.sale_date, Sale.id).limit(chunk_size)
+            ).all()
+            if ids:
+                db.session.execute(sqlite_insert(archived_sale_table).from_select(
+                    columns, select(*Sale.__table__.columns).where(Sale.id.in_(ids))
+                ).on_conflict_do_nothing())
+            db.session.commit()
+            return ids
+
+        def delete_chunk():
+            # Run on the connection so the bulk-statement listeners, which
+            # resync live clients and drop chart series, don't see it
+            db.session.connection().execute(Sale.__table__.delete().where(Sale.id.in_(ids)))
+            db.session.commit()
+
+        ids = run_with_lock_retry(copy_chunk)
+        if not ids:
+            return archived
+        run_with_lock_retry(delete_chunk)
+        archived += len(ids)
+
+class SalesArchiver(BackgroundWorker):
+    """Moves old sales to the archive every `interval` seconds."""
+
+    name = 'sales-archiver'
+    leased = True
+
+    def run_once(self):
+        archive_sales()
+
+@click.command('archive-sales')
+@with_appcontext
+def archive_sales_command():
+    """Move sales older than SALES_ARCHIVE_DAYS to the archive database."""
+    count = archive_sales()
+    click.echo(f'Archived {count} sales to {current_app.config["SALES_ARCHIVE_PATH"]}.')
+
+# Online backups and analysis snapshots of the database and its sales archive
+BACKUP_SCHEMAS = [('main', ''), (ARCHIVE_SCHEMA, '_archive')]
+
+class BackupRestartLimit(Exception):
+    """Raised from the progress callback to stop stepping a backup that keeps restarting."""
+
+def backup_dir():
+    return current_app.config.get('BACKUP_DIR') or os.path.join(current_app.instance_path, 'backups')
+
+def backup_stem():
+    database = db.engine.url.database
+    if database in (None, '', ':memory:'):
+        return 'memory'
+    return os.path.splitext(os.path.basename(database))[0]
+
+def step_backup(source, schema, target_path, pages_per_step, step_pause, max_restarts):
+    """Copy one schema of an open sqlite3 connection with SQLite's online backup API.
+
+    Each step copies `pages_per_step` pages. In WAL mode the whole copy reads
+    one pinned snapshot, so commits from other connections neither wait for
+    it nor restart it. Under a rollback journal each step holds the read
+    lock only while it runs and `step_pause` between steps lets writers in;
+    a write restarts the copy, so after `max_restarts` restarts the rest is
+    copied in one step.
+
+    Returns:
+        Dict with 'pages', 'steps', 'restarts', 'longest_step_ms' and 'one_step'
+    """
+    stats = {'pages': 0, 'steps': 0, 'restarts': 0, 'longest_step_ms': 0.0, 'one_step': False}
+    last = {'remaining': None, 'at': time_module.perf_counter()}
+    wal = source.execute(f'PRAGMA {schema}.journal_mode').fetchone()[0].lower() == 'wal'
+
+    def progress(status, remaining, total):
+        stats['pages'] = total
+        stats['steps'] += 1
+        stats['longest_step_ms'] = max(stats['longest_step_ms'], (time_module.perf_counter() - last['at']) * 1000)
+        if last['remaining'] is not None and remaining > last['remaining']:
+            stats['restarts'] += 1
+            if stats['restarts'] > max_restarts:
+                raise BackupRestartLimit()
+        last['remaining'] = remaining
+        if remaining and step_pause and not wal:
+            time_module.sleep(step_pause)
+        last['at'] = time_module.perf_counter()
+
+    target = sqlite3.connect(target_path)
+    try:
+        if wal:
+            source.execute('BEGIN')
+            source.execute(f'SELECT count(*) FROM {schema}.sqlite_master').fetchone()
+        try:
+            source.backup(target, pages=pages_per_step, progress=progress, name=schema)
+        except BackupRestartLimit:
+            stats['one_step'] = True
+            started = time_module.perf_counter()
+            source.backup(target, name=schema)
+            stats['steps'] += 1
+            stats['longest_step_ms'] = max(stats['longest_step_ms'], (time_module.perf_counter() - started) * 1000)
+        finally:
+            if wal:
+                source.execute('COMMIT')
+        # A backup of a WAL database is in WAL mode too; make it one self-contained file
+        target.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        target.close()
+    return stats
+
+def prune_backups(directory, stem, kind, keep):
+    """Delete all but the newest `keep` backups of one kind, archive files included."""
+    prefix = f'{stem}-{kind}-'
+    names = sorted(name for name in os.listdir(directory)
+                   if name.startswith(prefix) and name.endswith('.db') and not name.endswith('_archive.db'))
+    for name in names[:max(len(names) - keep, 0)]:
+        for _, suffix in BACKUP_SCHEMAS:
+            path = os.path.join(directory, f'{name[:-len(".db")]}{suffix}.db')
+            if os.path.exists(path):
+                os.chmod(path, 0o644)  # snapshots are read-only
+                os.remove(path)
+
+def backup_database(snapshot=False, directory=None):
+    """Copy the live database and its sales archive to timestamped files without stopping the app.
+
+    Backups copy pages with the online backup API in steps of
+    BACKUP_PAGES_PER_STEP (see step_backup). A snapshot runs VACUUM INTO
+    instead, which writes a compacted, defragmented copy in a single read
+    transaction and is left read-only for offline analysis. Either way a
+    file only gets its final name once complete, the pair opens as a
+    database with its archive, and the newest BACKUP_KEEP of each kind are kept.
+
+    Returns:
+        Dict with 'kind', 'paths', 'bytes', 'seconds', 'pages', 'steps',
+        'restarts', 'longest_step_ms' and 'one_step'
+    """
+    config = current_app.config
+    kind = 'snapshot' if snapshot else 'backup'
+    directory = directory or backup_dir()
+    os.makedirs(directory, exist_ok=True)
+    stem = backup_stem()
+    now = datetime.now()
+    name = f'{stem}-{kind}-{now:%Y%m%d-%H%M%S}-{now.microsecond // 1000:03d}'
+    report = {'kind': kind, 'paths': [], 'bytes': 0, 'seconds': 0.0, 'pages': 0, 'steps': 0,
+              'restarts': 0, 'longest_step_ms': 0.0, 'one_step': False}
+
+    started = time_module.perf_counter()
+    with db.engine.connect() as connection:
+        source = connection.connection.driver_connection
+        for schema, suffix in BACKUP_SCHEMAS:
+            path = os.path.join(directory, f'{name}{suffix}.db')
+            partial = f'{path}.partial'
+            if os.path.exists(partial):
+                os.remove(partial)
+            if snapshot:
+                step_started = time_module.perf_counter()
+                source.execute(f'VACUUM {schema} INTO ?', (partial,))
+                stats = {'pages': source.execute(f'PRAGMA {schema}.page_count').fetchone()[0], 'steps': 1,
+                         'restarts': 0, 'longest_step_ms': (time_module.perf_counter() - step_started) * 1000,
+                         'one_step': True}
+            else:
+                stats = step_backup(source, schema, partial, config['BACKUP_PAGES_PER_STEP'],
+                                    config['BACKUP_STEP_PAUSE'], config['BACKUP_MAX_RESTARTS'])
+            os.replace(partial, path)
+            if snapshot:
+                os.chmod(path, 0o444)
+            report['paths'].append(path)
+            report['bytes'] += os.path.getsize(path)
+            for key in ('pages', 'steps', 'restarts'):
+                report[key] += stats[key]
+            report['longest_step_ms'] = max(report['longest_step_ms'], stats['longest_step_ms'])
+            report['one_step'] = report['one_step'] or stats['one_step']
+    report['seconds'] = time_module.perf_counter() - started
+
+    prune_backups(directory, stem, kind, config['BACKUP_KEEP'])
+    return report
+
+def describe_backup(report):
+    """One-line summary of a backup_database() report, including how long it held the read lock."""
+    summary = (f"Wrote {report['kind']} {report['paths'][0]} ({report['bytes'] / 2**20:.1f} MiB with the archive) "
+               f"in {report['seconds']:.2f} s: {report['pages']} pages in {report['steps']} steps, "
+               f"longest step {report['longest_step_ms']:.1f} ms")
+    if report['restarts']:
+        summary += f", {report['restarts']} restarts after concurrent writes"
+    if report['one_step'] and report['kind'] == 'backup':
+        summary += ', rest copied in one step'
+    return summary + '.'
+
+class DatabaseBackupScheduler(BackgroundWorker):
+    """Takes an online backup every `interval` seconds."""
+
+    name = 'database-backup'
+    leased = True
+
+    def run_once(self):
+        self.app.logger.info(describe_backup(backup_database()))
+
+@click.command('backup-db')
+@click.option('--snapshot', is_flag=True, help='Write a compacted read-only copy with VACUUM INTO instead.')
+@click.option('--dir', 'directory', help='Directory to write to (BACKUP_DIR by default).')
+@with_appcontext
+def backup_db_command(snapshot, directory):
+    """Back up the database and its sales archive while the app keeps running."""
+    click.echo(describe_backup(backup_database(snapshot, directory)))
+
+@main.route('/changes')
+@login_required
+def change_feed():
+    """Stream Medicine and Sale changes after `since` as JSON lines, oldest first.
+
+    Branch managers only see their own store's changes; head office sees
+    the branch it has selected, or every branch. At most `limit` entries
+    are returned per call; X-Change-Log-Last-Seq carries the newest seq at
+    the time of the request. A consumer whose `since` falls before the
+    compacted range gets 410 and should re-export the full inventory and
+    sales before following the feed again.
+    """
+    if current_user.role != 'store_manager':
+        return jsonify({'error': 'Only store managers can read the change feed.'}), 403
+    
+    since = request.args.get('since', 0, type=int)
+    limit = min(max(request.args.get('limit', CHANGE_FEED_PAGE_SIZE, type=int), 1), CHANGE_FEED_PAGE_SIZE)
+    with report_session() as reports:
+        first_seq, last_seq = reports.query(func.min(ChangeLogEntry.seq), func.max(ChangeLogEntry.seq)).one()
+    if first_seq is not None and since < first_seq - 1:
+        return jsonify({'error': f'Changes up to seq {first_seq - 1} have been compacted; re-export and resume from the newest seq.',
+                        'first_seq': first_seq, 'last_seq': last_seq}), 410
+    
+    store_id = current_store_id()
+    
+    def json_lines():
+        with report_session() as reports:
+            entries = reports.query(ChangeLogEntry) \
+                .filter(ChangeLogEntry.seq > since, store_condition(ChangeLogEntry.store_id, store_id)) \
+                .order_by(ChangeLogEntry.seq).limit(limit).yield_per(1000)
+            for entry in entries:
+                yield json.dumps(entry.to_dict()) + '\n'
+    
+    response = Response(stream_with_context(json_lines()), mimetype='application/x-ndjson')
+    response.headers['X-Change-Log-Last-Seq'] = str(last_seq or 0)
+    return response
+
+# Live events
+def format_sse(name, data, event_id=None):
+    lines = [f'event: {name}', f'data: {json.dumps(data)}']
+    if event_id is not None:
+        lines.insert(0, f'id: {event_id}')
+    return '\n'.join(lines) + '\n\n'
+
+def live_snapshot(store_id=None, today=None):
+    """Current alert counts and today's sales totals, sent when a stream opens."""
+    today = today or datetime.now().date()
+    stock_bucket = stock_bucket_expression()
+    with report_session() as reports:
+        out_of_stock, low_stock = reports.query(
+            func.coalesce(func.sum(case((stock_bucket == 'out_of_stock', 1), else_=0)), 0),
+            func.coalesce(func.sum(case((stock_bucket == 'low_stock', 1), else_=0)), 0),
+        ).filter(store_condition(Medicine.store_id, store_id)).one()
+        start = datetime.combine(today, datetime.min.time())
+        sales = sales_since(reports, start)
+        sales_today, revenue_today = reports.query(
+            func.count(sales.id), func.coalesce(func.sum(sales.quantity * sales.sale_price), 0)
+        ).filter(
+            store_condition(sales.store_id, store_id),
+            sales.sale_date >= start
+        ).one()
+    return {
+        'low_stock_count': int(low_stock),
+        'out_of_stock_count': int(out_of_stock),
+        'sales_today': sales_today,
+        'revenue_today': round(float(revenue_today), 2),
+    }
+
+def live_event_stream(broker, store_id, after_id, snapshot, keepalive, max_seconds):
+    """Yield SSE frames for one client until `max_seconds` have passed.
+
+    Runs without an app or request context and holds no database
+    connection; between events it only waits on the broker, sending a
+    comment every `keepalive` seconds so proxies keep the connection open.
+    The browser reconnects when the stream ends and gets a fresh snapshot.
+    """
+    yield 'retry: 3000\n\n'
+    yield format_sse('snapshot', snapshot, after_id)
+    deadline = time_module.monotonic() + max_seconds
+    while time_module.monotonic() < deadline:
+        events, missed = broker.wait(after_id, keepalive)
+        if missed:
+            yield format_sse('resync', {})
+            return
+        if not events:
+            yield ': keepalive\n\n'
+            continue
+        for event_id, name, data, event_store_id in events:
+            after_id = event_id
+            if store_id is None or event_store_id in (None, store_id):
+                yield format_sse(name, data, event_id)
+
+@main.route('/events')
+@login_required
+def live_events():
+    if current_user.role != 'store_manager':
+        return jsonify({'error': 'Only store managers can follow live events.'}), 403
+    
+    broker = current_app.extensions['event_broker']
+    store_id = current_store_id()
+    # Taken before the snapshot, so a sale committed in between may be
+    # counted twice but is never missed
+    after_id = broker.last_id
+    snapshot = live_snapshot(store_id)
+    # Give the connection back to the pool before the long-lived stream starts
+    db.session.remove()
+    
+    response = Response(live_event_stream(broker, store_id, after_id, snapshot,
+                                          current_app.config['SSE_KEEPALIVE_SECONDS'],
+                                          current_app.config['SSE_MAX_STREAM_SECONDS']),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Route to manually trigger stock check
+@main.route('/check_stock')
+@login_required
+def check_stock():
+    # Change session check to current_user
+    if current_user.role != 'store_manager':
+        flash('Only store managers can perform stock checks.', 'error')
+        return redirect(url_for('main.index'))
+    
+    # An explicit request for a fresh result, so this one runs inline
+    check_stock_and_notify(in_context=True)
+    flash('Stock check completed. Check notifications for any alerts.', 'success')
+    return redirect(url_for('main.stock_levels'))
+
+# Start the background scheduler with the first request rather than at
+# import time, so CLI commands and tests never spawn the thread
+@main.before_app_request
+def start_background_jobs():
+    if current_app.testing:
+        return
+    for name in ['stock_scheduler', 'sales_counter_refresher', 'reorder_forecaster', 'change_log_compactor',
+                 'sales_archiver', 'database_backup']:
+        worker = current_app.extensions.get(name)
+        if worker is not None and not worker.is_running:
+            worker.start()
+    for worker in current_app.extensions.get('report_job_workers', []):
+        if not worker.is_running:
+            worker.start()
+
+@main.app_template_global()
+def asset_url(name):
+    """URL of the fingerprinted copy of a shared static asset."""
+    return url_for('main.asset', filename=current_app.extensions['asset_manifest'].files[name])
+
+@main.route('/assets/<path:filename>')
+def asset(filename):
+    path, encoding = current_app.extensions['asset_manifest'].resolve(filename, bool(request.accept_encodings['gzip']))
+    if path is None:
+        abort(404)
+    response = send_file(path, mimetype=mimetypes.guess_type(filename)[0], max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
+# Text bodies worth compressing; event streams are left alone so every
+# event reaches the browser as soon as it is written
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/csv', 'text/plain', 'text/css', 'text/javascript', 'application/javascript',
+    'application/json', 'application/x-ndjson',
+}
+
+def gzip_chunks(chunks, level):
+    """Gzip an iterable of byte or str chunks, yielding compressed blocks as zlib emits them."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        block = compressor.compress(chunk)
+        if block:
+            yield block
+    yield compressor.flush()
+
+def read_stream_head(chunks, min_size):
+    """Pull chunks until at least `min_size` bytes are buffered.
+
+    Returns:
+        (head, exhausted): the buffered byte chunks and whether the stream ended
+    """
+    head, size = [], 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        head.append(chunk)
+        size += len(chunk)
+        if size >= min_size:
+            return head, False
+    return head, True
+
+@main.after_app_request
+def compress_response(response):
+    """Gzip text responses for clients that accept it.
 
-    return render_template('reports_dashboard.html')
+    Bodies shorter than COMPRESS_MIN_SIZE go out as they are. Streamed
+    bodies are compressed as they are produced; only their first
+    COMPRESS_MIN_SIZE bytes are buffered to apply the same threshold.
+    """
+    level = current_app.config['COMPRESS_LEVEL']
+    if (level <= 0 or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or 'no-transform' in response.headers.get('Cache-Control', '')):
+        return response
+    response.vary.add('Accept-Encoding')
+    if request.method == 'HEAD' or not request.accept_encodings['gzip']:
+        return response
+    
+    min_size = current_app.config['COMPRESS_MIN_SIZE']
+    if not response.is_streamed:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(zlib.compress(data, level, 16 + zlib.MAX_WBITS))
+    else:
+        body = response.response
+        if hasattr(body, 'close'):
+            response.call_on_close(body.close)
+        chunks = iter(body)
+        head, exhausted = read_stream_head(chunks, min_size)
+        if exhausted:
+            response.response = head
+            return response
+        response.response = gzip_chunks(chain(head, chunks), level)
+        response.direct_passthrough = False
+        response.headers.pop('Content-Length', None)
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers.pop('Accept-Ranges', None)
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-gzip', weak)
+    return response
 
-# Inventory status report
-@app.route('/reports/inventory_status')
+@main.route('/reports/export_sales_csv')
 @login_required
-def inventory_status_report():
+def export_sales_csv():
     if current_user.role != 'store_manager':
-        flash('Only store managers can access reports.', 'error')
-        return redirect(url_for('index'))
-    
-    total_count = Medicine.query.count()
-    expired_count = Medicine.query.filter(Medicine.expiry_date < datetime.now().date()).count()
-    out_of_stock = Medicine.query.filter(Medicine.quantity <= 0).count()
-    low_stock = Medicine.query.filter(Medicine.quantity > 0, 
-                                    Medicine.quantity < Medicine.min_stock_level).count()
-    well_stocked = Medicine.query.filter(Medicine.quantity >= Medicine.min_stock_level).count()
+        flash('Only store managers can export sales data.', 'error')
+        return redirect(url_for('main.index'))
     
-    categories = db.session.query(
-        Medicine.category, func.count(Medicine.id)
-    ).group_by(Medicine.category).all()
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(SALES_CSV_HEADER)
     
-    # Pass the current timestamp directly to avoid using datetime in the template
-    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with report_session() as reports:
+        sales = list(merge_sales(*(
+            reports.query(source).filter(store_condition(source.store_id, current_store_id()))
+            .order_by(source.sale_date.desc(), source.id.desc()).all()
+            for source in sale_sources(reports)
+        )))
     
-    # Add data for charts
-    # Stock level pie chart
-    stock_status_labels = ['Out of Stock', 'Low Stock', 'Well Stocked']
-    stock_status_data = [out_of_stock, low_stock, well_stocked]
+    for sale in sales:
+        writer.writerow(sales_csv_row(sale))
     
-    # Category distribution
-    category_data = db.session.query(
-        Medicine.category, func.count(Medicine.id)
-    ).group_by(Medicine.category).all()
+    response = make_response(output.getvalue())
+    response.headers['Content-Disposition'] = 'attachment; filename=sales_report.csv'
+    response.headers['Content-type'] = 'text/csv'
     
-    category_labels = [item[0] for item in category_data]
-    category_values = [item[1] for item in category_data]
+    return response
+
+@main.route('/reports/jobs', methods=['POST'])
+@login_required
+def create_report_job():
+    if current_user.role != 'store_manager':
+        return jsonify({'error': 'Only store managers can access reports.'}), 403
     
-    # Value by category
-    value_by_category = db.session.query(
-        Medicine.category, func.sum(Medicine.price * Medicine.quantity)
-    ).group_by(Medicine.category).all()
+    job_type = request.form.get('job_type', '')
+    if job_type not in REPORT_JOB_TYPES:
+        return jsonify({'error': f'Unknown report type: {job_type}'}), 400
     
-    value_category_labels = [item[0] for item in value_by_category]
-    value_category_data = [float(item[1]) for item in value_by_category]
+    params = {}
+    if job_type == 'sales_csv':
+        for field in ['start_date', 'end_date']:
+            value = request.form.get(field, '').strip()
+            if value:
+                try:
+                    datetime.strptime(value, '%Y-%m-%d')
+                except ValueError:
+                    return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+                params[field] = value
+    if current_store_id() is not None:
+        params['store_id'] = current_store_id()
     
-    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    job, created = submit_report_job(job_type, params, current_user.id)
+    payload = job.to_dict()
+    payload['status_url'] = url_for('main.report_job_status', job_id=job.id)
+    return jsonify(payload), 202 if created else 200
+
+def get_store_report_job_or_404(job_id):
+    """Load a report job; a branch cannot see jobs run for another branch."""
+    job = db.get_or_404(ReportJob, job_id)
+    store_id = current_store_id()
+    if store_id is not None and json.loads(job.params).get('store_id') != store_id:
+        abort(404)
+    return job
+
+@main.route('/reports/jobs/<int:job_id>')
+@login_required
+def report_job_status(job_id):
+    if current_user.role != 'store_manager':
+        return jsonify({'error': 'Only store managers can access reports.'}), 403
     
-    return render_template(
-        'inventory_status_report.html',
-        # Existing parameters...
-        total_count=total_count,
-        expired_count=expired_count,
-        out_of_stock=out_of_stock,
-        low_stock=low_stock,
-        well_stocked=well_stocked,
-        categories=categories,
-        current_time=current_time,
-        # New chart data
-        stock_status_labels=stock_status_labels,
-        stock_status_data=stock_status_data,
-        category_labels=category_labels,
-        category_values=category_values,
-        value_category_labels=value_category_labels,
-        value_category_data=value_category_data
-    )
+    job = get_store_report_job_or_404(job_id)
+    payload = job.to_dict()
+    if job.status == 'done':
+        payload['download_url'] = url_for('main.download_report_job', job_id=job.id)
+    return jsonify(payload)
 
-# Export inventory as CSV
-@app.route('/reports/export_inventory_csv')
+@main.route('/reports/jobs/<int:job_id>/download')
 @login_required
-def export_inventory_csv():
-    if current_user.role != 'store_manager':  # Changed from session to current_user
+def download_report_job(job_id):
+    if current_user.role != 'store_manager':
         flash('Only store managers can access reports.', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['ID', 'Name', 'Category', 'Price', 'Quantity', 
-                    'Minimum Stock', 'Expiry Date', 'Stock Status', 'Created At', 'Updated At'])
+    job = get_store_report_job_or_404(job_id)
+    if job.status != 'done' or not job.artifact_path or not os.path.exists(job.artifact_path):
+        abort(404)
     
-    medicines = Medicine.query.all()
+    _, download_name = REPORT_JOB_TYPES[job.job_type]
+    return send_file(job.artifact_path, mimetype='text/csv', as_attachment=True,
+                     download_name=download_name)
+
+@main.route('/reports/top_products')
+@login_required
+def top_products_report():
+    if current_user.role != 'store_manager':
+        return jsonify({'error': 'Only store managers can access reports.'}), 403
     
-    for medicine in medicines:
-        writer.writerow([
-            medicine.id,
-            medicine.name,
-            medicine.category,
-            medicine.price,
-            medicine.quantity,
-            medicine.min_stock_level,
-            medicine.expiry_date.strftime('%Y-%m-%d'),
-            medicine.stock_status(),
-            medicine.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            medicine.updated_at.strftime('%Y-%m-%d %H:%M:%S')
-        ])
+    by = request.args.get('by', 'units')
+    period = request.args.get('period', 'lifetime')
+    if by not in ['units', 'revenue'] or period not in ['lifetime', 'window']:
+        return jsonify({'error': "Use by=units|revenue and period=lifetime|window"}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
     
-    response = make_response(output.getvalue())
-    response.headers['Content-Disposition'] = 'attachment; filename=inventory_report.csv'
-    response.headers['Content-type'] = 'text/csv'
+    with report_session() as reports:
+        counters = top_selling_medicines(limit, by=by, window=(period == 'window'), session=reports,
+                                         store_id=current_store_id())
     
-    return response
+    return jsonify({
+        'by': by,
+        'period': period,
+        'window_days': current_app.config['SALES_COUNTER_WINDOW_DAYS'],
+        'products': [{
+            'medicine_id': counter.medicine_id,
+            'medicine_name': counter.medicine_name,
+            'medicine_category': counter.medicine_category,
+            'units': counter.window_units if period == 'window' else counter.lifetime_units,
+            'revenue': round(counter.window_revenue if period == 'window' else counter.lifetime_revenue, 2),
+        } for counter in counters]
+    })
 
-def check_stock_and_notify(in_context=False):
-    """Helper function to check stock levels
+# Sales analytics over any date range. Each granularity maps a sale_date to
+# the label of its bucket in SQL; weeks start on Monday. SQLite stores
+# DateTime columns as ISO-8601 text, so hour, day and month buckets are
+# prefixes of it, which group faster than parsing every date.
+ANALYTICS_GRANULARITIES = {
+    'hour': lambda column: func.substr(column, 1, 13).concat(':00'),
+    'day': lambda column: func.substr(column, 1, 10),
+    'week': lambda column: func.date(column, 'weekday 0', '-6 days'),
+    'month': lambda column: func.substr(column, 1, 7).concat('-01'),
+}
+ANALYTICS_MAX_BUCKETS = 10000
+
+def analytics_bucket_count(start_date, end_date, granularity):
+    """Number of labels analytics_bucket_labels() returns, computed without building them."""
+    days = (end_date - start_date).days + 1
+    if granularity == 'hour':
+        return days * 24
+    if granularity == 'day':
+        return days
+    if granularity == 'week':
+        return (end_date - (start_date - timedelta(days=start_date.weekday()))).days // 7 + 1
+    return (end_date.year - start_date.year) * 12 + end_date.month - start_date.month + 1
+
+def analytics_bucket_labels(start_date, end_date, granularity):
+    """Every bucket label from start_date to end_date, matching ANALYTICS_GRANULARITIES."""
+    if granularity == 'hour':
+        hours = ((end_date - start_date).days + 1) * 24
+        start = datetime.combine(start_date, time.min)
+        return [(start + timedelta(hours=i)).strftime('%Y-%m-%d %H:00') for i in range(hours)]
+    if granularity == 'day':
+        return [(start_date + timedelta(days=i)).isoformat() for i in range((end_date - start_date).days + 1)]
+    if granularity == 'week':
+        monday = start_date - timedelta(days=start_date.weekday())
+        return [(monday + timedelta(weeks=i)).isoformat() for i in range((end_date - monday).days // 7 + 1)]
+    labels = []
+    month = start_date.replace(day=1)
+    while month <= end_date:
+        labels.append(month.isoformat())
+        month = (month + timedelta(days=32)).replace(day=1)
+    return labels
+
+def sales_analytics(session, start_date, end_date, granularity, store_id=None, category=None, medicine_id=None):
+    """Revenue, units and transactions per bucket from one GROUP BY over the sale_date range.
+
+    Returns:
+        List of dicts with 'bucket', 'revenue', 'units' and 'transactions',
+        one per bucket in the range including empty ones
+    """
+    start = datetime.combine(start_date, time.min)
+    sales = sales_since(session, start)
+    bucket = ANALYTICS_GRANULARITIES[granularity](sales.sale_date).label('bucket')
+    query = select(
+        bucket,
+        func.sum(sales.quantity * sales.sale_price).label('revenue'),
+        func.sum(sales.quantity).label('units'),
+        func.count().label('transactions'),
+    ).where(
+        sales.sale_date >= start,
+        sales.sale_date < datetime.combine(end_date + timedelta(days=1), time.min),
+        store_condition(sales.store_id, store_id),
+    ).group_by(bucket)
+    if category:
+        query = query.where(sales.medicine_category == category)
+    if medicine_id:
+        query = query.where(sales.medicine_id == medicine_id)
+    rows = {row.bucket: row for row in session.execute(query)}
+
+    buckets = []
+    for label in analytics_bucket_labels(start_date, end_date, granularity):
+        row = rows.get(label)
+        buckets.append({
+            'bucket': label,
+            'revenue': round(row.revenue, 2) if row else 0.0,
+            'units': row.units if row else 0,
+            'transactions': row.transactions if row else 0,
+        })
+    return buckets
+
+@main.route('/reports/analytics')
+@login_required
+def sales_analytics_report():
+    if current_user.role != 'store_manager':
+        return jsonify({'error': 'Only store managers can access reports.'}), 403
+    
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ANALYTICS_GRANULARITIES:
+        return jsonify({'error': 'Use granularity=hour|day|week|month'}), 400
+    try:
+        end_date = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date() \
+            if request.args.get('end_date') else datetime.now().date()
+        start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date() \
+            if request.args.get('start_date') else end_date - timedelta(days=29)
+    except ValueError:
+        return jsonify({'error': 'Dates must be in YYYY-MM-DD format'}), 400
+    if start_date > end_date:
+        return jsonify({'error': 'start_date must not be after end_date'}), 400
+    if analytics_bucket_count(start_date, end_date, granularity) > ANALYTICS_MAX_BUCKETS:
+        return jsonify({'error': f'At most {ANALYTICS_MAX_BUCKETS} buckets; use a coarser granularity'}), 400
+    category = request.args.get('category', '').strip() or None
+    medicine_id = request.args.get('medicine_id', type=int)
+    
+    with report_session() as reports:
+        buckets = sales_analytics(reports, start_date, end_date, granularity, store_id=current_store_id(),
+                                  category=category, medicine_id=medicine_id)
     
+    return jsonify({
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'granularity': granularity,
+        'category': category,
+        'medicine_id': medicine_id,
+        'totals': {
+            'revenue': round(sum(bucket['revenue'] for bucket in buckets), 2),
+            'units': sum(bucket['units'] for bucket in buckets),
+            'transactions': sum(bucket['transactions'] for bucket in buckets),
+        },
+        'buckets': buckets,
+    })
+
+# Sales history pagination
+SALES_PAGE_SIZE = 50
+
+def parse_sales_filters(args):
+    """Read the sales history filters from request arguments.
+
+    Raises:
+        ValueError: If a date is not in YYYY-MM-DD format
+    """
+    filters = {}
+    for field in ['start_date', 'end_date']:
+        value = args.get(field, '').strip()
+        if value:
+            filters[field] = datetime.strptime(value, '%Y-%m-%d').date()
+    for field in ['medicine_id', 'customer_id']:
+        value = args.get(field, type=int)
+        if value:
+            filters[field] = value
+    for field in ['medicine', 'category', 'customer']:
+        value = args.get(field, '').strip()
+        if value:
+            filters[field] = value
+    return filters
+
+def sales_history_page(session, filters, cursor=None, limit=SALES_PAGE_SIZE):
+    """One page of sales, newest first, using keyset pagination on (sale_date, id).
+
+    The hot table is read first. Archived sales are only read when the page
+    can reach back into the archive: when the hot table cannot fill it, or
+    its oldest row is no newer than the newest archived sale.
+
     Args:
-        in_context: Set to True if already in an app context
+        cursor: The next_cursor returned with the previous page
+
+    Returns:
+        Tuple of (sales, next_cursor); next_cursor is None on the last page
     """
-    # Use this approach to avoid nested contexts
-    if in_context:
-        # Execute directly without creating a new context
-        low_stock_items = Medicine.query.filter(
-            Medicine.quantity > 0,
-            Medicine.quantity < Medicine.min_stock_level
-        ).all()
-        
-        out_of_stock_items = Medicine.query.filter(Medicine.quantity <= 0).all()
-        
-        return len(low_stock_items), len(out_of_stock_items)
-    else:
-        # Original behavior with context
-        with app.app_context():
-            low_stock_items = Medicine.query.filter(
-                Medicine.quantity > 0,
-                Medicine.quantity < Medicine.min_stock_level
-            ).all()
-            
-            out_of_stock_items = Medicine.query.filter(Medicine.quantity <= 0).all()
-            
-            return len(low_stock_items), len(out_of_stock_items)
+    start = None
+    if 'start_date' in filters:
+        start = datetime.combine(filters['start_date'], datetime.min.time())
+    if cursor:
+        cursor_date, cursor_id = decode_sales_cursor(cursor)
 
-# Route to manually trigger stock check
-@app.route('/check_stock')
+    def page_query(source):
+        query = session.query(source)
+        if filters.get('store_id') is not None:
+            query = query.filter(source.store_id == filters['store_id'])
+        if start is not None:
+            query = query.filter(source.sale_date >= start)
+        if 'end_date' in filters:
+            query = query.filter(source.sale_date < datetime.combine(filters['end_date'] + timedelta(days=1), datetime.min.time()))
+        if 'medicine_id' in filters:
+            query = query.filter(source.medicine_id == filters['medicine_id'])
+        if 'medicine' in filters:
+            query = query.filter(source.medicine_name.ilike(filters['medicine'] + '%'))
+        if 'category' in filters:
+            query = query.filter(source.medicine_category == filters['category'])
+        if 'customer_id' in filters:
+            query = query.filter(source.customer_id == filters['customer_id'])
+        if 'customer' in filters:
+            # Matching customers come off the name index, then their sales off the customer index
+            query = query.filter(source.customer_id.in_(
+                select(Customer.id).where(customer_name_starts_with(filters['customer']))))
+        if cursor:
+            # Row-value comparison lets SQLite seek straight into the index
+            query = query.filter(tuple_(source.sale_date, source.id) < tuple_(cursor_date, cursor_id))
+        # Fetch one extra row to learn whether another page exists
+        return query.order_by(source.sale_date.desc(), source.id.desc()).limit(limit + 1).all()
+
+    sales = page_query(Sale)
+    newest_archived = newest_archived_sale_date(session)
+    if newest_archived is not None and (start is None or newest_archived >= start) \
+            and (len(sales) <= limit or sales[-1].sale_date <= newest_archived):
+        sales = list(merge_sales(sales, page_query(ArchivedSale)))[:limit + 1]
+    if len(sales) > limit:
+        sales = sales[:limit]
+        return sales, encode_sales_cursor(sales[-1])
+    return sales, None
+
+def encode_sales_cursor(sale):
+    return f"{sale.sale_date.isoformat()}_{sale.id}"
+
+def decode_sales_cursor(cursor):
+    """Raises ValueError for a malformed cursor."""
+    sale_date, sale_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(sale_date), int(sale_id)
+
+def sale_to_dict(sale):
+    return {
+        'id': sale.id,
+        'sale_date': sale.sale_date.strftime('%Y-%m-%d %H:%M'),
+        'medicine_id': sale.medicine_id,
+        'medicine_name': sale.medicine_name,
+        'medicine_category': sale.medicine_category,
+        'customer_id': sale.customer_id,
+        'customer_name': sale.customer_name or 'Walk-in Customer',
+        'quantity': sale.quantity,
+        'sale_price': round(sale.sale_price, 2),
+        'total_price': round(sale.total_price, 2),
+    }
+
+@main.route('/sales_report/sales')
 @login_required
-def check_stock():
-    # Change session check to current_user
+def sales_history():
     if current_user.role != 'store_manager':
-        flash('Only store managers can perform stock checks.', 'error')
-        return redirect(url_for('index'))
+        return jsonify({'error': 'Access denied. Store managers only.'}), 403
     
-    check_stock_and_notify()
-    flash('Stock check completed. Check notifications for any alerts.', 'success')
-    return redirect(url_for('stock_levels'))
-
-# Use Flask's before_request to check stock levels automatically
-# This is more efficient than checking on every request
-last_check = datetime.now()
-
-@app.before_request
-def auto_check_stock():
-    global last_check
-    # Only check once per hour to avoid overloading the system
-    if (datetime.now() - last_check).total_seconds() > 3600:  # 3600 seconds = 1 hour
-        # Only check on certain routes to avoid checking too frequently
-        if request.endpoint in ['index', 'stock_levels', 'inventory_status_report']:
-            check_stock_and_notify()
-            last_check = datetime.now()
-
-@app.route('/reports/export_sales_csv')
+    try:
+        filters = parse_sales_filters(request.args)
+        filters['store_id'] = current_store_id()
+        limit = min(max(request.args.get('limit', SALES_PAGE_SIZE, type=int), 1), 500)
+        with report_session() as reports:
+            sales, next_cursor = sales_history_page(reports, filters, request.args.get('cursor'), limit)
+    except ValueError:
+        return jsonify({'error': 'Invalid filter or cursor'}), 400
+    
+    return jsonify({
+        'sales': [sale_to_dict(sale) for sale in sales],
+        'next_cursor': next_cursor
+    })
+
+# Per-medicine sales ledger
+VELOCITY_WINDOWS = [7, 30, 90]
+
+def medicine_sales_velocity(session, medicine_id, today=None):
+    """Units sold per day over each of the VELOCITY_WINDOWS.
+
+    One range scan of the (medicine_id, sale_date) index covers all windows.
+
+    Returns:
+        Dict like {'7d': {'units': 14, 'per_day': 2.0}, ...}
+    """
+    today = today or datetime.now().date()
+    starts = {days: datetime.combine(today - timedelta(days=days - 1), datetime.min.time())
+              for days in VELOCITY_WINDOWS}
+    sales = sales_since(session, starts[max(VELOCITY_WINDOWS)])
+    totals = session.query(*[
+        func.coalesce(func.sum(case((sales.sale_date >= starts[days], sales.quantity), else_=0)), 0)
+        for days in VELOCITY_WINDOWS
+    ]).filter(
+        sales.medicine_id == medicine_id,
+        sales.sale_date >= starts[max(VELOCITY_WINDOWS)]
+    ).one()
+    return {
+        f'{days}d': {'units': int(units), 'per_day': round(units / days, 2)}
+        for days, units in zip(VELOCITY_WINDOWS, totals)
+    }
+
+def medicine_daily_units(session, medicine_id, days=90, today=None):
+    """Units sold per calendar day for the last `days` days, zero-filled.
+
+    Returns:
+        List of (YYYY-MM-DD, units) tuples, oldest first
+    """
+    today = today or datetime.now().date()
+    start = today - timedelta(days=days - 1)
+    sales = sales_since(session, datetime.combine(start, datetime.min.time()))
+    sale_day = func.date(sales.sale_date)
+    rows = dict(session.query(sale_day, func.sum(sales.quantity)).filter(
+        sales.medicine_id == medicine_id,
+        sales.sale_date >= datetime.combine(start, datetime.min.time())
+    ).group_by(sale_day).all())
+    return [((start + timedelta(days=i)).isoformat(), int(rows.get((start + timedelta(days=i)).isoformat(), 0)))
+            for i in range(days)]
+
+@main.route('/medicine/<int:id>/ledger')
 @login_required
-def export_sales_csv():
-    if current_user.role != 'store_manager':
-        flash('Only store managers can export sales data.', 'error')
-        return redirect(url_for('index'))
+def medicine_ledger(id):
+    if current_user.role not in ['store_manager', 'pharmacist']:
+        flash('You do not have permission to view sales ledgers.', 'error')
+        return redirect(url_for('main.index'))
     
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Sale ID', 'Date', 'Medicine', 'Category', 'Quantity', 
-                     'Unit Price', 'Total', 'Customer'])
+    medicine = get_store_medicine_or_404(id)
+    with report_session() as reports:
+        sales, next_cursor = sales_history_page(reports, {'medicine_id': id})
+        velocity = medicine_sales_velocity(reports, id)
+        daily_units = medicine_daily_units(reports, id)
     
-    sales = Sale.query.order_by(Sale.sale_date.desc()).all()
+    # Days of stock left at the 30-day selling rate
+    per_day = velocity['30d']['per_day']
+    days_of_stock = round(medicine.quantity / per_day) if per_day else None
     
-    for sale in sales:
-        writer.writerow([
-            sale.id,
-            sale.sale_date.strftime('%Y-%m-%d %H:%M:%S'),
-            sale.medicine_name,
-            sale.medicine_category,
-            sale.quantity,
-            f"${sale.sale_price:.2f}",
-            f"${sale.total_price:.2f}",
-            sale.customer_name or 'Walk-in Customer'
-        ])
+    return render_template('medicine_ledger.html',
+                          medicine=medicine,
+                          sales=sales,
+                          next_cursor=next_cursor,
+                          velocity=velocity,
+                          days_of_stock=days_of_stock,
+                          daily_labels=[day for day, _ in daily_units],
+                          daily_values=[units for _, units in daily_units])
+
+@main.route('/medicine/<int:id>/ledger.json')
+@login_required
+def medicine_ledger_data(id):
+    if current_user.role not in ['store_manager', 'pharmacist']:
+        return jsonify({'error': 'You do not have permission to view sales ledgers.'}), 403
+    if current_store_id() is not None:
+        get_store_medicine_or_404(id)
     
-    response = make_response(output.getvalue())
-    response.headers['Content-Disposition'] = 'attachment; filename=sales_report.csv'
-    response.headers['Content-type'] = 'text/csv'
+    days = min(max(request.args.get('days', 90, type=int), 1), 366)
+    try:
+        with report_session() as reports:
+            sales, next_cursor = sales_history_page(reports, {'medicine_id': id}, request.args.get('cursor'))
+            velocity = medicine_sales_velocity(reports, id)
+            daily_units = medicine_daily_units(reports, id, days)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
     
-    return response
+    return jsonify({
+        'medicine_id': id,
+        'sales': [sale_to_dict(sale) for sale in sales],
+        'next_cursor': next_cursor,
+        'velocity': velocity,
+        'daily_units': [{'date': day, 'units': units} for day, units in daily_units]
+    })
+
+# Customers and their purchase history
+CUSTOMERS_SHOWN = 50
+CUSTOMER_LOOKUP_LIMIT = 10
 
-@app.route('/sales_report')
+def find_customers(prefix=None, limit=CUSTOMERS_SHOWN, session=None):
+    """Customers whose name starts with `prefix` in name order, or the top spenders without one."""
+    query = (session or db.session).query(Customer)
+    if prefix:
+        return query.filter(customer_name_starts_with(prefix)).order_by(Customer.name).limit(limit).all()
+    return query.filter(Customer.lifetime_revenue > 0).order_by(Customer.lifetime_revenue.desc()).limit(limit).all()
+
+@main.route('/customers')
 @login_required
-def sales_report():
-    if current_user.role != 'store_manager':
-        flash('Access denied. Store managers only.', 'error')
-        return redirect(url_for('index'))
+def customers():
+    if current_user.role not in ['store_manager', 'pharmacist']:
+        flash('You do not have permission to view customers.', 'error')
+        return redirect(url_for('main.index'))
     
-    # Get all sales for basic statistics
-    sales = Sale.query.all()
-    total_revenue = sum(sale.total_price for sale in sales) if sales else 0
-    total_sales_count = len(sales)
+    search = request.args.get('q', '').strip()
+    with report_session() as reports:
+        found = find_customers(search, session=reports)
+    return render_template('customers.html', customers=found, search=search)
+
+@main.route('/customers/lookup')
+@login_required
+def customer_lookup():
+    # Loyalty lookups at the till, so every sales role may use it, but only
+    # managers and pharmacists see the chain-wide spending totals
+    search = request.args.get('q', '').strip()
+    if not search:
+        return jsonify({'customers': []})
+    found = find_customers(search, limit=CUSTOMER_LOOKUP_LIMIT)
+    if current_user.role not in ['store_manager', 'pharmacist']:
+        return jsonify({'customers': [{'id': customer.id, 'name': customer.name} for customer in found]})
+    return jsonify({'customers': [customer.to_dict() for customer in found]})
+
+@main.route('/customers/<int:id>')
+@login_required
+def customer_history(id):
+    if current_user.role not in ['store_manager', 'pharmacist']:
+        flash('You do not have permission to view customers.', 'error')
+        return redirect(url_for('main.index'))
     
-    # Current time for report header
-    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    customer = db.get_or_404(Customer, id)
+    with report_session() as reports:
+        sales, next_cursor = sales_history_page(reports, {'customer_id': id, 'store_id': current_store_id()})
+    return render_template('customer_history.html', customer=customer, sales=sales, next_cursor=next_cursor)
+
+@main.route('/customers/<int:id>/sales')
+@login_required
+def customer_sales(id):
+    if current_user.role not in ['store_manager', 'pharmacist']:
+        return jsonify({'error': 'You do not have permission to view customers.'}), 403
     
-    # Daily sales for the past 7 days
-    end_date = datetime.now().date()
+    customer = db.get_or_404(Customer, id)
+    try:
+        with report_session() as reports:
+            sales, next_cursor = sales_history_page(reports, {'customer_id': id, 'store_id': current_store_id()},
+                                                    request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
     
-    daily_sales = []
-    daily_labels = []
+    return jsonify({
+        'customer': customer.to_dict(),
+        'sales': [sale_to_dict(sale) for sale in sales],
+        'next_cursor': next_cursor,
+    })
+
+# Demand forecasting and reorder points
+REORDER_SUGGESTIONS_SHOWN = 200
+
+def forecast_day_weight(age, history_days, method='ewma', smoothing=0.1, window_days=28):
+    """SQL expression for the weight of a day `age` days old in the demand forecast.
+
+    The weights over the history window sum to 1, so weighted sums of daily
+    units give the forecast directly and days without sales count as zero.
+
+    Args:
+        age: SQL expression for days between the bucket and today
+        history_days: Days of history covered
+        method: 'ewma' for exponential smoothing or 'sma' for a moving average
+        smoothing: EWMA smoothing factor
+        window_days: Moving average window
+    """
+    if method == 'ewma':
+        decay = 1 - smoothing
+        scale = smoothing / (1 - decay ** history_days)
+        return scale * func.pow(decay, age)
+    if method == 'sma':
+        window_days = min(window_days, history_days)
+        return case((age < window_days, 1.0 / window_days), else_=0.0)
+    raise ValueError(f'Unknown forecast method: {method}')
+
+def forecast_reorder_points(weighted_units, weighted_squares, lead_time_days=7, service_z=1.65):
+    """Daily demand, its spread and a reorder point for every SKU at once.
+
+    Args:
+        weighted_units: Per-SKU sum of day weight * units
+        weighted_squares: Per-SKU sum of day weight * units squared
+        lead_time_days: Days between ordering and restocking
+        service_z: Safety factor, 1.65 covers about 95% of lead times
+
+    Returns:
+        Tuple of NumPy arrays (daily_demand, demand_std, reorder_point)
+    """
+    import numpy as np
+
+    demand = np.asarray(weighted_units, dtype=float)
+    variance = np.asarray(weighted_squares, dtype=float) - demand * demand
+    std = np.sqrt(np.maximum(variance, 0))
+    reorder_point = demand * lead_time_days + service_z * std * np.sqrt(lead_time_days)
+    return demand, std, reorder_point
+
+def compute_reorder_suggestions(today=None):
+    """Forecast demand for every medicine and store suggested min_stock_level values.
+
+    One query reduces the daily sales buckets to weighted sums per medicine,
+    so only one row per medicine leaves SQLite; NumPy then forecasts every
+    medicine at once. The sales counters must be current (see
+    `flask rebuild-sales-counters`). Medicines without sales in the history
+    window, or whose level already matches, get no suggestion. Replaces the
+    previous suggestions.
+
+    Returns:
+        Number of suggestions stored
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise RuntimeError('Demand forecasting requires NumPy; install it with `pip install numpy`.')
+
+    config = current_app.config
+    today = today or datetime.utcnow().date()
+    history_days = config['FORECAST_HISTORY_DAYS']
+    start = today - timedelta(days=history_days - 1)
+
+    age = func.julianday(today.isoformat()) - func.julianday(MedicineDailySales.sale_day)
+    weight = forecast_day_weight(age, history_days,
+                                 method=config['FORECAST_METHOD'],
+                                 smoothing=config['FORECAST_SMOOTHING'],
+                                 window_days=config['FORECAST_WINDOW_DAYS'])
+    history = select(
+        MedicineDailySales.medicine_id,
+        func.sum(weight * MedicineDailySales.units).label('weighted_units'),
+        func.sum(weight * MedicineDailySales.units * MedicineDailySales.units).label('weighted_squares')
+    ).where(
+        MedicineDailySales.sale_day >= start,
+        MedicineDailySales.sale_day <= today
+    ).group_by(MedicineDailySales.medicine_id).subquery()
+
+    # The join drops buckets of deleted medicines
+    rows = db.session.execute(
+        select(Medicine.id, func.coalesce(Medicine.min_stock_level, 0),
+               history.c.weighted_units, history.c.weighted_squares)
+        .join(history, history.c.medicine_id == Medicine.id)
+    ).all()
+    db.session.rollback()  # end the read transaction before writing
+
+    # Flattening first avoids NumPy inspecting each Row as a sequence
+    table = np.fromiter((value for row in rows for value in row), dtype=float,
+                        count=4 * len(rows)).reshape(-1, 4)
+    ids = table[:, 0].astype(np.int64)
+    current_levels = table[:, 1].astype(np.int64)
+    demand, std, reorder_point = forecast_reorder_points(
+        table[:, 2], table[:, 3],
+        lead_time_days=config['FORECAST_LEAD_TIME_DAYS'],
+        service_z=config['FORECAST_SERVICE_Z'])
+    suggested = np.maximum(np.ceil(reorder_point), 1).astype(np.int64)
+
+    changed = np.flatnonzero(suggested != current_levels)
+    computed_at = datetime.utcnow()
+    suggestions = [
+        {'medicine_id': medicine_id, 'current_min_stock_level': current, 'suggested_min_stock_level': level,
+         'daily_demand': daily, 'demand_std': spread, 'computed_at': computed_at}
+        for medicine_id, current, level, daily, spread in zip(
+            ids[changed].tolist(), current_levels[changed].tolist(), suggested[changed].tolist(),
+            np.round(demand[changed], 3).tolist(), np.round(std[changed], 3).tolist())
+    ]
+
+    def store():
+        ReorderSuggestion.query.delete()
+        if suggestions:
+            db.session.execute(ReorderSuggestion.__table__.insert(), suggestions)
+        db.session.commit()
+
+    run_with_lock_retry(store)
+    return len(suggestions)
+
+def accept_reorder_suggestions(medicine_ids=None, store_id=None):
+    """Copy suggested levels onto their medicines in one UPDATE and clear them.
+
+    Args:
+        medicine_ids: Medicines to accept, or None for every suggestion
+        store_id: Only accept suggestions for this branch's medicines
+
+    Returns:
+        Number of medicines updated
+    """
+    accepted = select(ReorderSuggestion.medicine_id)
+    if medicine_ids is not None:
+        accepted = accepted.where(ReorderSuggestion.medicine_id.in_(medicine_ids))
+    if store_id is not None:
+        # An alias, so the subquery is not correlated with the UPDATE's own medicine table
+        branch_medicine = aliased(Medicine)
+        accepted = accepted.where(ReorderSuggestion.medicine_id.in_(
+            select(branch_medicine.id).where(branch_medicine.store_id == store_id)))
+    suggested_level = select(ReorderSuggestion.suggested_min_stock_level).where(
+        ReorderSuggestion.medicine_id == Medicine.id
+    ).scalar_subquery()
+
+    def accept():
+        accepted_ids = db.session.scalars(accepted).all()
+        result = db.session.execute(
+            update(Medicine).where(Medicine.id.in_(accepted)).values(min_stock_level=suggested_level),
+            execution_options={'synchronize_session': False})
+        db.session.execute(ReorderSuggestion.__table__.delete().where(
+            ReorderSuggestion.medicine_id.in_(accepted)))
+        # The bulk UPDATE bypasses the flush events, so log the new rows here
+        for start in range(0, len(accepted_ids), 500):
+            chunk = accepted_ids[start:start + 500]
+            log_changes(db.session, db.session.scalars(
+                select(Medicine).where(Medicine.id.in_(chunk)).execution_options(populate_existing=True)),
+                'update')
+        db.session.commit()
+        return result.rowcount
+
+    return run_with_lock_retry(accept)
+
+class ReorderForecaster(BackgroundWorker):
+    """Recomputes the reorder suggestions every `interval` seconds."""
+
+    name = 'reorder-forecaster'
+    leased = True
+
+    def run_once(self):
+        compute_reorder_suggestions()
+
+@click.command('forecast-reorder-points')
+@with_appcontext
+def forecast_reorder_points_command():
+    """Forecast demand for every medicine and store suggested stock levels."""
+    init_db()
+    count = compute_reorder_suggestions()
+    click.echo(f'Stored {count} reorder suggestions.')
+
+@main.route('/reorder_suggestions')
+@login_required
+def reorder_suggestions():
+    if current_user.role != 'pharmacist':
+        flash('Only pharmacists can review reorder suggestions.', 'error')
+        return redirect(url_for('main.index'))
+
+    # Largest changes first; the rest are accepted with "Accept all"
+    change = func.abs(ReorderSuggestion.suggested_min_stock_level - ReorderSuggestion.current_min_stock_level)
+    in_store = store_condition(Medicine.store_id, current_store_id())
+    suggestions = db.session.query(ReorderSuggestion, Medicine).join(
+        Medicine, Medicine.id == ReorderSuggestion.medicine_id
+    ).filter(in_store).order_by(change.desc(), ReorderSuggestion.medicine_id).limit(REORDER_SUGGESTIONS_SHOWN).all()
+    total = db.session.query(func.count(ReorderSuggestion.medicine_id)).join(
+        Medicine, Medicine.id == ReorderSuggestion.medicine_id
+    ).filter(in_store).scalar()
+    computed_at = db.session.query(func.max(ReorderSuggestion.computed_at)).scalar()
+
+    return render_template('reorder_suggestions.html',
+                          suggestions=suggestions,
+                          total=total,
+                          computed_at=computed_at,
+                          lead_time_days=current_app.config['FORECAST_LEAD_TIME_DAYS'])
+
+@main.route('/reorder_suggestions/accept', methods=['POST'])
+@login_required
+def accept_reorder_suggestions_view():
+    if current_user.role != 'pharmacist':
+        flash('Only pharmacists can accept reorder suggestions.', 'error')
+        return redirect(url_for('main.index'))
+
+    store_id = current_store_id()
+    if request.form.get('accept_all'):
+        count = accept_reorder_suggestions(store_id=store_id)
+    else:
+        medicine_ids = request.form.getlist('medicine_ids', type=int)
+        if not medicine_ids:
+            flash('Select at least one suggestion to accept.', 'error')
+            return redirect(url_for('main.reorder_suggestions'))
+        count = accept_reorder_suggestions(medicine_ids, store_id=store_id)
+
+    flash(f'Updated the minimum stock level of {count} medicines.', 'success')
+    return redirect(url_for('main.reorder_suggestions'))
+
+@main.route('/reorder_suggestions/refresh', methods=['POST'])
+@login_required
+def refresh_reorder_suggestions():
+    if current_user.role != 'pharmacist':
+        flash('Only pharmacists can refresh reorder suggestions.', 'error')
+        return redirect(url_for('main.index'))
+
+    try:
+        count = compute_reorder_suggestions()
+    except RuntimeError as e:
+        flash(str(e), 'error')
+    else:
+        flash(f'Forecast complete: {count} medicines have a new suggested stock level.', 'success')
+    return redirect(url_for('main.reorder_suggestions'))
+
+# Chart series behind the report pages, each served as JSON by chart_data so
+# the pages render without waiting for them. Series read in their own
+# report transaction and are cached per branch in the ChartCache.
+def sales_totals_series(store_id):
+    with report_session() as reports:
+        sales = sales_since(reports)
+        count, revenue = reports.query(
+            func.count(sales.id), func.coalesce(func.sum(sales.quantity * sales.sale_price), 0)
+        ).filter(store_condition(sales.store_id, store_id)).one()
+    return {'count': count, 'revenue': float(revenue)}
+
+def daily_sales_series(store_id, days=7):
+    """Revenue for each of the last `days` days, from one GROUP BY over the sale_date index."""
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=days - 1)
+    with report_session() as reports:
+        sales = sales_since(reports, datetime.combine(start_date, time.min))
+        day_key = func.date(sales.sale_date)
+        totals = dict(reports.query(day_key, func.sum(sales.quantity * sales.sale_price)).filter(
+            store_condition(sales.store_id, store_id),
+            sales.sale_date >= datetime.combine(start_date, time.min),
+            sales.sale_date < datetime.combine(end_date + timedelta(days=1), time.min)
+        ).group_by(day_key).all())
+    labels = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+    return {'labels': labels, 'values': [float(totals.get(label) or 0) for label in labels]}
+
+def monthly_revenue_series(store_id):
+    with report_session() as reports:
+        sales = sales_since(reports)
+        month_key = func.strftime('%Y-%m', sales.sale_date)
+        rows = reports.query(month_key, func.sum(sales.quantity * sales.sale_price)).filter(
+            store_condition(sales.store_id, store_id)).group_by(month_key).order_by(month_key).all()
+    return {'labels': [datetime.strptime(month, '%Y-%m').strftime('%b %Y') for month, _ in rows],
+            'values': [float(total) for _, total in rows]}
+
+def sales_by_category_series(store_id):
+    with report_session() as reports:
+        sales = sales_since(reports)
+        rows = reports.query(sales.medicine_category, func.sum(sales.quantity * sales.sale_price)).filter(
+            store_condition(sales.store_id, store_id)).group_by(sales.medicine_category).all()
+    return {'labels': [category for category, _ in rows], 'values': [float(total) for _, total in rows]}
+
+def top_products_series(store_id):
+    # Top selling products come from the maintained counters
+    with report_session() as reports:
+        top_products = top_selling_medicines(5, session=reports, store_id=store_id)
+        return {'labels': [counter.medicine_name for counter in top_products],
+                'values': [counter.lifetime_units for counter in top_products]}
+
+def stock_status_series(store_id):
+    rows = chart_series('inventory_by_category', store_id)
+    return {'labels': ['Out of Stock', 'Low Stock', 'Well Stocked'],
+            'values': [sum(row[key] for row in rows) for key in ('out_of_stock', 'low_stock', 'well_stocked')]}
+
+def medicines_by_category_series(store_id):
+    rows = chart_series('inventory_by_category', store_id)
+    return {'labels': [row['category'] for row in rows], 'values': [row['count'] for row in rows]}
+
+def value_by_category_series(store_id):
+    rows = chart_series('inventory_by_category', store_id)
+    return {'labels': [row['category'] for row in rows], 'values': [row['value'] for row in rows]}
+
+CHART_SERIES = {
+    'sales_totals': sales_totals_series,
+    'daily_sales': daily_sales_series,
+    'monthly_revenue': monthly_revenue_series,
+    'sales_by_category': sales_by_category_series,
+    'top_products': top_products_series,
+    'inventory_by_category': lambda store_id: inventory_by_category(store_id=store_id),
+    'stock_status': stock_status_series,
+    'medicines_by_category': medicines_by_category_series,
+    'value_by_category': value_by_category_series,
+}
+
+# Which series a committed Sale or Medicine change makes stale
+SALES_CHART_SERIES = frozenset(['sales_totals', 'daily_sales', 'monthly_revenue',
+                                'sales_by_category', 'top_products'])
+INVENTORY_CHART_SERIES = frozenset(['inventory_by_category', 'stock_status',
+                                    'medicines_by_category', 'value_by_category'])
+
+def chart_series(name, store_id):
+    """The named series for a branch (None for all), from the cache when fresh."""
+    return current_app.extensions['chart_cache'].get((name, store_id), lambda: CHART_SERIES[name](store_id))
+
+@main.route('/reports/charts/<name>')
+@login_required
+def chart_data(name):
+    if current_user.role != 'store_manager':
+        return jsonify({'error': 'Only store managers can access reports.'}), 403
+    if name not in CHART_SERIES:
+        return jsonify({'error': f'Unknown chart series {name}.'}), 404
     
-    for i in range(7):
-        day = end_date - timedelta(days=i)
-        day_start = datetime.combine(day, datetime.min.time())
-        day_end = datetime.combine(day, datetime.max.time())
-        
-        day_sales = db.session.query(func.sum(Sale.quantity * Sale.sale_price)).filter(
-            Sale.sale_date >= day_start,
-            Sale.sale_date <= day_end
-        ).scalar() or 0
-        
-        daily_sales.insert(0, float(day_sales))
-        daily_labels.insert(0, day.strftime('%Y-%m-%d'))
+    return jsonify(chart_series(name, current_store_id()))
+
+@main.route('/sales_report')
+@login_required
+def sales_report():
+    if current_user.role != 'store_manager':
+        flash('Access denied. Store managers only.', 'error')
+        return redirect(url_for('main.index'))
     
-    # Monthly revenue data
-    monthly_data = {}
-    for sale in sales:
-        month_key = sale.sale_date.strftime('%Y-%m')
-        if month_key in monthly_data:
-            monthly_data[month_key] += sale.total_price
-        else:
-            monthly_data[month_key] = sale.total_price
+    # Current time for report header
+    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
-    # Sort by month
-    sorted_months = sorted(monthly_data.keys()) if monthly_data else []
-    month_labels = [datetime.strptime(m, '%Y-%m').strftime('%b %Y') for m in sorted_months]
-    month_values = [monthly_data[m] for m in sorted_months]
+    try:
+        filters = parse_sales_filters(request.args)
+    except ValueError:
+        flash('Invalid date format. Use YYYY-MM-DD', 'error')
+        filters = {}
+    store_id = filters['store_id'] = current_store_id()
     
-    # Sales by category
-    category_data = db.session.query(
-        Sale.medicine_category, func.sum(Sale.quantity * Sale.sale_price)
-    ).group_by(Sale.medicine_category).all()
-
-    category_labels = [item[0] for item in category_data]
-    category_values = [float(item[1]) for item in category_data]
-
-    # Top selling products
-    product_sales = {}
-    for sale in sales:
-        if sale.medicine_name in product_sales:
-            product_sales[sale.medicine_name] += sale.quantity
-        else:
-            product_sales[sale.medicine_name] = sale.quantity
+    # The charts load their series from chart_data once the page is shown
+    totals = chart_series('sales_totals', store_id)
     
-    # Sort products by sales quantity and get top 5
-    top_products = sorted(product_sales.items(), key=lambda x: x[1], reverse=True)[:5] if product_sales else []
-    product_labels = [p[0] for p in top_products]
-    product_values = [p[1] for p in top_products]
+    # Only the first page of the sales history; the table loads the rest on demand
+    with report_session() as reports:
+        sales, next_cursor = sales_history_page(reports, filters)
     
     return render_template('sales_report.html', 
                           sales=sales, 
-                          total_revenue=total_revenue,
-                          total_sales_count=total_sales_count,
-                          daily_labels=daily_labels,
-                          daily_sales=daily_sales,
-                          month_labels=month_labels,
-                          month_values=month_values,
-                          category_labels=category_labels,
-                          category_values=category_values,
-                          product_labels=product_labels,
-                          product_values=product_values,
+                          next_cursor=next_cursor,
+                          filters=filters,
+                          categories=MEDICINE_CATEGORIES,
+                          total_revenue=totals['revenue'],
+                          total_sales_count=totals['count'],
                           current_time=current_time)
 
 # Fix the context processor to ensure notifications are always updated
-@app.context_processor
+@main.app_context_processor
 def inject_medicines():
     if current_user.is_authenticated:
-        # Always check stock for store managers
-        if current_user.role == 'store_manager':
-            check_stock_and_notify()
+        store_id = current_store_id()
+        medicines = inventory_snapshot().medicines(store_id)
         
-        medicines = Medicine.query.all()
+        # Notification counts and the alert dropdown come from the latest
+        # stored stock check; the background scheduler keeps it fresh
+        stock_check = latest_stock_check()
+        if stock_check is None:
+            return {'medicines': medicines, 'stock_alerts': [], 'low_stock_count': 0,
+                    'out_of_stock_count': 0, 'notification_count': 0, 'stock_check_id': None}
         
-        # Calculate notification counts directly in the context processor
-        low_stock_count = 0
-        out_of_stock_count = 0
+        stock_alerts = StockAlert.query.filter(
+            StockAlert.check_id == stock_check.id,
+            store_condition(StockAlert.store_id, store_id),
+            StockAlert.alert_type.in_(['out_of_stock', 'low_stock'])
+        ).order_by(StockAlert.id).all()
         
-        for medicine in medicines:
-            if medicine.quantity <= 0:
-                out_of_stock_count += 1
-            elif medicine.quantity < medicine.min_stock_level:
-                low_stock_count += 1
+        if store_id is None:
+            low_stock_count, out_of_stock_count = stock_check.low_stock_count, stock_check.out_of_stock_count
+        else:
+            # The stored counts cover every branch, so count this branch's alerts
+            out_of_stock_count = sum(alert.alert_type == 'out_of_stock' for alert in stock_alerts)
+            low_stock_count = len(stock_alerts) - out_of_stock_count
                 
         return {
             'medicines': medicines,
+            'stock_alerts': stock_alerts,
             'low_stock_count': low_stock_count,
             'out_of_stock_count': out_of_stock_count,
-            'notification_count': low_stock_count + out_of_stock_count
+            'notification_count': low_stock_count + out_of_stock_count,
+            'stock_check_id': stock_check.id
         }
-    return {'medicines': [], 'low_stock_count': 0, 'out_of_stock_count': 0, 'notification_count': 0}
+    return {'medicines': [], 'stock_alerts': [], 'low_stock_count': 0, 'out_of_stock_count': 0,
+            'notification_count': 0, 'stock_check_id': None}
+
+
+@main.app_context_processor
+def inject_store():
+    if not current_user.is_authenticated:
+        return {'stores': [], 'current_store': None}
+    store_id = current_store_id()
+    # Only head-office users get the branch picker
+    stores = Store.query.order_by(Store.name).all() if current_user.store_id is None else []
+    return {'stores': stores, 'current_store': db.session.get(Store, store_id) if store_id else None}
 
+@main.route('/store/select', methods=['POST'])
+@login_required
+def select_store():
+    if current_user.store_id is not None:
+        flash('Branch staff can only work in their own store.', 'error')
+        return redirect(url_for('main.index'))
+    
+    store_id = request.form.get('store_id', type=int)
+    if store_id is None:
+        session.pop('store_id', None)
+        flash('Showing all branches.', 'success')
+    elif db.session.get(Store, store_id) is None:
+        flash('Unknown branch.', 'error')
+    else:
+        session['store_id'] = store_id
+        flash(f'Now working in {db.session.get(Store, store_id).name}.', 'success')
+    return redirect(url_for('main.index'))
 
-@app.route('/delete_medicine_direct/<int:id>', methods=['POST'])
+@main.route('/delete_medicine_direct/<int:id>', methods=['POST'])
 @login_required
 def delete_medicine_direct(id):
     if current_user.role != 'pharmacist':
         flash('Access denied: Pharmacists only', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     try:
-        medicine = Medicine.query.get_or_404(id)
+        medicine = get_store_medicine_or_404(id)
         medicine_name = medicine.name
         
         # We now allow deletion of medicines with sales records
         # since sales store medicine details independently
         
-        db.session.delete(medicine)
-        db.session.commit()
+        def delete_medicine():
+            target = db.session.get(Medicine, id)
+            if target is not None:
+                db.session.delete(target)
+
+        commit_write(delete_medicine)
         flash(f'Medicine {medicine_name} deleted successfully', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error deleting medicine: {str(e)}', 'error')
     
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
+
+def load_config_from_env():
+    """Build the application settings from environment variables.
+
+    Every setting has a development default; the readme's Configuration
+    and Operations section describes what each one does.
+    """
+    config = {
+        'SQLALCHEMY_DATABASE_URI': os.environ.get('DATABASE_URL', 'sqlite:///medical_store.db'),
+        'SECRET_KEY': os.environ.get('SECRET_KEY', 'your-secret-key-here'),
+    }
+
+    engine_options = {}
+    pool_settings = {
+        'pool_size': 'DB_POOL_SIZE',
+        'max_overflow': 'DB_MAX_OVERFLOW',
+        'pool_timeout': 'DB_POOL_TIMEOUT',
+        'pool_recycle': 'DB_POOL_RECYCLE',
+    }
+    for option, env_var in pool_settings.items():
+        if os.environ.get(env_var):
+            engine_options[option] = int(os.environ[env_var])
+    if os.environ.get('DB_POOL_PRE_PING'):
+        engine_options['pool_pre_ping'] = os.environ['DB_POOL_PRE_PING'].lower() in ('1', 'true', 'yes')
+    if engine_options:
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
+    # SQLITE_<PRAGMA> variables override individual entries of the profile,
+    # e.g. SQLITE_JOURNAL_MODE=DELETE or SQLITE_SYNCHRONOUS=FULL
+    pragmas = dict(DEFAULT_SQLITE_PRAGMAS)
+    for name in pragmas:
+        env_value = os.environ.get(f'SQLITE_{name.upper()}')
+        if env_value:
+            pragmas[name] = env_value
+    config['SQLITE_PRAGMAS'] = pragmas
+    # Retries, with exponential backoff, when a write finds the database locked
+    config['SQLITE_LOCK_RETRIES'] = int(os.environ.get('SQLITE_LOCK_RETRIES', 5))
+    config['SQLITE_LOCK_RETRY_DELAY'] = float(os.environ.get('SQLITE_LOCK_RETRY_DELAY', 0.05))
+    # Background stock check period in seconds (0 disables it) and how many checks are kept
+    config['STOCK_CHECK_INTERVAL'] = int(os.environ.get('STOCK_CHECK_INTERVAL', 300))
+    config['STOCK_CHECK_HISTORY'] = int(os.environ.get('STOCK_CHECK_HISTORY', 50))
+    # Rolling window of the per-medicine sales counters
+    config['SALES_COUNTER_WINDOW_DAYS'] = int(os.environ.get('SALES_COUNTER_WINDOW_DAYS', 30))
+    config['SALES_COUNTER_REFRESH_INTERVAL'] = int(os.environ.get('SALES_COUNTER_REFRESH_INTERVAL', 3600))
+    # Background report jobs: output directory, worker threads, and how long finished jobs are kept
+    config['REPORT_JOB_DIR'] = os.environ.get('REPORT_JOB_DIR')
+    config['REPORT_JOB_WORKERS'] = int(os.environ.get('REPORT_JOB_WORKERS', 2))
+    config['REPORT_JOB_POLL_INTERVAL'] = int(os.environ.get('REPORT_JOB_POLL_INTERVAL', 30))
+    config['REPORT_JOB_TIMEOUT'] = int(os.environ.get('REPORT_JOB_TIMEOUT', 3600))
+    config['REPORT_JOB_RETENTION_HOURS'] = int(os.environ.get('REPORT_JOB_RETENTION_HOURS', 24))
+    # Route request writes through one group-committing writer thread
+    config['SINGLE_WRITER'] = os.environ.get('SINGLE_WRITER', '').lower() in ('1', 'true', 'yes')
+    config['WRITE_BATCH_SIZE'] = int(os.environ.get('WRITE_BATCH_SIZE', 64))
+    config['WRITE_TIMEOUT'] = float(os.environ.get('WRITE_TIMEOUT', 30))
+    # How long change feed entries are kept and how often they are compacted
+    config['CHANGE_LOG_RETENTION_DAYS'] = int(os.environ.get('CHANGE_LOG_RETENTION_DAYS', 30))
+    config['CHANGE_LOG_COMPACT_INTERVAL'] = int(os.environ.get('CHANGE_LOG_COMPACT_INTERVAL', 86400))
+    # Sales older than SALES_ARCHIVE_DAYS move to the archive file (0 interval disables it)
+    config['SALES_ARCHIVE_PATH'] = os.environ.get('SALES_ARCHIVE_PATH')
+    config['SALES_ARCHIVE_DAYS'] = int(os.environ.get('SALES_ARCHIVE_DAYS', 365))
+    config['SALES_ARCHIVE_INTERVAL'] = int(os.environ.get('SALES_ARCHIVE_INTERVAL', 86400))
+    config['SALES_ARCHIVE_CHUNK_SIZE'] = int(os.environ.get('SALES_ARCHIVE_CHUNK_SIZE', 5000))
+    # Online backups: where, how often (0 disables them), how many are kept and how the copy is stepped
+    config['BACKUP_DIR'] = os.environ.get('BACKUP_DIR')
+    config['BACKUP_INTERVAL'] = int(os.environ.get('BACKUP_INTERVAL', 86400))
+    config['BACKUP_KEEP'] = int(os.environ.get('BACKUP_KEEP', 7))
+    config['BACKUP_PAGES_PER_STEP'] = int(os.environ.get('BACKUP_PAGES_PER_STEP', 1024))
+    config['BACKUP_STEP_PAUSE'] = float(os.environ.get('BACKUP_STEP_PAUSE', 0.01))
+    config['BACKUP_MAX_RESTARTS'] = int(os.environ.get('BACKUP_MAX_RESTARTS', 3))
+    # How long a crashed process can hold a periodic job before another takes it over
+    config['JOB_LEASE_SECONDS'] = int(os.environ.get('JOB_LEASE_SECONDS', 3600))
+    # Live event streams and how long their events are kept
+    config['SSE_KEEPALIVE_SECONDS'] = float(os.environ.get('SSE_KEEPALIVE_SECONDS', 15))
+    config['SSE_MAX_STREAM_SECONDS'] = float(os.environ.get('SSE_MAX_STREAM_SECONDS', 600))
+    config['SSE_POLL_SECONDS'] = float(os.environ.get('SSE_POLL_SECONDS', 1))
+    config['LIVE_EVENT_RETENTION_HOURS'] = int(os.environ.get('LIVE_EVENT_RETENTION_HOURS', 24))
+    # Gzip level for text responses (0 disables it) and the smallest body compressed
+    config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+    config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+    # Seconds report chart series are cached (0 disables it)
+    config['CHART_CACHE_TTL'] = int(os.environ.get('CHART_CACHE_TTL', 60))
+    # Fingerprinted assets, rendered-fragment cache (0 disables it) and compiled template cache
+    config['ASSET_BUILD_DIR'] = os.environ.get('ASSET_BUILD_DIR')
+    config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', 256))
+    config['JINJA_BYTECODE_CACHE'] = os.environ.get('JINJA_BYTECODE_CACHE', '1').lower() in ('1', 'true', 'yes')
+    config['JINJA_BYTECODE_CACHE_DIR'] = os.environ.get('JINJA_BYTECODE_CACHE_DIR')
+    # Seconds before the shared inventory snapshot is reloaded in full
+    config['INVENTORY_SNAPSHOT_MAX_AGE'] = int(os.environ.get('INVENTORY_SNAPSHOT_MAX_AGE', 300))
+    # Draft purchase orders restock a medicine to this many times its minimum level
+    config['PURCHASE_ORDER_TARGET_FACTOR'] = int(os.environ.get('PURCHASE_ORDER_TARGET_FACTOR', 2))
+    # Demand forecast behind reorder suggestions
+    config['FORECAST_METHOD'] = os.environ.get('FORECAST_METHOD', 'ewma')
+    config['FORECAST_HISTORY_DAYS'] = int(os.environ.get('FORECAST_HISTORY_DAYS', 730))
+    config['FORECAST_WINDOW_DAYS'] = int(os.environ.get('FORECAST_WINDOW_DAYS', 28))
+    config['FORECAST_SMOOTHING'] = float(os.environ.get('FORECAST_SMOOTHING', 0.1))
+    config['FORECAST_LEAD_TIME_DAYS'] = int(os.environ.get('FORECAST_LEAD_TIME_DAYS', 7))
+    config['FORECAST_SERVICE_Z'] = float(os.environ.get('FORECAST_SERVICE_Z', 1.65))
+    config['FORECAST_INTERVAL'] = int(os.environ.get('FORECAST_INTERVAL', 86400))
+    if os.environ.get('REPORTS_DATABASE_URL'):
+        config['REPORTS_DATABASE_URI'] = os.environ['REPORTS_DATABASE_URL']
+
+    return config
+
+def create_app(config=None):
+    """Application factory.
+
+    Args:
+        config: Optional mapping of settings applied on top of the environment config
+
+    Building the app does no database work; run `flask init-db` and
+    `flask seed-db` to create the schema and sample data.
+    """
+    app = Flask(__name__)
+    app.config.from_mapping(load_config_from_env())
+    if config:
+        app.config.from_mapping(config)
+
+    db.init_app(app)
+    with app.app_context():
+        if not app.config['SALES_ARCHIVE_PATH']:
+            database = db.engine.url.database
+            app.config['SALES_ARCHIVE_PATH'] = ':memory:' if database in (None, '', ':memory:') \
+                else f'{os.path.splitext(database)[0]}_archive.db'
+        # Engines exist after init_app but have not connected yet
+        for engine in db.engines.values():
+            configure_sqlite_engine(engine, app.config['SQLITE_PRAGMAS'])
+            register_sql_functions(engine)
+            attach_sales_archive(engine, app.config['SALES_ARCHIVE_PATH'], app.config['SQLITE_PRAGMAS'])
+        app.extensions['reports_engine'] = create_reports_engine(app)
+    app.extensions['inventory_snapshot'] = InventorySnapshot(app, app.config['INVENTORY_SNAPSHOT_MAX_AGE'])
+    app.extensions['event_broker'] = EventBroker(app, app.config['SSE_POLL_SECONDS'])
+    app.extensions['chart_cache'] = ChartCache(app.config['CHART_CACHE_TTL'])
+    if app.config['SINGLE_WRITER']:
+        app.extensions['write_queue'] = WriteQueue(app, app.config['WRITE_BATCH_SIZE'], app.config['WRITE_TIMEOUT'])
+    login_manager.init_app(app)
+    app.register_blueprint(main)
+    if not app.config['ASSET_BUILD_DIR']:
+        app.config['ASSET_BUILD_DIR'] = os.path.join(app.static_folder, 'dist')
+    app.extensions['asset_manifest'] = AssetManifest(app.static_folder, app.config['ASSET_BUILD_DIR'])
+
+    # Rendered fragments are shared by every request of this process, and
+    # compiled templates persist across restarts in the bytecode cache
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = app.extensions['fragment_cache'] = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'])
+    if app.config['JINJA_BYTECODE_CACHE']:
+        app.jinja_env.bytecode_cache = LazyBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+
+    if app.config['STOCK_CHECK_INTERVAL'] > 0:
+        app.extensions['stock_scheduler'] = StockCheckScheduler(app, app.config['STOCK_CHECK_INTERVAL'])
+    if app.config['SALES_COUNTER_REFRESH_INTERVAL'] > 0:
+        app.extensions['sales_counter_refresher'] = SalesCounterRefresher(
+            app, app.config['SALES_COUNTER_REFRESH_INTERVAL'])
+    if app.config['FORECAST_INTERVAL'] > 0:
+        app.extensions['reorder_forecaster'] = ReorderForecaster(app, app.config['FORECAST_INTERVAL'])
+    if app.config['CHANGE_LOG_COMPACT_INTERVAL'] > 0:
+        app.extensions['change_log_compactor'] = ChangeLogCompactor(app, app.config['CHANGE_LOG_COMPACT_INTERVAL'])
+    if app.config['SALES_ARCHIVE_INTERVAL'] > 0 and app.config['SALES_ARCHIVE_DAYS'] > 0:
+        app.extensions['sales_archiver'] = SalesArchiver(app, app.config['SALES_ARCHIVE_INTERVAL'])
+    if app.config['BACKUP_INTERVAL'] > 0:
+        app.extensions['database_backup'] = DatabaseBackupScheduler(app, app.config['BACKUP_INTERVAL'])
+    app.extensions['report_job_workers'] = [
+        ReportJobWorker(app, app.config['REPORT_JOB_POLL_INTERVAL'])
+        for _ in range(app.config['REPORT_JOB_WORKERS'])
+    ]
+
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(seed_db_command)
+    app.cli.add_command(build_assets_command)
+    app.cli.add_command(rebuild_sales_counters_command)
+    app.cli.add_command(rebuild_customers_command)
+    app.cli.add_command(forecast_reorder_points_command)
+    app.cli.add_command(compact_change_log_command)
+    app.cli.add_command(archive_sales_command)
+    app.cli.add_command(backup_db_command)
+    app.cli.add_command(add_store_command)
+    app.cli.add_command(assign_store_command)
+
+    return app
+
+# Default app used by `flask run`, WSGI servers and the tests
+app = create_app()
 
 if __name__ == '__main__':
+    with app.app_context():
+        init_db()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,31 @@
+"""Measure how long a fresh interpreter takes to import the app module.
+
+Each run happens in a new subprocess so nothing is cached between runs.
+
+Usage:
+    python benchmarks/cold_start.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+SNIPPET = (
+    "import time; start = time.perf_counter(); import app; "
+    "print(time.perf_counter() - start)"
+)
+
+def time_import():
+    output = subprocess.run(
+        [sys.executable, '-c', SNIPPET],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    timings = [time_import() for _ in range(runs)]
+    print(f"import app: median {statistics.median(timings) * 1000:.1f} ms, "
+          f"min {min(timings) * 1000:.1f} ms, max {max(timings) * 1000:.1f} ms over {runs} runs")
@@ -0,0 +1,110 @@
+"""Measure bytes on the wire and time to last byte for the largest pages,
+with and without gzip.
+
+Serves a throwaway database of medicines and sales over a local HTTP
+server, logs in as the store manager and fetches each page several times
+with and without `Accept-Encoding: gzip`. The fragment cache is off so
+every request renders in full.
+
+Usage:
+    python benchmarks/compression.py [medicines] [sales]
+"""
+import http.client
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from app import create_app, db, init_db
+
+# Loopback hides the wire, so transfer time is also estimated for a branch link
+LINK_MBIT = 10
+
+PAGES = ['/index', '/sales_report', '/reports/inventory_status',
+         '/reports/export_sales_csv', '/reports/purchase_orders?format=csv']
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+def build_database(path, medicines, sales):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        init_db()
+        db.engine.dispose()
+    app.extensions['reports_engine'].dispose()
+
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        'INSERT INTO medicine (store_id, name, category, price, quantity, min_stock_level, expiry_date, created_at, updated_at) '
+        "VALUES (1, ?, 'Vitamins', 9.99, ?, 10, '2030-01-01', '2024-01-01 09:00:00', '2024-01-01 09:00:00')",
+        ((f'Medicine {i}', i % 50) for i in range(medicines)))
+    connection.executemany(
+        'INSERT INTO sale (store_id, medicine_id, medicine_name, medicine_category, quantity, sale_price, sale_date) '
+        "VALUES (1, ?, ?, 'Vitamins', 2, 19.98, datetime('2024-01-01', ? || ' minutes'))",
+        ((i % medicines + 1, f'Medicine {i % medicines}', i) for i in range(sales)))
+    connection.commit()
+    connection.close()
+
+def log_in(port):
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    connection.request('POST', '/login', urlencode({'username': 'manager', 'password': 'manager123'}),
+                       {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.getheader('Set-Cookie').split(';', 1)[0]
+
+def fetch(port, path, cookie, gzip, repeats=5):
+    """Return (median seconds to last byte, bytes received)."""
+    headers = {'Cookie': cookie}
+    if gzip:
+        headers['Accept-Encoding'] = 'gzip'
+    timings, size = [], 0
+    for _ in range(repeats):
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        start = time.perf_counter()
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        timings.append(time.perf_counter() - start)
+        connection.close()
+        size = len(body)
+    return statistics.median(timings), size
+
+def main():
+    medicines = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    sales = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'compression.db')
+        build_database(path, medicines, sales)
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'TESTING': True,
+                          'FRAGMENT_CACHE_SIZE': 0})
+        server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            cookie = log_in(server.port)
+            print(f'{medicines} medicines, {sales} sales')
+            print(f'time to last byte on loopback, and with the transfer at {LINK_MBIT} Mbit/s')
+            print(f'{"page":38} {"identity":>34} {"gzip":>34}')
+            for page in PAGES:
+                columns = []
+                for gzip in (False, True):
+                    seconds, size = fetch(server.port, page, cookie, gzip)
+                    link = seconds + size * 8 / (LINK_MBIT * 1_000_000)
+                    columns.append(f'{size / 1024:8.1f} KiB {seconds * 1000:7.1f} ms {link * 1000:7.1f} ms')
+                print(f'{page:38} ' + ' '.join(columns))
+        finally:
+            server.shutdown()
+            app.extensions['inventory_snapshot'].close()
+
+if __name__ == '__main__':
+    main()
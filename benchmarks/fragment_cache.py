@@ -0,0 +1,79 @@
+"""Time the inventory page with and without fragment caching, and template
+compilation with and without the persistent bytecode cache.
+
+Builds a throwaway database with the requested number of medicines and
+renders /index as a pharmacist repeatedly, first with FRAGMENT_CACHE_SIZE=0
+and then with the cache on. Then compiles every template in a fresh app
+against an empty and a warm bytecode cache directory.
+
+Usage:
+    python benchmarks/fragment_cache.py [medicines]
+"""
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db, init_db
+
+def build_database(path, medicines):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        init_db()
+        db.engine.dispose()
+    app.extensions['reports_engine'].dispose()
+
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        'INSERT INTO medicine (store_id, name, category, price, quantity, min_stock_level, expiry_date, created_at, updated_at) '
+        "VALUES (1, ?, 'Vitamins', 9.99, ?, 10, '2030-01-01', '2024-01-01 09:00:00', '2024-01-01 09:00:00')",
+        ((f'Medicine {i}', i % 50) for i in range(medicines)))
+    connection.commit()
+    connection.close()
+
+def time_index(path, fragment_cache_size, requests=20):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'TESTING': True,
+                      'FRAGMENT_CACHE_SIZE': fragment_cache_size})
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = 1  # the default pharmacist
+    client.get('/index')  # warm the snapshot and template
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get('/index')
+        timings.append(time.perf_counter() - start)
+    with app.app_context():
+        db.engine.dispose()
+    app.extensions['reports_engine'].dispose()
+    app.extensions['inventory_snapshot'].close()
+    return statistics.median(timings)
+
+def time_template_compile(cache_dir):
+    app = create_app({'JINJA_BYTECODE_CACHE_DIR': cache_dir})
+    start = time.perf_counter()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    return time.perf_counter() - start
+
+def main():
+    medicines = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'fragments.db')
+        build_database(path, medicines)
+        uncached = time_index(path, 0)
+        cached = time_index(path, 256)
+        print(f'/index with {medicines} medicines: {uncached * 1000:.1f} ms uncached, '
+              f'{cached * 1000:.1f} ms from the fragment cache')
+
+        cache_dir = os.path.join(tmp, 'jinja')
+        cold = time_template_compile(cache_dir)
+        warm = time_template_compile(cache_dir)
+        print(f'compiling all templates: {cold * 1000:.1f} ms cold, {warm * 1000:.1f} ms from bytecode cache')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Compare the memory and time of the inventory snapshot with loading ORM objects.
+
+Builds a throwaway database with the requested number of medicines, then
+measures with tracemalloc what Medicine.query.all() allocates for one
+request and what the shared InventorySnapshot holds, plus the cost of a
+snapshot read after one medicine changed.
+
+Usage:
+    python benchmarks/inventory_snapshot.py [medicines]
+"""
+import gc
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db, create_missing_indexes, Medicine, inventory_snapshot
+
+def build_database(path, medicines):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        db.create_all()
+        create_missing_indexes()
+        db.engine.dispose()
+
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        'INSERT INTO medicine (name, category, price, quantity, min_stock_level, expiry_date, created_at, updated_at) '
+        "VALUES (?, 'Vitamins', 9.99, ?, 10, '2030-01-01', '2024-01-01 09:00:00', '2024-01-01 09:00:00')",
+        ((f'Medicine {i}', i % 50) for i in range(medicines)))
+    connection.commit()
+    connection.close()
+
+def measure(load):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+def main():
+    medicines = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'snapshot.db')
+        build_database(path, medicines)
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+        with app.app_context():
+            orm_rows, orm_size, orm_time = measure(lambda: Medicine.query.all())
+            print(f'ORM objects: {orm_size / 1e6:.1f} MB, {orm_time:.2f}s per request')
+            del orm_rows
+            db.session.remove()
+
+            snapshot = inventory_snapshot()
+            _, snapshot_size, snapshot_time = measure(snapshot.medicines)
+            print(f'snapshot:    {snapshot_size / 1e6:.1f} MB once per process, {snapshot_time:.2f}s to build')
+
+            start = time.perf_counter()
+            snapshot.medicines()
+            print(f'unchanged snapshot read: {(time.perf_counter() - start) * 1000:.2f} ms')
+
+            medicine = db.session.get(Medicine, 1)
+            medicine.quantity += 1
+            db.session.commit()
+            start = time.perf_counter()
+            snapshot.medicines()
+            print(f'read after one change: {(time.perf_counter() - start) * 1000:.1f} ms')
+            snapshot.close()
+            db.engine.dispose()
+        app.extensions['reports_engine'].dispose()
+
+if __name__ == '__main__':
+    main()
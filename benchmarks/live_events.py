@@ -0,0 +1,71 @@
+"""Measure what idle live event streams cost and how fast a sale reaches them.
+
+Opens the requested number of streams on threads, as a threaded server
+would, lets them sit idle, then publishes sales and times how long every
+stream takes to receive each one. Sales are published by this process
+and then by a second app on the same database file, which stands in for
+another worker process and reaches the streams only through polling.
+
+Usage:
+    python benchmarks/live_events.py [streams] [idle_seconds]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db, live_event_stream
+
+def main():
+    streams = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    idle_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    with tempfile.TemporaryDirectory() as directory:
+        uri = f'sqlite:///{os.path.join(directory, "events.db")}'
+        app, other_process = create_app({'SQLALCHEMY_DATABASE_URI': uri}), create_app({'SQLALCHEMY_DATABASE_URI': uri})
+        with app.app_context():
+            db.create_all()
+        run(app.extensions['event_broker'], other_process.extensions['event_broker'], streams, idle_seconds)
+        for each_app in (app, other_process):
+            each_app.extensions['event_broker'].close()
+
+def run(broker, other_broker, streams, idle_seconds):
+    received = []
+    lock = threading.Lock()
+    after_id = broker.last_id
+
+    def client():
+        for frame in live_event_stream(broker, None, after_id, {}, keepalive=15, max_seconds=idle_seconds + 30):
+            if frame.startswith('id:'):
+                with lock:
+                    received.append(time.perf_counter())
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(streams)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)
+    received.clear()  # the opening snapshots
+
+    cpu_start = time.process_time()
+    time.sleep(idle_seconds)
+    idle_cpu = time.process_time() - cpu_start
+    print(f'{streams} idle streams polling every {broker.poll_interval:g}s: '
+          f'{idle_cpu * 1000:.1f} ms CPU over {idle_seconds:.0f}s')
+
+    for label, publisher in [('this process', broker), ('another process', other_broker)]:
+        latencies = []
+        for number in range(20):
+            received.clear()
+            start = time.perf_counter()
+            publisher.publish('sale', {'sale_id': number, 'total': 9.99})
+            while len(received) < streams:
+                time.sleep(0.0005)
+            latencies.append(max(received) - start)
+        latencies.sort()
+        print(f'sale from {label} delivered to all {streams} streams: median {latencies[10] * 1000:.2f} ms, '
+              f'worst {latencies[-1] * 1000:.2f} ms')
+
+if __name__ == '__main__':
+    main()
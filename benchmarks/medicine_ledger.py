@@ -0,0 +1,62 @@
+"""Time the per-medicine ledger queries against a large sales table.
+
+Builds a throwaway database with the requested number of sales spread over
+2,000 medicines and two years, then times one ledger page, the velocity
+windows and the 90-day daily series for a single medicine.
+
+Usage:
+    python benchmarks/medicine_ledger.py [sales]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import (create_app, db, create_missing_indexes, sales_history_page,
+                 medicine_sales_velocity, medicine_daily_units)
+
+MEDICINES = 2000
+
+def build_database(path, sales):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        db.create_all()
+        create_missing_indexes()
+        db.engine.dispose()
+
+    # Raw executemany keeps the setup time reasonable for millions of rows
+    now = datetime.now()
+    connection = sqlite3.connect(path)
+    rows = ((random.randint(1, MEDICINES), 'Medicine', 'Category', random.randint(1, 3), 9.99,
+             (now - timedelta(minutes=random.randint(0, 2 * 365 * 24 * 60))).isoformat(' '))
+            for _ in range(sales))
+    connection.executemany(
+        'INSERT INTO sale (medicine_id, medicine_name, medicine_category, quantity, sale_price, sale_date) '
+        'VALUES (?, ?, ?, ?, ?, ?)', rows)
+    connection.commit()
+    connection.execute('ANALYZE')
+    connection.close()
+    return app
+
+def timed(label, fn, repeats=20):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    print(f'{label:<28} {(time.perf_counter() - start) / repeats * 1000:8.2f} ms')
+
+if __name__ == '__main__':
+    sales = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    path = os.path.join(tempfile.mkdtemp(), 'ledger.db')
+    print(f'Building {sales:,} sales over {MEDICINES:,} medicines...')
+    app = build_database(path, sales)
+
+    with app.app_context():
+        medicine_id = random.randint(1, MEDICINES)
+        timed('ledger page (50 rows)', lambda: sales_history_page(db.session, {'medicine_id': medicine_id}))
+        timed('velocity 7/30/90 days', lambda: medicine_sales_velocity(db.session, medicine_id))
+        timed('daily units, 90 days', lambda: medicine_daily_units(db.session, medicine_id))
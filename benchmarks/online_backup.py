@@ -0,0 +1,85 @@
+"""Time online backups and VACUUM INTO snapshots under concurrent sales.
+
+Builds a throwaway database with the requested number of sales, then takes
+a stepped backup, a one-step backup and a snapshot while a second
+connection records a sale every 10 ms. Each line shows what the backup
+reported and how long the concurrent sale commits waited.
+
+Usage:
+    python benchmarks/online_backup.py [sales] [journal_mode]
+"""
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db, init_db, backup_database, describe_backup
+
+def build_database(path, sales, journal_mode):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        init_db()
+        db.engine.dispose()
+    app.extensions['reports_engine'].dispose()
+
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        'INSERT INTO sale (store_id, medicine_id, medicine_name, medicine_category, quantity, sale_price, sale_date) '
+        "VALUES (1, ?, ?, 'Vitamins', ?, 4.5, datetime('2024-01-01', ? || ' seconds'))",
+        ((i % 2000 + 1, f'Medicine {i % 2000 + 1}', 1 + i % 5, i * 60) for i in range(sales)))
+    connection.commit()
+    connection.execute(f'PRAGMA journal_mode={journal_mode}')
+    connection.close()
+
+def record_sales(path, stop, latencies, errors):
+    connection = sqlite3.connect(path, timeout=5)
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            connection.execute(
+                "INSERT INTO sale (store_id, medicine_id, medicine_name, medicine_category, quantity, sale_price, "
+                "sale_date) VALUES (1, 1, 'Medicine 1', 'Vitamins', 1, 4.5, datetime('now'))")
+            connection.commit()
+            latencies.append(time.perf_counter() - start)
+        except sqlite3.OperationalError:
+            connection.rollback()
+            errors.append(time.perf_counter() - start)
+        time.sleep(0.01)
+    connection.close()
+
+def main():
+    sales = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    journal_mode = sys.argv[2] if len(sys.argv) > 2 else 'WAL'
+    cases = [
+        ('stepped backup', dict(BACKUP_PAGES_PER_STEP=1024), False),
+        ('one-step backup', dict(BACKUP_PAGES_PER_STEP=-1), False),
+        ('VACUUM INTO snapshot', {}, True),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'store.db')
+        build_database(path, sales, journal_mode)
+        print(f'{sales} sales, {os.path.getsize(path) / 2**20:.0f} MiB, journal_mode={journal_mode}')
+        for label, config, snapshot in cases:
+            app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'BACKUP_DIR': tmp,
+                              'SQLITE_PRAGMAS': {'busy_timeout': 5000, 'journal_mode': journal_mode}, **config})
+            stop = threading.Event()
+            latencies, errors = [], []
+            writer = threading.Thread(target=record_sales, args=(path, stop, latencies, errors))
+            writer.start()
+            with app.app_context():
+                report = backup_database(snapshot)
+                db.engine.dispose()
+            stop.set()
+            writer.join()
+            app.extensions['reports_engine'].dispose()
+            print(f'{label}: {describe_backup(report).replace(tmp + os.sep, "")}')
+            print(f'  {len(latencies)} concurrent sale commits, median {statistics.median(latencies) * 1000:.1f} ms, '
+                  f'max {max(latencies) * 1000:.1f} ms, {len(errors)} failed with database is locked')
+
+if __name__ == '__main__':
+    main()
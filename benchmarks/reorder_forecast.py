@@ -0,0 +1,73 @@
+"""Time the reorder forecast over a large catalogue.
+
+Builds a throwaway database with the requested number of medicines and two
+years of daily sales buckets, where each medicine sells on `density` of the
+days, then times compute_reorder_suggestions() with both forecast methods.
+
+Usage:
+    python benchmarks/reorder_forecast.py [medicines] [density]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db, create_missing_indexes, compute_reorder_suggestions
+
+HISTORY_DAYS = 730
+
+def build_database(path, medicines, density):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        db.create_all()
+        create_missing_indexes()
+        db.engine.dispose()
+
+    rng = np.random.default_rng(1)
+    today = date.today()
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        'INSERT INTO medicine (id, name, category, price, quantity, min_stock_level, expiry_date) '
+        "VALUES (?, 'Medicine', 'Category', 9.99, 100, 10, '2030-01-01')",
+        ((i,) for i in range(1, medicines + 1)))
+
+    # One day of buckets at a time keeps memory flat for large catalogues
+    days = [(today - timedelta(days=age)).isoformat() for age in range(HISTORY_DAYS)]
+    rows = 0
+    for day in days:
+        selling = np.flatnonzero(rng.random(medicines) < density) + 1
+        units = rng.poisson(4, size=len(selling)) + 1
+        connection.executemany(
+            'INSERT INTO medicine_daily_sales (medicine_id, sale_day, units, revenue) VALUES (?, ?, ?, 0)',
+            zip(selling.tolist(), [day] * len(selling), units.tolist()))
+        rows += len(selling)
+    connection.commit()
+    connection.close()
+    return rows
+
+def main():
+    medicines = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    density = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'forecast.db')
+        start = time.perf_counter()
+        rows = build_database(path, medicines, density)
+        print(f'built {medicines:,} medicines and {rows:,} daily buckets in {time.perf_counter() - start:.1f}s')
+
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+        with app.app_context():
+            for method in ['ewma', 'sma']:
+                app.config['FORECAST_METHOD'] = method
+                start = time.perf_counter()
+                stored = compute_reorder_suggestions()
+                print(f'{method}: {stored:,} suggestions in {time.perf_counter() - start:.2f}s')
+            db.engine.dispose()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Time the sales analytics query over several years of history.
+
+Builds a throwaway database with the requested number of sales spread over
+three branches, 2,000 medicines and three years, then times one analytics
+call per granularity, branch and filter combination.
+
+Usage:
+    python benchmarks/sales_analytics.py [sales]
+"""
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db, init_db, sales_analytics
+
+MEDICINES = 2000
+YEARS = 3
+CATEGORIES = ['Vitamins', 'Antibiotics', 'Pain Relief', 'Allergy', 'Digestive', 'First Aid']
+
+CASES = [
+    ('all branches, month', dict(granularity='month')),
+    ('all branches, week', dict(granularity='week')),
+    ('all branches, day', dict(granularity='day')),
+    ('one branch, day', dict(granularity='day', store_id=2)),
+    ('all branches, day, one category', dict(granularity='day', category='Vitamins')),
+    ('one branch, day, one medicine', dict(granularity='day', store_id=2, medicine_id=17)),
+    ('all branches, hour, last 30 days', dict(granularity='hour', start_date=date(2024, 12, 2))),
+]
+
+def build_database(path, sales):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        init_db()
+        db.engine.dispose()
+    app.extensions['reports_engine'].dispose()
+
+    rng = random.Random(1)
+    seconds = YEARS * 365 * 86400
+    rows = []
+    for i in range(sales):
+        medicine_id = rng.randint(1, MEDICINES)
+        rows.append((rng.randint(1, 3), medicine_id, f'Medicine {medicine_id}', CATEGORIES[medicine_id % 6],
+                     rng.randint(1, 5), 4.5, i * seconds // sales))
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        'INSERT INTO sale (store_id, medicine_id, medicine_name, medicine_category, quantity, sale_price, sale_date) '
+        "VALUES (?, ?, ?, ?, ?, ?, datetime('2022-01-01', ? || ' seconds'))", rows)
+    connection.commit()
+    connection.close()
+
+def main():
+    sales = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'analytics.db')
+        build_database(path, sales)
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+        with app.app_context():
+            print(f'{sales} sales over {YEARS} years')
+            for label, options in CASES:
+                options = dict(options)
+                start_date = options.pop('start_date', date(2022, 1, 1))
+                timings = []
+                for _ in range(3):
+                    start = time.perf_counter()
+                    buckets = sales_analytics(db.session, start_date, date(2024, 12, 31), **options)
+                    timings.append(time.perf_counter() - start)
+                print(f'{label:36} {len(buckets):6} buckets {statistics.median(timings) * 1000:8.1f} ms')
+            db.engine.dispose()
+        app.extensions['reports_engine'].dispose()
+
+if __name__ == '__main__':
+    main()
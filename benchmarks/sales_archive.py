@@ -0,0 +1,121 @@
+"""Time hot-table reports before and after archiving old sales.
+
+Builds a throwaway database with the requested number of sales spread
+evenly over three years, times a few recent-range reports, moves sales
+older than a year to the archive file and times them again. While the
+archive runs, a second connection records a sale every 10 ms and reports
+how long its commits waited.
+
+Usage:
+    python benchmarks/sales_archive.py [sales]
+"""
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import (create_app, db, init_db, archive_sales, report_session, sales_analytics,
+                 sales_history_page, daily_sales_series, live_snapshot)
+
+YEARS = 3
+
+def build_database(path, sales):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        init_db()
+        db.engine.dispose()
+    app.extensions['reports_engine'].dispose()
+
+    seconds = YEARS * 365 * 86400
+    start = datetime.utcnow() - timedelta(seconds=seconds)
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        'INSERT INTO sale (store_id, medicine_id, medicine_name, medicine_category, quantity, sale_price, sale_date) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        ((i % 3 + 1, i % 2000 + 1, f'Medicine {i % 2000 + 1}', 'Vitamins', 1 + i % 5, 4.5,
+          (start + timedelta(seconds=i * seconds // sales)).isoformat(' ')) for i in range(sales)))
+    connection.commit()
+    connection.close()
+
+def time_reports(app):
+    today = datetime.now().date()
+    cases = [
+        ('history, first page', lambda reports: sales_history_page(reports, {})),
+        ('history, one branch, last week', lambda reports: sales_history_page(
+            reports, {'store_id': 2, 'start_date': today - timedelta(days=7)})),
+        ('analytics, last 30 days by day', lambda reports: sales_analytics(
+            reports, today - timedelta(days=29), today, 'day')),
+        ('analytics, last 90 days by hour', lambda reports: sales_analytics(
+            reports, today - timedelta(days=89), today, 'hour')),
+        ('analytics, all years by month', lambda reports: sales_analytics(
+            reports, today - timedelta(days=YEARS * 365), today, 'month')),
+    ]
+    with app.app_context():
+        for label, run in cases:
+            timings = []
+            for _ in range(5):
+                start = time.perf_counter()
+                with report_session() as reports:
+                    run(reports)
+                timings.append(time.perf_counter() - start)
+            print(f'  {label:34} {statistics.median(timings) * 1000:8.2f} ms')
+        for label, run in [('daily sales chart', lambda: daily_sales_series(None)),
+                           ('live snapshot', lambda: live_snapshot())]:
+            timings = []
+            for _ in range(5):
+                start = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - start)
+            print(f'  {label:34} {statistics.median(timings) * 1000:8.2f} ms')
+
+def record_sales(path, stop, latencies):
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute('PRAGMA journal_mode=WAL')
+    while not stop.is_set():
+        start = time.perf_counter()
+        connection.execute(
+            "INSERT INTO sale (store_id, medicine_id, medicine_name, medicine_category, quantity, sale_price, sale_date) "
+            "VALUES (1, 1, 'Medicine 1', 'Vitamins', 1, 4.5, ?)", (datetime.utcnow().isoformat(' '),))
+        connection.commit()
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.01)
+    connection.close()
+
+def main():
+    sales = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'archive.db')
+        build_database(path, sales)
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+        print(f'{sales} sales over {YEARS} years, all hot')
+        time_reports(app)
+
+        stop = threading.Event()
+        latencies = []
+        writer = threading.Thread(target=record_sales, args=(path, stop, latencies))
+        writer.start()
+        with app.app_context():
+            start = time.perf_counter()
+            archived = archive_sales(older_than_days=365)
+            elapsed = time.perf_counter() - start
+        stop.set()
+        writer.join()
+        print(f'archived {archived} sales in {elapsed:.1f} s; {len(latencies)} concurrent sale commits, '
+              f'median {statistics.median(latencies) * 1000:.1f} ms, max {max(latencies) * 1000:.1f} ms')
+        print(f'hot file {os.path.getsize(path) / 2**20:.0f} MiB, '
+              f'archive file {os.path.getsize(os.path.join(tmp, "archive_archive.db")) / 2**20:.0f} MiB')
+
+        print('after archiving sales older than a year')
+        time_reports(app)
+        with app.app_context():
+            db.engine.dispose()
+        app.extensions['reports_engine'].dispose()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Mixed read/write throughput for each step of the SQLite connection profile.
+
+Writer threads record sales (insert a Sale, decrement stock, commit) while
+reader threads run the sales-by-category aggregate used by the reports.
+Every profile runs against a fresh database file for the same duration.
+
+Usage:
+    python benchmarks/sqlite_profile.py [seconds_per_profile] [writers] [readers]
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+
+from app import create_app, db, Medicine, Sale, DEFAULT_SQLITE_PRAGMAS
+
+PROFILES = {
+    'stock settings': {},
+    'busy_timeout': {'busy_timeout': 5000},
+    '+ WAL': {'busy_timeout': 5000, 'journal_mode': 'WAL'},
+    '+ synchronous=NORMAL': {'busy_timeout': 5000, 'journal_mode': 'WAL', 'synchronous': 'NORMAL'},
+    '+ cache/mmap/temp_store': DEFAULT_SQLITE_PRAGMAS,
+}
+
+def seed(app, medicines=200, sales=20000):
+    with app.app_context():
+        db.create_all()
+        db.session.bulk_save_objects([
+            Medicine(name=f'Medicine {i}', category=f'Category {i % 12}', price=5.0 + i % 20,
+                     quantity=10 ** 6, min_stock_level=10, expiry_date=date.today() + timedelta(days=365))
+            for i in range(medicines)
+        ])
+        now = datetime.now()
+        db.session.bulk_save_objects([
+            Sale(medicine_id=i % medicines + 1, medicine_name=f'Medicine {i % medicines}',
+                 medicine_category=f'Category {i % 12}', quantity=1 + i % 3, sale_price=9.99,
+                 sale_date=now - timedelta(minutes=i))
+            for i in range(sales)
+        ])
+        db.session.commit()
+
+def run_profile(name, pragmas, seconds, writers, readers):
+    workdir = tempfile.mkdtemp()
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(workdir, "bench.db")}',
+        'SQLITE_PRAGMAS': pragmas,
+    })
+    seed(app)
+
+    counts = {'writes': 0, 'reads': 0, 'lock_errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def bump(key):
+        with lock:
+            counts[key] += 1
+
+    def writer():
+        with app.app_context():
+            while time.perf_counter() < deadline:
+                medicine = db.session.get(Medicine, random.randint(1, 200))
+                try:
+                    db.session.add(Sale(medicine_id=medicine.id, medicine_name=medicine.name,
+                                        medicine_category=medicine.category, quantity=1,
+                                        sale_price=medicine.price))
+                    medicine.quantity -= 1
+                    db.session.commit()
+                    bump('writes')
+                except OperationalError:
+                    db.session.rollback()
+                    bump('lock_errors')
+
+    def reader():
+        with app.app_context():
+            while time.perf_counter() < deadline:
+                try:
+                    db.session.query(Sale.medicine_category, func.sum(Sale.quantity * Sale.sale_price)) \
+                        .group_by(Sale.medicine_category).all()
+                    db.session.rollback()
+                    bump('reads')
+                except OperationalError:
+                    db.session.rollback()
+                    bump('lock_errors')
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        db.engine.dispose()
+    print(f"{name:<26} writes/s {counts['writes'] / seconds:>8.1f}   "
+          f"reads/s {counts['reads'] / seconds:>7.1f}   lock errors {counts['lock_errors']}")
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    readers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    print(f"{writers} writer and {readers} reader threads, {seconds:g}s per profile")
+    for name, pragmas in PROFILES.items():
+        run_profile(name, pragmas, seconds, writers, readers)
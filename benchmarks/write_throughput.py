@@ -0,0 +1,82 @@
+"""Compare sales per second with and without the single-writer queue.
+
+Builds a throwaway database with a few hundred medicines, then runs 1, 8 and
+32 concurrent tills for a fixed number of seconds, each till calling
+sell_medicine() in a loop. Every request thread commits on its own in the
+direct path; with SINGLE_WRITER the writer thread groups queued sales into
+one transaction.
+
+Usage:
+    python benchmarks/write_throughput.py [seconds]
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db, create_missing_indexes, Medicine, sell_medicine
+
+MEDICINES = 500
+TILLS = (1, 8, 32)
+
+def build_app(path, single_writer):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': max(TILLS) + 8},
+        'SINGLE_WRITER': single_writer,
+    })
+    with app.app_context():
+        db.create_all()
+        create_missing_indexes()
+        db.session.add_all(Medicine(name=f'Medicine {i}', category='Vitamins', price=9.99,
+                                    quantity=10_000_000, min_stock_level=10,
+                                    expiry_date=date(2030, 1, 1))
+                           for i in range(MEDICINES))
+        db.session.commit()
+    return app
+
+def run_tills(app, tills, seconds):
+    sold = [0] * tills
+    failures = [0] * tills
+    deadline = time.perf_counter() + seconds
+
+    def till(index):
+        with app.app_context():
+            while time.perf_counter() < deadline:
+                try:
+                    sell_medicine(random.randint(1, MEDICINES), 1, 'Benchmark')
+                    sold[index] += 1
+                except Exception:
+                    failures[index] += 1
+                db.session.remove()
+
+    threads = [threading.Thread(target=till, args=(i,)) for i in range(tills)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(sold), sum(failures)
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    for single_writer in (False, True):
+        label = 'single writer' if single_writer else 'direct commit'
+        for tills in TILLS:
+            with tempfile.TemporaryDirectory() as tmp:
+                app = build_app(os.path.join(tmp, 'writes.db'), single_writer)
+                sold, failures = run_tills(app, tills, seconds)
+                print(f'{label}, {tills:2d} tills: {sold / seconds:7.0f} sales/s ({failures} failed)')
+                if single_writer:
+                    app.extensions['write_queue'].stop(timeout=5)
+                with app.app_context():
+                    db.engine.dispose()
+                app.extensions['reports_engine'].dispose()
+                app.extensions['inventory_snapshot'].close()
+
+if __name__ == '__main__':
+    main()
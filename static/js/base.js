@@ -0,0 +1,39 @@
+document.addEventListener('DOMContentLoaded', function() {
+    // Theme toggle functionality
+    const themeToggle = document.getElementById('theme-toggle');
+    const prefersDark = window.matchMedia('(prefers-color-scheme: dark)').matches;
+
+    // Set initial theme based on localStorage or system preference
+    if (localStorage.getItem('theme') === 'dark' || (!localStorage.getItem('theme') && prefersDark)) {
+        document.documentElement.setAttribute('data-theme', 'dark');
+        themeToggle.checked = true;
+    }
+
+    themeToggle.addEventListener('change', function() {
+        if (this.checked) {
+            document.documentElement.setAttribute('data-theme', 'dark');
+            localStorage.setItem('theme', 'dark');
+        } else {
+            document.documentElement.setAttribute('data-theme', 'light');
+            localStorage.setItem('theme', 'light');
+        }
+    });
+
+    // Add fade-in class to content for animation
+    const contentContainer = document.querySelector('.container.mt-4');
+    if (contentContainer) {
+        contentContainer.classList.add('fade-in');
+    }
+
+    // Add animation class for notification bell
+    const notificationBell = document.querySelector('.bi-bell-fill');
+    if (notificationBell && document.querySelector('.notification-badge:not(.d-none)')) {
+        notificationBell.classList.add('notification-bell');
+    }
+
+    // Make tables with long content scrollable horizontally
+    const tables = document.querySelectorAll('.table-responsive');
+    tables.forEach(table => {
+        table.style.maxHeight = '70vh';
+    });
+});
@@ -0,0 +1,12 @@
+// Report charts are drawn empty with the page and filled from their JSON
+// series endpoints, so a slow series only delays its own chart
+function fillChart(chart, url) {
+    return fetch(url, {credentials: 'same-origin'})
+        .then(response => response.json())
+        .then(series => {
+            chart.data.labels = series.labels;
+            chart.data.datasets[0].data = series.values;
+            chart.update();
+            return chart;
+        });
+}
@@ -0,0 +1,59 @@
+// Live alerts and sales pushed by the server; pages listen for the
+// live:* DOM events to update their own figures
+(function() {
+    if (!window.EventSource) return;
+    const eventsUrl = document.currentScript.dataset.eventsUrl;
+    const alertStatuses = ['low_stock', 'out_of_stock'];
+    let alertCount = 0;
+    let source;
+
+    function setAlertCount(count) {
+        alertCount = Math.max(count, 0);
+        const badge = document.querySelector('.notification-badge');
+        if (!badge) return;
+        badge.querySelector('.notification-count').textContent = alertCount;
+        badge.classList.toggle('d-none', alertCount === 0);
+        document.querySelector('.bi-bell-fill').classList.toggle('notification-bell', alertCount > 0);
+    }
+
+    function showAlert(alert) {
+        const body = document.querySelector('.notification-body');
+        if (!body || !alertStatuses.includes(alert.status)) return;
+        const item = document.createElement('div');
+        const outOfStock = alert.status === 'out_of_stock';
+        item.className = 'notification-item ' + (outOfStock ? 'danger' : 'warning');
+        item.innerHTML = '<div class="d-flex justify-content-between"><strong></strong><span></span></div><small></small>';
+        item.querySelector('strong').textContent = alert.medicine_name;
+        item.querySelector('span').className = outOfStock ? 'text-danger' : 'text-warning';
+        item.querySelector('span').textContent = outOfStock ? 'Out of Stock' : `Low Stock (${alert.quantity})`;
+        item.querySelector('small').textContent = `Min. Required: ${alert.min_stock_level}`;
+        body.prepend(item);
+    }
+
+    function relay(name, data) {
+        document.dispatchEvent(new CustomEvent('live:' + name, {detail: data}));
+    }
+
+    function connect() {
+        source = new EventSource(eventsUrl);
+        source.addEventListener('snapshot', function(event) {
+            const snapshot = JSON.parse(event.data);
+            setAlertCount(snapshot.low_stock_count + snapshot.out_of_stock_count);
+            relay('snapshot', snapshot);
+        });
+        source.addEventListener('alert', function(event) {
+            const alert = JSON.parse(event.data);
+            setAlertCount(alertCount + alertStatuses.includes(alert.status) - alertStatuses.includes(alert.previous_status));
+            showAlert(alert);
+            relay('alert', alert);
+        });
+        source.addEventListener('sale', function(event) {
+            relay('sale', JSON.parse(event.data));
+        });
+        source.addEventListener('resync', function() {
+            source.close();
+            connect();
+        });
+    }
+    connect();
+})();
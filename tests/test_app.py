@@ -2,6 +2,7 @@ import pytest
 import sys
 import os
 import datetime
+import time as time_module
 from datetime import date, timedelta
 from unittest.mock import patch, MagicMock, Mock
 from flask import session, url_for, make_response
@@ -29,8 +30,11 @@ def ignore_warnings():
 # Add the parent directory to path so we can import app
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app import app, db, Medicine, User, Sale
-from app import check_stock_and_notify, MEDICINE_CATEGORIES, auto_check_stock
+# Point the default app at an in-memory database before it is created on import
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+from app import app, db, Medicine, User, Sale, EventBroker
+from app import check_stock_and_notify, MEDICINE_CATEGORIES, StockCheck, StockAlert, StockCheckScheduler
 
 @pytest.fixture
 def client():
@@ -39,6 +43,9 @@ def client():
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
     app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
 
+    # Each test gets a fresh database, so live event ids start over
+    app.extensions['event_broker'] = EventBroker(app, app.config['SSE_POLL_SECONDS'])
+
     with app.test_client() as client:
         with app.app_context():
             db.create_all()
@@ -558,6 +565,33 @@ def test_inventory_status_report(auth_manager):
     assert response.status_code == 200
     assert b'Inventory Status Report' in response.data
 
+def test_inventory_by_category_breakdown(auth_manager):
+    """One aggregate gives per-category stock, expiry and value figures."""
+    from app import inventory_by_category
+    today = datetime.date(2024, 6, 1)
+    with app.app_context():
+        db.session.add_all([
+            Medicine(name='A', category='Antibiotics', price=2.0, quantity=0, min_stock_level=5,
+                     expiry_date=today - timedelta(days=1)),
+            Medicine(name='B', category='Antibiotics', price=2.0, quantity=3, min_stock_level=5,
+                     expiry_date=today + timedelta(days=10)),
+            Medicine(name='C', category='Vitamins', price=1.5, quantity=20, min_stock_level=5,
+                     expiry_date=today + timedelta(days=100)),
+        ])
+        db.session.commit()
+
+        rows = inventory_by_category(today=today)
+        assert rows == [
+            {'category': 'Antibiotics', 'count': 2, 'out_of_stock': 1, 'low_stock': 1, 'well_stocked': 0,
+             'expired': 1, 'expiring_soon': 1, 'value': 6.0},
+            {'category': 'Vitamins', 'count': 1, 'out_of_stock': 0, 'low_stock': 0, 'well_stocked': 1,
+             'expired': 0, 'expiring_soon': 0, 'value': 30.0},
+        ]
+
+    response = auth_manager.get('/reports/inventory_status')
+    assert b'Category Breakdown' in response.data
+    assert b'$30.00' in response.data
+
 def test_export_inventory_csv(auth_manager, sample_medicine):
     """Test exporting inventory as CSV."""
     # Add a medicine for the report
@@ -1014,8 +1048,9 @@ def test_inject_medicines_context(client):
         
         # Mock the current_user before calling inject_medicines
         with patch('app.current_user') as mock_current_user:
-            # Mock the authentication status
+            # Mock the authentication status of a head-office user
             mock_current_user.is_authenticated = True
+            mock_current_user.store_id = None
             
             # Now get the context data
             from app import inject_medicines
@@ -1182,28 +1217,29 @@ def test_root_with_various_user_types(client):  # Add client parameter
     response = client.get('/', follow_redirects=True)
     assert response.status_code == 200
         
-def test_auto_check_stock():
-    """Test the auto_check_stock function."""
-    with app.test_request_context():
-        with patch('app.check_stock_and_notify') as mock_check:
-            with patch('app.datetime') as mock_datetime:
-                # Set up the mock datetime to trigger the check
-                mock_now = mock_datetime.now
-                mock_now.return_value = datetime.datetime.now()
-                
-                # Set up last_check to be more than 3600 seconds ago
-                from app import last_check
-                old_last_check = last_check - timedelta(seconds=3700)
-                with patch('app.last_check', old_last_check):
-                    with patch('app.request') as mock_request:
-                        # Set up a valid endpoint
-                        mock_request.endpoint = 'index'
-                        
-                        # Call the function
-                        auto_check_stock()
-                        
-                        # Verify the function was called
-                        mock_check.assert_called_once()
+def test_stock_check_scheduler(client):
+    """The background scheduler stores a stock check without any request."""
+    with app.app_context():
+        db.session.add(Medicine(name='Scheduled Low', category='Antibiotics', price=3.0,
+                                quantity=2, min_stock_level=10,
+                                expiry_date=(datetime.datetime.now() + timedelta(days=200)).date()))
+        db.session.commit()
+
+    scheduler = StockCheckScheduler(app, interval=3600)
+    scheduler.start()
+    try:
+        for _ in range(100):
+            with app.app_context():
+                stock_check = StockCheck.query.first()
+                if stock_check is not None:
+                    break
+            time_module.sleep(0.05)
+    finally:
+        scheduler.stop(timeout=5)
+
+    assert not scheduler.is_running
+    assert stock_check is not None
+    assert stock_check.low_stock_count == 1
             
 def test_check_stock_as_other_roles(auth_pharmacist, auth_cashier):
     """Test access to check_stock by different roles."""
@@ -1304,6 +1340,51 @@ def test_stock_levels_with_filters(auth_pharmacist):
     response = auth_pharmacist.get('/stock_levels?filter=out_of_stock')
     assert response.status_code == 200
     assert b'Out of Stock' in response.data
+
+def test_classify_stock_levels_single_pass(client):
+    """One query returns each bucket's page, its total and the expiry counts."""
+    from app import classify_stock_levels
+    today = datetime.date(2024, 6, 1)
+    with app.app_context():
+        db.session.add_all(
+            [Medicine(name=f'Low {i:02d}', category='Vitamins', price=1.0, quantity=1, min_stock_level=10,
+                      expiry_date=today + timedelta(days=3)) for i in range(5)] +
+            [Medicine(name='Empty', category='Vitamins', price=1.0, quantity=0, min_stock_level=10,
+                      expiry_date=today - timedelta(days=1)),
+             Medicine(name='Plenty', category='Vitamins', price=1.0, quantity=50, min_stock_level=10,
+                      expiry_date=today + timedelta(days=20))])
+        db.session.commit()
+
+        buckets, expiring = classify_stock_levels(db.session, {'low_stock': 2}, today=today, per_page=2)
+        assert [row.name for row in buckets['low_stock']['items']] == ['Low 02', 'Low 03']
+        assert buckets['low_stock']['total'] == 5
+        assert buckets['low_stock']['pages'] == 3
+        assert [row.name for row in buckets['out_of_stock']['items']] == ['Empty']
+        assert buckets['well_stocked']['total'] == 1
+        assert expiring == {'this_week': 5, 'this_month': 1, 'expired': 1}
+
+        # Totals are still known when a page lies past the end
+        buckets, _ = classify_stock_levels(db.session, {'low_stock': 9}, today=today, per_page=2)
+        assert buckets['low_stock']['items'] == []
+        assert buckets['low_stock']['total'] == 5
+
+def test_stock_levels_paginates_buckets(auth_manager):
+    """Each stock bucket on the page has its own pager."""
+    with app.app_context():
+        db.session.add_all([Medicine(name=f'Paged Low {i:03d}', category='Vitamins', price=1.0, quantity=1,
+                                     min_stock_level=10, expiry_date=datetime.date.today() + timedelta(days=90))
+                            for i in range(60)])
+        db.session.commit()
+
+    response = auth_manager.get('/stock_levels')
+    assert b'Paged Low 049' in response.data
+    assert b'Paged Low 050' not in response.data
+    assert b'low_stock_page=2' in response.data
+
+    response = auth_manager.get('/stock_levels?low_stock_page=2')
+    assert b'Paged Low 050' in response.data
+    assert b'Paged Low 049' not in response.data
+
 # ==== TEST UTILITY FUNCTIONS ====
 
 def test_check_stock_and_notify(client, low_stock_medicine):
@@ -1330,4 +1411,1656 @@ def test_check_stock_and_notify(client, low_stock_medicine):
         low_count, out_count = check_stock_and_notify(in_context=True)
         
         # Verify it detected the low stock
-        assert low_count >= 1
\ No newline at end of file
+        assert low_count >= 1
+
+# ==== TEST APPLICATION FACTORY ====
+
+def test_create_app_does_no_database_io(tmp_path):
+    """Building an app must not create or touch the database file."""
+    from app import create_app
+    db_file = tmp_path / 'factory.db'
+    factory_app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_file}'})
+
+    assert factory_app.config['SQLALCHEMY_DATABASE_URI'].endswith('factory.db')
+    assert 'main.index' in factory_app.view_functions
+    assert not db_file.exists()
+
+def test_importing_app_touches_no_files(tmp_path):
+    """Importing app.py opens no static or database files and creates no cache directories."""
+    import json
+    import subprocess
+    script = (
+        "import json, sys\n"
+        "events = []\n"
+        "sys.addaudithook(lambda event, args: events.append([event, str(args[0])])"
+        " if event in ('open', 'os.mkdir', 'os.chmod') else None)\n"
+        "import app\n"
+        "print(json.dumps(events))\n"
+    )
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{tmp_path / "import.db"}',
+               JINJA_BYTECODE_CACHE_DIR=str(tmp_path / 'bytecode'))
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', script], cwd=repo_dir, env=env,
+                            capture_output=True, text=True, check=True)
+    events = json.loads(result.stdout.splitlines()[-1])
+    static_dir = os.path.join(repo_dir, 'static')
+    touched = [event for event in events if event[0] != 'open'
+               or event[1].startswith((static_dir, str(tmp_path)))]
+    assert touched == []
+    assert not (tmp_path / 'bytecode').exists()
+
+def test_asset_manifest_loads_on_first_use(tmp_path):
+    """Static files are fingerprinted when a page first links them, not when the app is built."""
+    from app import create_app
+    factory_app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "lazy.db"}'})
+    manifest = factory_app.extensions['asset_manifest']
+    assert 'files' not in vars(manifest)
+
+    response = factory_app.test_client().get('/login')
+    assert manifest.files['css/base.css'] in response.get_data(as_text=True)
+
+def test_bytecode_cache_directory_created_on_first_render(tmp_path):
+    """Building the app leaves the bytecode cache directory alone until a template loads."""
+    from app import create_app
+    bytecode_dir = tmp_path / 'bytecode'
+    factory_app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "lazy.db"}',
+                              'JINJA_BYTECODE_CACHE_DIR': str(bytecode_dir)})
+    assert not bytecode_dir.exists()
+
+    assert factory_app.test_client().get('/login').status_code == 200
+    assert list(bytecode_dir.iterdir())
+
+def test_load_config_from_env(monkeypatch):
+    """Database URI, secret key and pool settings come from the environment."""
+    from app import load_config_from_env
+    monkeypatch.setenv('DATABASE_URL', 'sqlite:///env.db')
+    monkeypatch.setenv('SECRET_KEY', 'env-secret')
+    monkeypatch.setenv('DB_POOL_SIZE', '7')
+    monkeypatch.setenv('DB_POOL_PRE_PING', 'true')
+
+    config = load_config_from_env()
+
+    assert config['SQLALCHEMY_DATABASE_URI'] == 'sqlite:///env.db'
+    assert config['SECRET_KEY'] == 'env-secret'
+    assert config['SQLALCHEMY_ENGINE_OPTIONS'] == {'pool_size': 7, 'pool_pre_ping': True}
+
+def test_init_and_seed_commands(tmp_path):
+    """init-db creates the default users and seed-db loads sample data once."""
+    from app import create_app
+    cli_app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "cli.db"}'})
+    runner = cli_app.test_cli_runner()
+
+    result = runner.invoke(args=['init-db'])
+    assert 'initialized' in result.output
+
+    result = runner.invoke(args=['seed-db'])
+    assert 'sample medicines' in result.output
+
+    result = runner.invoke(args=['seed-db'])
+    assert 'skipping' in result.output
+
+    with cli_app.app_context():
+        assert User.query.count() == 3
+        assert Medicine.query.count() > 0
+        assert Sale.query.count() > 0
+        db.engine.dispose()
+
+# ==== TEST SQLITE CONNECTION PROFILE ====
+
+def test_sqlite_pragmas_applied_on_connect(tmp_path):
+    """Every new connection gets the WAL/busy_timeout profile."""
+    from app import create_app
+    profile_app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "profile.db"}'})
+
+    with profile_app.app_context():
+        with db.engine.connect() as connection:
+            assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+            assert connection.exec_driver_sql('PRAGMA busy_timeout').scalar() == 5000
+            assert connection.exec_driver_sql('PRAGMA synchronous').scalar() == 1  # NORMAL
+            assert connection.exec_driver_sql('PRAGMA temp_store').scalar() == 2  # MEMORY
+        db.engine.dispose()
+
+def test_pow_registered_without_pragma_profile(tmp_path):
+    """SQL functions are added on connect even when the PRAGMA profile is empty."""
+    import sqlite3
+    from sqlalchemy import event
+    from app import create_app
+    bare_app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "bare.db"}', 'SQLITE_PRAGMAS': {}})
+
+    def missing_pow(*args):
+        raise ValueError('no such function: pow')
+
+    def connect_without_pow(dialect, connection_record, cargs, cparams):
+        # Stands in for a SQLite build without the math functions
+        dbapi_connection = sqlite3.connect(*cargs, **cparams)
+        dbapi_connection.create_function('pow', 2, missing_pow)
+        return dbapi_connection
+
+    with bare_app.app_context():
+        engines = [db.engine, bare_app.extensions['reports_engine']]
+        db.create_all()
+        for engine in engines:
+            event.listen(engine, 'do_connect', connect_without_pow)
+            engine.dispose()
+            with engine.connect() as connection:
+                assert connection.exec_driver_sql('SELECT pow(2, 10)').scalar() == 1024.0
+            engine.dispose()
+
+def test_run_with_lock_retry(client):
+    """Lock errors are retried with backoff; other errors are raised at once."""
+    from sqlalchemy.exc import OperationalError
+    from app import run_with_lock_retry
+
+    attempts = []
+
+    def flaky_write():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise OperationalError('COMMIT', {}, Exception('database is locked'))
+        return 'saved'
+
+    with patch('app.time_module.sleep') as mock_sleep:
+        assert run_with_lock_retry(flaky_write) == 'saved'
+    assert len(attempts) == 3
+    assert mock_sleep.call_count == 2
+
+    def broken_write():
+        raise OperationalError('INSERT', {}, Exception('no such table: sale'))
+
+    with pytest.raises(OperationalError):
+        run_with_lock_retry(broken_write)
+
+# ==== TEST READ-ONLY REPORTS ENGINE ====
+
+@pytest.fixture
+def file_app(tmp_path):
+    """An app on a real SQLite file, so the read-only reports engine is active."""
+    from app import create_app
+    file_backed_app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "store.db"}',
+    })
+    with file_backed_app.app_context():
+        db.create_all()
+        db.session.add(User(username='file_manager', password='password',
+                            user_type='store_manager', email='m@example.com'))
+        db.session.add(Medicine(name='Report Med', category='Vitamins', price=4.0,
+                                quantity=12, min_stock_level=5,
+                                expiry_date=(datetime.datetime.now() + timedelta(days=90)).date()))
+        db.session.add(Sale(medicine_id=1, medicine_name='Report Med', medicine_category='Vitamins',
+                            quantity=2, sale_price=4.0, sale_date=datetime.datetime.now()))
+        db.session.commit()
+    yield file_backed_app
+    with file_backed_app.app_context():
+        db.engine.dispose()
+    file_backed_app.extensions['reports_engine'].dispose()
+    file_backed_app.extensions['inventory_snapshot'].close()
+    file_backed_app.extensions['event_broker'].close()
+
+def test_reports_engine_is_read_only(file_app):
+    """The reports engine opens the database file with mode=ro."""
+    from sqlalchemy.exc import OperationalError
+    from app import report_session
+
+    engine = file_app.extensions['reports_engine']
+    assert engine is not None
+    assert engine.url.query['mode'] == 'ro'
+
+    with file_app.app_context():
+        with report_session() as reports:
+            assert reports.query(Medicine).count() == 1
+        with pytest.raises(OperationalError):
+            with report_session() as reports:
+                reports.add(Medicine(name='Blocked', category='Other', price=1.0, quantity=1,
+                                     min_stock_level=1, expiry_date=datetime.date.today()))
+                reports.flush()
+
+def test_report_session_snapshot(file_app):
+    """A write committed during a report is not visible until the next report."""
+    from app import report_session
+
+    with file_app.app_context():
+        with report_session() as reports:
+            before = reports.query(Sale).count()
+            db.session.add(Sale(medicine_id=1, medicine_name='Report Med', medicine_category='Vitamins',
+                                quantity=1, sale_price=4.0, sale_date=datetime.datetime.now()))
+            db.session.commit()
+            assert reports.query(Sale).count() == before
+        with report_session() as reports:
+            assert reports.query(Sale).count() == before + 1
+
+def test_reports_render_from_file_database(file_app):
+    """Report pages and exports work through the read-only engine."""
+    with file_app.test_client() as file_client:
+        with file_client.session_transaction() as sess:
+            sess['_user_id'] = 1
+        assert file_client.get('/sales_report').status_code == 200
+        assert file_client.get('/reports/inventory_status').status_code == 200
+        response = file_client.get('/reports/export_sales_csv')
+        assert b'Report Med' in response.data
+        response = file_client.get('/reports/export_inventory_csv')
+        assert b'Report Med' in response.data
+
+def test_reports_fall_back_to_main_session_in_memory(client):
+    """In-memory databases cannot be reopened read-only, so reports share db.session."""
+    from app import report_session
+    assert app.extensions['reports_engine'] is None
+    with app.app_context():
+        with report_session() as reports:
+            assert reports is db.session
+
+# ==== TEST STORED STOCK ALERTS ====
+
+def test_run_stock_check_stores_alerts(client):
+    """One check classifies stock and expiry and records each flagged medicine."""
+    from app import run_stock_check
+    today = datetime.date.today()
+    with app.app_context():
+        db.session.add_all([
+            Medicine(name='Out Med', category='Vitamins', price=1.0, quantity=0,
+                     min_stock_level=5, expiry_date=today + timedelta(days=300)),
+            Medicine(name='Low Expiring Med', category='Vitamins', price=1.0, quantity=2,
+                     min_stock_level=5, expiry_date=today + timedelta(days=10)),
+            Medicine(name='Expired Med', category='Vitamins', price=1.0, quantity=50,
+                     min_stock_level=5, expiry_date=today - timedelta(days=1)),
+            Medicine(name='Fine Med', category='Vitamins', price=1.0, quantity=50,
+                     min_stock_level=5, expiry_date=today + timedelta(days=300)),
+        ])
+        db.session.commit()
+
+        stock_check = run_stock_check()
+
+        assert stock_check.out_of_stock_count == 1
+        assert stock_check.low_stock_count == 1
+        assert stock_check.expired_count == 1
+        assert stock_check.expiring_soon_count == 1
+        alerts = {(a.medicine_name, a.alert_type) for a in
+                  StockAlert.query.filter_by(check_id=stock_check.id)}
+        assert alerts == {('Out Med', 'out_of_stock'), ('Low Expiring Med', 'low_stock'),
+                          ('Low Expiring Med', 'expiring_soon'), ('Expired Med', 'expired')}
+
+def test_stock_check_history_is_pruned(client):
+    """Only the configured number of checks is kept."""
+    from app import run_stock_check
+    with app.app_context():
+        with patch.dict(app.config, {'STOCK_CHECK_HISTORY': 2}):
+            for _ in range(4):
+                run_stock_check()
+        assert StockCheck.query.count() == 2
+
+def test_request_paths_read_stored_check(auth_manager, low_stock_medicine):
+    """Pages render the stored result instead of running the check themselves."""
+    with app.app_context():
+        db.session.add(Medicine(
+            name=low_stock_medicine['name'], category=low_stock_medicine['category'],
+            price=low_stock_medicine['price'], quantity=low_stock_medicine['quantity'],
+            min_stock_level=low_stock_medicine['min_stock_level'],
+            expiry_date=datetime.datetime.strptime(low_stock_medicine['expiry_date'], '%Y-%m-%d').date()
+        ))
+        db.session.commit()
+
+    with patch('app.run_stock_check') as mock_check:
+        response = auth_manager.get('/', follow_redirects=True)
+        mock_check.assert_not_called()
+    assert b'Alert:' not in response.data
+
+    auth_manager.get('/check_stock')
+    response = auth_manager.get('/', follow_redirects=True)
+    assert b'Alert: 1 medicines with low stock' in response.data
+    assert b'Low Stock (5)' in response.data
+
+# ==== TEST BACKGROUND REPORT JOBS ====
+
+def test_report_job_submit_process_download(auth_manager, tmp_path):
+    """A submitted export runs in the queue and its artifact can be downloaded."""
+    from app import process_next_report_job
+    with app.app_context():
+        db.session.add(Sale(medicine_id=1, medicine_name='Queued Med', medicine_category='Vitamins',
+                            quantity=3, sale_price=2.5, sale_date=datetime.datetime(2024, 5, 1, 10, 0)))
+        db.session.add(Sale(medicine_id=1, medicine_name='Old Med', medicine_category='Vitamins',
+                            quantity=1, sale_price=2.5, sale_date=datetime.datetime(2023, 1, 1, 10, 0)))
+        db.session.commit()
+
+    with patch.dict(app.config, {'REPORT_JOB_DIR': str(tmp_path)}):
+        response = auth_manager.post('/reports/jobs', data={
+            'job_type': 'sales_csv', 'start_date': '2024-01-01', 'end_date': '2024-12-31'
+        })
+        assert response.status_code == 202
+        job_id = response.get_json()['job_id']
+
+        status = auth_manager.get(f'/reports/jobs/{job_id}').get_json()
+        assert status['status'] == 'pending'
+
+        with app.app_context():
+            assert process_next_report_job() is True
+            assert process_next_report_job() is False
+
+        status = auth_manager.get(f'/reports/jobs/{job_id}').get_json()
+        assert status['status'] == 'done'
+        assert status['progress'] == 100
+
+        response = auth_manager.get(status['download_url'])
+        assert response.status_code == 200
+        assert b'Queued Med' in response.data
+        assert b'Old Med' not in response.data
+        response.close()
+
+def test_expired_report_jobs_and_artifacts_are_deleted(client, tmp_path):
+    """Finished jobs past the retention period go with their files; recent and active ones stay."""
+    from app import ReportJob, expire_report_jobs
+    now = datetime.datetime.utcnow()
+    with patch.dict(app.config, {'REPORT_JOB_DIR': str(tmp_path)}), app.app_context():
+        jobs = [ReportJob(job_type='inventory_csv', dedupe_key=f'job-{number}', status=status, finished_at=finished_at)
+                for number, (status, finished_at) in enumerate([
+                    ('done', now - timedelta(days=3)), ('failed', now - timedelta(days=3)),
+                    ('done', now - timedelta(hours=1)), ('running', None)])]
+        db.session.add_all(jobs)
+        db.session.commit()
+        for job in jobs:
+            job.artifact_path = str(tmp_path / f'report_job_{job.id}.csv')
+            open(job.artifact_path, 'w').close()
+        db.session.commit()
+        open(tmp_path / f'report_job_{jobs[1].id}.csv.part', 'w').close()
+        kept_ids = [jobs[2].id, jobs[3].id]
+
+        assert expire_report_jobs(retention_hours=24) == 2
+        assert [job.id for job in ReportJob.query.order_by(ReportJob.id)] == kept_ids
+        assert sorted(path.name for path in tmp_path.iterdir()) == [f'report_job_{job_id}.csv' for job_id in kept_ids]
+        assert expire_report_jobs(retention_hours=24) == 0
+
+def test_report_job_dedupes_pending_requests(auth_manager):
+    """Identical pending submissions share one job; different params do not."""
+    first = auth_manager.post('/reports/jobs', data={'job_type': 'inventory_csv'})
+    second = auth_manager.post('/reports/jobs', data={'job_type': 'inventory_csv'})
+    other = auth_manager.post('/reports/jobs', data={'job_type': 'sales_csv', 'start_date': '2024-01-01'})
+
+    assert first.status_code == 202
+    assert second.status_code == 200
+    assert first.get_json()['job_id'] == second.get_json()['job_id']
+    assert other.get_json()['job_id'] != first.get_json()['job_id']
+
+def test_report_job_validation_and_access(auth_manager):
+    """Unknown types and bad dates are rejected."""
+    response = auth_manager.post('/reports/jobs', data={'job_type': 'everything'})
+    assert response.status_code == 400
+    response = auth_manager.post('/reports/jobs', data={'job_type': 'sales_csv', 'start_date': '01/02/2024'})
+    assert response.status_code == 400
+    response = auth_manager.get('/reports/jobs/999')
+    assert response.status_code == 404
+
+def test_report_job_requires_manager(auth_cashier):
+    """Only store managers can queue report jobs."""
+    response = auth_cashier.post('/reports/jobs', data={'job_type': 'inventory_csv'})
+    assert response.status_code == 403
+
+# ==== TEST SALES COUNTERS ====
+
+def test_create_sale_updates_sales_counters(auth_cashier, sample_medicine):
+    """Each sale adds to its medicine's counters in the same transaction."""
+    from app import MedicineSalesCounter, MedicineDailySales
+    with app.app_context():
+        medicine = Medicine(name='Counter Med', category='Vitamins', price=2.0, quantity=50,
+                            min_stock_level=5, expiry_date=datetime.date.today() + timedelta(days=100))
+        db.session.add(medicine)
+        db.session.commit()
+        medicine_id = medicine.id
+
+    for quantity in [3, 4]:
+        auth_cashier.post('/sale', data={'medicine_id': medicine_id, 'quantity': quantity,
+                                         'customer_name': 'Counter Customer'})
+
+    with app.app_context():
+        counter = db.session.get(MedicineSalesCounter, medicine_id)
+        assert counter.lifetime_units == 7
+        assert counter.lifetime_revenue == 14.0
+        assert counter.window_units == 7
+        assert MedicineDailySales.query.filter_by(medicine_id=medicine_id).one().units == 7
+
+def test_rebuild_and_window_refresh(client):
+    """Counters rebuilt from history rank medicines and age out old days."""
+    from app import rebuild_sales_counters, top_selling_medicines
+    now = datetime.datetime.utcnow()
+    with app.app_context():
+        db.session.add_all([
+            Sale(medicine_id=1, medicine_name='Recent Med', medicine_category='Vitamins',
+                 quantity=5, sale_price=1.0, sale_date=now),
+            Sale(medicine_id=2, medicine_name='Old Favourite', medicine_category='Vitamins',
+                 quantity=20, sale_price=1.0, sale_date=now - timedelta(days=90)),
+        ])
+        db.session.commit()
+
+        assert rebuild_sales_counters() == 2
+
+        lifetime = top_selling_medicines(5)
+        assert [c.medicine_name for c in lifetime] == ['Old Favourite', 'Recent Med']
+        window = top_selling_medicines(5, window=True)
+        assert [c.medicine_name for c in window] == ['Recent Med']
+        assert window[0].window_units == 5
+
+def test_top_products_endpoint(auth_manager):
+    """The top products endpoint validates its arguments and returns rankings."""
+    from app import rebuild_sales_counters
+    with app.app_context():
+        db.session.add(Sale(medicine_id=1, medicine_name='Ranked Med', medicine_category='Vitamins',
+                            quantity=2, sale_price=3.0, sale_date=datetime.datetime.utcnow()))
+        db.session.commit()
+        rebuild_sales_counters()
+
+    data = auth_manager.get('/reports/top_products?by=revenue&limit=3').get_json()
+    assert data['products'][0]['medicine_name'] == 'Ranked Med'
+    assert data['products'][0]['revenue'] == 6.0
+
+    assert auth_manager.get('/reports/top_products?by=price').status_code == 400
+
+# ==== TEST SALES HISTORY PAGINATION ====
+
+def add_history_sales(count, **overrides):
+    base = datetime.datetime(2024, 3, 1, 9, 0)
+    with app.app_context():
+        for i in range(count):
+            fields = dict(medicine_id=1, medicine_name='History Med', medicine_category='Vitamins',
+                          quantity=1, sale_price=2.0, customer_name='Alice',
+                          sale_date=base + timedelta(hours=i))
+            fields.update(overrides)
+            db.session.add(Sale(**fields))
+        db.session.commit()
+
+def test_sales_history_keyset_pages(auth_manager):
+    """Pages follow each other newest first with no gaps or repeats."""
+    add_history_sales(7)
+    # Two sales at the same instant are ordered by id
+    add_history_sales(2, sale_date=datetime.datetime(2024, 3, 1, 12, 0))
+
+    seen = []
+    cursor = ''
+    while True:
+        page = auth_manager.get(f'/sales_report/sales?limit=4&cursor={cursor}').get_json()
+        seen.extend(page['sales'])
+        if not page['next_cursor']:
+            break
+        cursor = page['next_cursor']
+
+    assert len(seen) == 9
+    assert len({sale['id'] for sale in seen}) == 9
+    keys = [(sale['sale_date'], sale['id']) for sale in seen]
+    assert keys == sorted(keys, reverse=True)
+
+def test_sales_history_filters(auth_manager):
+    """Date range, medicine, category and customer filters narrow the history."""
+    add_history_sales(3)
+    add_history_sales(2, medicine_name='Other Med', medicine_category='Antibiotics',
+                      customer_name='Bob', sale_date=datetime.datetime(2024, 6, 1, 9, 0))
+
+    def count(query):
+        return len(auth_manager.get('/sales_report/sales?' + query).get_json()['sales'])
+
+    assert count('category=Antibiotics') == 2
+    assert count('customer=bo') == 2
+    assert count('medicine=History') == 3
+    assert count('start_date=2024-05-01') == 2
+    assert count('end_date=2024-03-01') == 3
+    assert auth_manager.get('/sales_report/sales?start_date=March').status_code == 400
+    assert auth_manager.get('/sales_report/sales?cursor=garbage').status_code == 400
+
+def test_sales_report_renders_first_page_only(auth_manager):
+    """The report renders one page of rows and a cursor for the rest."""
+    add_history_sales(60)
+    response = auth_manager.get('/sales_report')
+    assert response.status_code == 200
+    assert response.data.count(b'History Med</td>') == 50
+    assert b'data-next-cursor="2024-03' in response.data
+
+# ==== TEST MEDICINE SALES LEDGER ====
+
+def test_medicine_sales_velocity(client):
+    """Velocity windows and zero-filled daily units come from the medicine's own sales."""
+    from app import medicine_sales_velocity, medicine_daily_units
+    today = datetime.date(2024, 6, 30)
+    noon = datetime.datetime(2024, 6, 30, 12, 0)
+    with app.app_context():
+        db.session.add_all([
+            Sale(medicine_id=5, medicine_name='Velocity Med', medicine_category='Vitamins',
+                 quantity=7, sale_price=1.0, sale_date=noon),
+            Sale(medicine_id=5, medicine_name='Velocity Med', medicine_category='Vitamins',
+                 quantity=23, sale_price=1.0, sale_date=noon - timedelta(days=20)),
+            Sale(medicine_id=5, medicine_name='Velocity Med', medicine_category='Vitamins',
+                 quantity=60, sale_price=1.0, sale_date=noon - timedelta(days=60)),
+            Sale(medicine_id=5, medicine_name='Velocity Med', medicine_category='Vitamins',
+                 quantity=500, sale_price=1.0, sale_date=noon - timedelta(days=200)),
+            Sale(medicine_id=6, medicine_name='Other Med', medicine_category='Vitamins',
+                 quantity=99, sale_price=1.0, sale_date=noon),
+        ])
+        db.session.commit()
+
+        velocity = medicine_sales_velocity(db.session, 5, today=today)
+        assert velocity['7d'] == {'units': 7, 'per_day': 1.0}
+        assert velocity['30d'] == {'units': 30, 'per_day': 1.0}
+        assert velocity['90d'] == {'units': 90, 'per_day': 1.0}
+
+        daily = medicine_daily_units(db.session, 5, days=30, today=today)
+        assert len(daily) == 30
+        assert daily[-1] == ('2024-06-30', 7)
+        assert sum(units for _, units in daily) == 30
+
+def test_medicine_ledger_page_and_api(auth_pharmacist):
+    """The ledger page renders and its API pages through the medicine's sales."""
+    with app.app_context():
+        medicine = Medicine(name='Ledger Med', category='Vitamins', price=2.0, quantity=40,
+                            min_stock_level=5, expiry_date=datetime.date.today() + timedelta(days=100))
+        db.session.add(medicine)
+        db.session.commit()
+        medicine_id = medicine.id
+    add_history_sales(55, medicine_id=medicine_id, medicine_name='Ledger Med')
+    add_history_sales(3, medicine_id=medicine_id + 1, medicine_name='Not This One')
+
+    response = auth_pharmacist.get(f'/medicine/{medicine_id}/ledger')
+    assert response.status_code == 200
+    assert b'Ledger Med' in response.data
+    assert b'Not This One' not in response.data
+
+    page = auth_pharmacist.get(f'/medicine/{medicine_id}/ledger.json').get_json()
+    assert len(page['sales']) == 50
+    assert set(page['velocity']) == {'7d', '30d', '90d'}
+    page = auth_pharmacist.get(f"/medicine/{medicine_id}/ledger.json?cursor={page['next_cursor']}").get_json()
+    assert len(page['sales']) == 5
+    assert page['next_cursor'] is None
+
+    response = auth_pharmacist.get('/inventory')
+    assert f'/medicine/{medicine_id}/ledger'.encode() in response.data
+
+def test_medicine_ledger_denied_for_cashier(auth_cashier):
+    """Cashiers cannot open sales ledgers."""
+    response = auth_cashier.get('/medicine/1/ledger.json')
+    assert response.status_code == 403
+
+# ==== TEST REORDER FORECAST ====
+
+def test_reorder_forecast_matches_per_sku_calculation(client):
+    """The set-based forecast equals a straightforward per-medicine calculation."""
+    np = pytest.importorskip('numpy')
+    from app import compute_reorder_suggestions, MedicineDailySales, ReorderSuggestion
+    history_days = 60
+    today = datetime.date(2024, 6, 30)
+    rng = np.random.default_rng(7)
+    daily = rng.poisson(3, size=(3, history_days)) * (rng.random((3, history_days)) < 0.6)
+    with app.app_context():
+        medicines = [Medicine(name=f'Forecast Med {i}', category='Vitamins', price=1.0, quantity=10,
+                              min_stock_level=0, expiry_date=today + timedelta(days=300)) for i in range(3)]
+        db.session.add_all(medicines)
+        db.session.commit()
+        ids = [medicine.id for medicine in medicines]
+        db.session.add_all([
+            MedicineDailySales(medicine_id=ids[sku], sale_day=today - timedelta(days=int(age)),
+                               units=int(daily[sku, age]), revenue=0.0)
+            for sku, age in zip(*np.nonzero(daily))
+        ])
+        # Older than the history window, so ignored
+        db.session.add(MedicineDailySales(medicine_id=ids[0], sale_day=today - timedelta(days=history_days),
+                                          units=500, revenue=0.0))
+        db.session.commit()
+
+        for method, weights in [('ewma', 0.2 * 0.8 ** np.arange(history_days)),
+                                ('sma', (np.arange(history_days) < 14).astype(float))]:
+            settings = {'FORECAST_METHOD': method, 'FORECAST_HISTORY_DAYS': history_days,
+                        'FORECAST_SMOOTHING': 0.2, 'FORECAST_WINDOW_DAYS': 14,
+                        'FORECAST_LEAD_TIME_DAYS': 5, 'FORECAST_SERVICE_Z': 2.0}
+            with patch.dict(app.config, settings):
+                assert compute_reorder_suggestions(today=today) == 3
+
+            weights = weights / weights.sum()
+            for sku, medicine_id in enumerate(ids):
+                expected_mean = (weights * daily[sku]).sum()
+                expected_std = np.sqrt((weights * (daily[sku] - expected_mean) ** 2).sum())
+                suggestion = db.session.get(ReorderSuggestion, medicine_id)
+                assert suggestion.daily_demand == pytest.approx(expected_mean, abs=1e-3)
+                assert suggestion.demand_std == pytest.approx(expected_std, abs=1e-3)
+                assert suggestion.suggested_min_stock_level == \
+                    int(np.ceil(expected_mean * 5 + 2.0 * expected_std * np.sqrt(5)))
+
+def test_reorder_suggestions_compute_and_accept(auth_pharmacist):
+    """Suggestions are stored from the daily buckets and accepted in bulk."""
+    pytest.importorskip('numpy')
+    from app import compute_reorder_suggestions, rebuild_sales_counters, ReorderSuggestion
+    now = datetime.datetime.utcnow()
+    with app.app_context():
+        busy = Medicine(name='Busy Med', category='Vitamins', price=1.0, quantity=100,
+                        min_stock_level=5, expiry_date=datetime.date.today() + timedelta(days=300))
+        idle = Medicine(name='Idle Med', category='Vitamins', price=1.0, quantity=100,
+                        min_stock_level=5, expiry_date=datetime.date.today() + timedelta(days=300))
+        db.session.add_all([busy, idle])
+        db.session.commit()
+        busy_id, idle_id = busy.id, idle.id
+        db.session.add_all([
+            Sale(medicine_id=busy_id, medicine_name='Busy Med', medicine_category='Vitamins',
+                 quantity=10, sale_price=1.0, sale_date=now - timedelta(days=day))
+            for day in range(60)
+        ])
+        db.session.commit()
+        rebuild_sales_counters()
+
+        with patch.dict(app.config, {'FORECAST_METHOD': 'sma', 'FORECAST_WINDOW_DAYS': 28}):
+            assert compute_reorder_suggestions() == 1
+        suggestion = db.session.get(ReorderSuggestion, busy_id)
+        assert suggestion.daily_demand == pytest.approx(10.0)
+        assert suggestion.suggested_min_stock_level == 70  # steady demand needs no safety stock
+        assert db.session.get(ReorderSuggestion, idle_id) is None
+
+    response = auth_pharmacist.get('/reorder_suggestions')
+    assert response.status_code == 200
+    assert b'Busy Med' in response.data
+
+    response = auth_pharmacist.post('/reorder_suggestions/accept', data={'accept_all': '1'},
+                                    follow_redirects=True)
+    assert b'Updated the minimum stock level of 1 medicines' in response.data
+    with app.app_context():
+        assert db.session.get(Medicine, busy_id).min_stock_level == 70
+        assert db.session.get(Medicine, idle_id).min_stock_level == 5
+        assert ReorderSuggestion.query.count() == 0
+
+def test_reorder_suggestions_denied_for_cashier(auth_cashier):
+    """Only pharmacists can accept reorder suggestions."""
+    response = auth_cashier.post('/reorder_suggestions/accept', data={'accept_all': '1'},
+                                 follow_redirects=True)
+    assert b'Only pharmacists can accept reorder suggestions.' in response.data
+
+# ==== TEST PURCHASE ORDERS ====
+
+def add_deficient_medicines():
+    with app.app_context():
+        expiry = datetime.date.today() + timedelta(days=200)
+        db.session.add_all([
+            Medicine(name='Amoxil', category='Antibiotics', price=5.0, quantity=2,
+                     min_stock_level=10, expiry_date=expiry),
+            Medicine(name='Cipro', category='Antibiotics', price=6.0, quantity=0,
+                     min_stock_level=5, expiry_date=expiry),
+            Medicine(name='Ibuprofen', category='Pain Relief', price=1.0, quantity=-3,
+                     min_stock_level=20, expiry_date=expiry),
+            Medicine(name='Plenty', category='Vitamins', price=1.0, quantity=50,
+                     min_stock_level=10, expiry_date=expiry),
+        ])
+        db.session.commit()
+
+def test_purchase_orders_csv(auth_manager):
+    """Below-threshold medicines are grouped into one draft order per category."""
+    import csv as csv_module
+    add_deficient_medicines()
+    response = auth_manager.get('/reports/purchase_orders?format=csv')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert 'attachment' in response.headers['Content-Disposition']
+
+    rows = list(csv_module.reader(response.get_data(as_text=True).splitlines()))
+    assert rows[0][0] == 'Order'
+    lines = {row[3]: row for row in rows[1:]}
+    assert set(lines) == {'Amoxil', 'Cipro', 'Ibuprofen'}
+    assert lines['Amoxil'][6] == '18'    # topped up to twice the minimum
+    assert lines['Cipro'][6] == '10'
+    assert lines['Ibuprofen'][6] == '40'  # negative stock counts as empty
+    assert lines['Amoxil'][0] == lines['Cipro'][0] != lines['Ibuprofen'][0]
+
+def test_purchase_orders_json(auth_manager):
+    """The JSON export nests the lines under their draft orders."""
+    add_deficient_medicines()
+    data = auth_manager.get('/reports/purchase_orders?format=json').get_json()
+    assert [order['category'] for order in data['orders']] == ['Antibiotics', 'Pain Relief']
+    assert data['orders'][0]['total_units'] == 28
+    assert [line['medicine_name'] for line in data['orders'][0]['lines']] == ['Amoxil', 'Cipro']
+
+    assert auth_manager.get('/reports/purchase_orders?format=xml').status_code == 400
+
+def test_purchase_orders_denied_for_pharmacist(auth_pharmacist):
+    """Only store managers can generate purchase orders."""
+    response = auth_pharmacist.get('/reports/purchase_orders', follow_redirects=True)
+    assert b'Only store managers can generate purchase orders.' in response.data
+
+# ==== TEST INVENTORY SNAPSHOT ====
+
+def test_inventory_snapshot_follows_session_changes(client):
+    """Commits through the session refresh just the medicines they touched."""
+    from sqlalchemy import update
+    from app import inventory_snapshot, MedicineSnapshot
+    with app.app_context():
+        snapshot = inventory_snapshot()
+        expiry = datetime.date.today() + timedelta(days=60)
+        first = Medicine(name='Snap One', category='Vitamins', price=1.0, quantity=5,
+                         min_stock_level=2, expiry_date=expiry)
+        second = Medicine(name='Snap Two', category='Vitamins', price=1.0, quantity=0,
+                          min_stock_level=2, expiry_date=expiry)
+        db.session.add_all([first, second])
+        db.session.commit()
+
+        medicines = snapshot.medicines()
+        assert [m.name for m in medicines] == ['Snap One', 'Snap Two']
+        assert isinstance(medicines[0], MedicineSnapshot)
+        assert medicines[1].stock_status() == 'out_of_stock'
+        assert snapshot.medicines() is medicines  # unchanged, so no reload
+
+        first.quantity = 9
+        db.session.delete(second)
+        db.session.commit()
+        assert [(m.name, m.quantity) for m in snapshot.medicines()] == [('Snap One', 9)]
+
+        db.session.execute(update(Medicine).values(price=3.5))
+        db.session.commit()
+        assert snapshot.medicines()[0].price == 3.5
+
+def test_inventory_snapshot_sees_other_process_writes(file_app):
+    """A write from another connection shows up through PRAGMA data_version."""
+    import sqlite3
+    from app import inventory_snapshot
+    with file_app.app_context():
+        snapshot = inventory_snapshot()
+        assert [m.quantity for m in snapshot.medicines()] == [12]
+
+        other = sqlite3.connect(db.engine.url.database)
+        other.execute('UPDATE medicine SET quantity = 3')
+        other.commit()
+        other.close()
+
+        assert [m.quantity for m in snapshot.medicines()] == [3]
+
+def test_inventory_snapshot_sees_other_writes_despite_local_commits(file_app):
+    """A local commit does not hide another connection's write, and unrelated commits keep the version."""
+    import sqlite3
+    from sqlalchemy.orm import Session
+    from app import inventory_snapshot, ReportJob
+    with file_app.app_context():
+        db.session.add(Medicine(name='Local Med', category='Vitamins', price=2.0, quantity=50, min_stock_level=5,
+                                expiry_date=datetime.date.today() + timedelta(days=90)))
+        db.session.commit()
+        snapshot = inventory_snapshot()
+        version, medicines = snapshot.versioned_medicines()
+        assert [m.quantity for m in medicines] == [12, 50]
+
+        other = sqlite3.connect(db.engine.url.database)
+        other.execute('UPDATE medicine SET quantity = 999 WHERE id = 1')
+        other.commit()
+        db.session.get(Medicine, 2).quantity = 49
+        db.session.commit()
+        version, medicines = snapshot.versioned_medicines()
+        assert [m.quantity for m in medicines] == [999, 49]
+
+        other.execute('DELETE FROM medicine WHERE id = 2')
+        other.commit()
+        other.close()
+        version, medicines = snapshot.versioned_medicines()
+        assert [m.id for m in medicines] == [1]
+
+        # Report job progress is written through its own session
+        with Session(db.engine) as jobs:
+            jobs.add(ReportJob(job_type='inventory_csv', params='{}', dedupe_key='inventory_csv:{}'))
+            jobs.commit()
+        assert snapshot.versioned_medicines()[0] == version
+
+# ==== TEST SINGLE WRITER ====
+
+@pytest.fixture
+def writer_app(tmp_path):
+    """A file-backed app with request writes going through the write queue."""
+    from app import create_app
+    writer_backed_app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "writer.db"}',
+        'SINGLE_WRITER': True,
+    })
+    with writer_backed_app.app_context():
+        db.create_all()
+        db.session.add(Medicine(name='Queued Med', category='Vitamins', price=2.0, quantity=15,
+                                min_stock_level=5, expiry_date=datetime.date.today() + timedelta(days=90)))
+        db.session.commit()
+    yield writer_backed_app
+    writer_backed_app.extensions['write_queue'].stop(timeout=5)
+    with writer_backed_app.app_context():
+        db.engine.dispose()
+    writer_backed_app.extensions['reports_engine'].dispose()
+    writer_backed_app.extensions['inventory_snapshot'].close()
+    writer_backed_app.extensions['event_broker'].close()
+
+def test_write_queue_never_oversells(writer_app):
+    """Concurrent tills share the writer, and stock is checked inside the write."""
+    import threading
+    from app import sell_medicine
+    outcomes = []
+
+    def till():
+        with writer_app.app_context():
+            try:
+                outcomes.append(sell_medicine(1, 1, 'Queue Customer'))
+            except ValueError as e:
+                outcomes.append(str(e))
+
+    tills = [threading.Thread(target=till) for _ in range(20)]
+    for thread in tills:
+        thread.start()
+    for thread in tills:
+        thread.join()
+
+    assert sum(isinstance(outcome, int) for outcome in outcomes) == 15
+    assert outcomes.count('Insufficient stock. Available: 0 units') == 5
+    with writer_app.app_context():
+        assert db.session.get(Medicine, 1).quantity == 0
+        assert Sale.query.count() == 15
+
+def test_write_queue_batch_isolates_failures(writer_app):
+    """A failing write rolls back alone while the rest of its batch commits."""
+    from app import PendingWrite
+
+    def add(name):
+        def apply():
+            db.session.add(Medicine(name=name, category='Vitamins', price=1.0, quantity=1,
+                                    min_stock_level=1, expiry_date=datetime.date.today()))
+        return apply
+
+    def fail():
+        add('Half Written')()
+        db.session.flush()
+        raise ValueError('rejected')
+
+    batch = [PendingWrite(add('First')), PendingWrite(fail), PendingWrite(add('Last'))]
+    with writer_app.app_context():
+        writer_app.extensions['write_queue']._commit_batch(batch)
+        assert [write.done.is_set() for write in batch] == [True, True, True]
+        assert str(batch[1].error) == 'rejected'
+        assert batch[0].error is None and batch[2].error is None
+        names = {medicine.name for medicine in Medicine.query.all()}
+        assert {'First', 'Last'} <= names
+        assert 'Half Written' not in names
+
+# ==== TEST CHANGE FEED ====
+
+def read_change_feed(client, since, **params):
+    import json
+    response = client.get('/changes', query_string={'since': since, **params})
+    assert response.status_code == 200
+    return response, [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+def test_change_feed_records_row_changes(auth_manager):
+    """Inserts, updates, deletes and bulk reorder updates reach the feed in order."""
+    from app import ReorderSuggestion, accept_reorder_suggestions
+    with app.app_context():
+        medicine = Medicine(name='Feed Med', category='Vitamins', price=3.0, quantity=10,
+                            min_stock_level=5, expiry_date=date.today() + timedelta(days=30))
+        db.session.add(medicine)
+        db.session.commit()
+        medicine.quantity = 8
+        db.session.add(Sale(medicine_id=medicine.id, medicine_name='Feed Med', medicine_category='Vitamins',
+                            quantity=2, sale_price=3.0))
+        db.session.commit()
+        db.session.add(ReorderSuggestion(medicine_id=medicine.id, current_min_stock_level=5,
+                                         suggested_min_stock_level=12, daily_demand=1.0, demand_std=0.5))
+        db.session.commit()
+        assert accept_reorder_suggestions() == 1
+        db.session.delete(db.session.get(Medicine, medicine.id))
+        db.session.commit()
+
+    response, changes = read_change_feed(auth_manager, 0)
+    assert [(change['table'], change['op']) for change in changes] == [
+        ('medicine', 'insert'), ('medicine', 'update'), ('sale', 'insert'),
+        ('medicine', 'update'), ('medicine', 'delete')]
+    assert [change['seq'] for change in changes] == sorted(change['seq'] for change in changes)
+    assert changes[1]['row']['quantity'] == 8
+    assert changes[3]['row']['min_stock_level'] == 12
+    assert response.headers['X-Change-Log-Last-Seq'] == str(changes[-1]['seq'])
+
+    _, newer = read_change_feed(auth_manager, changes[2]['seq'])
+    assert [change['seq'] for change in newer] == [changes[3]['seq'], changes[4]['seq']]
+    _, first_page = read_change_feed(auth_manager, 0, limit=2)
+    assert len(first_page) == 2
+
+def test_change_log_compaction(auth_manager):
+    """Expired entries are deleted, except the newest, and stale consumers get 410."""
+    from app import ChangeLogEntry, compact_change_log
+    with app.app_context():
+        for number in range(5):
+            db.session.add(Medicine(name=f'Old {number}', category='Vitamins', price=1.0, quantity=1,
+                                    min_stock_level=1, expiry_date=date.today()))
+            db.session.commit()
+        ChangeLogEntry.query.update({'changed_at': datetime.datetime.utcnow() - timedelta(days=90)})
+        db.session.commit()
+        assert compact_change_log(retention_days=30, chunk_size=2) == 4
+        remaining = [entry.seq for entry in ChangeLogEntry.query.all()]
+        assert remaining == [5]
+
+    assert auth_manager.get('/changes?since=0').status_code == 410
+    _, changes = read_change_feed(auth_manager, 4)
+    assert [change['row']['name'] for change in changes] == ['Old 4']
+
+def test_change_feed_requires_manager(auth_cashier):
+    assert auth_cashier.get('/changes?since=0').status_code == 403
+
+# ==== TEST BRANCHES ====
+
+def add_branch_medicines():
+    """Two branches with one medicine each; returns (main_id, north_id)."""
+    from app import Store
+    db.session.add_all([Store(id=1, code='MAIN', name='Main Branch'), Store(id=2, code='NORTH', name='North Branch')])
+    main_medicine = Medicine(store_id=1, name='Main Only Med', category='Vitamins', price=2.0, quantity=5,
+                             min_stock_level=10, expiry_date=date.today() + timedelta(days=200))
+    north_medicine = Medicine(store_id=2, name='North Only Med', category='Vitamins', price=4.0, quantity=50,
+                              min_stock_level=10, expiry_date=date.today() + timedelta(days=200))
+    db.session.add_all([main_medicine, north_medicine])
+    db.session.commit()
+    return main_medicine.id, north_medicine.id
+
+def test_branch_staff_only_see_their_store(client):
+    """A branch pharmacist lists, edits and sells only their own store's medicines."""
+    from app import MedicineSalesCounter
+    with app.app_context():
+        main_id, north_id = add_branch_medicines()
+        branch_user = User(username='north_pharmacist', password='password', user_type='pharmacist', store_id=2)
+        db.session.add(branch_user)
+        db.session.commit()
+        branch_user_id = branch_user.id
+    with client.session_transaction() as sess:
+        sess['_user_id'] = branch_user_id
+
+    page = client.get('/index').get_data(as_text=True)
+    assert 'North Only Med' in page and 'Main Only Med' not in page
+    assert client.get(f'/update_medicine/{main_id}').status_code == 404
+
+    response = client.post('/sale', data={'medicine_id': main_id, 'quantity': 1}, follow_redirects=True)
+    assert b'Medicine not found' in response.data
+    response = client.post('/sale', data={'medicine_id': north_id, 'quantity': 2}, follow_redirects=True)
+    assert b'Sale completed successfully' in response.data
+    with app.app_context():
+        sale = Sale.query.one()
+        assert sale.store_id == 2
+        assert db.session.get(MedicineSalesCounter, north_id).store_id == 2
+
+def test_head_office_selects_branch_and_compares(auth_manager):
+    """Head office sees every branch until it picks one, and gets a per-branch summary."""
+    with app.app_context():
+        main_id, north_id = add_branch_medicines()
+        for store_id, medicine_id in [(1, main_id), (2, north_id)]:
+            db.session.add(Sale(store_id=store_id, medicine_id=medicine_id, medicine_name='Med',
+                                medicine_category='Vitamins', quantity=1, sale_price=store_id * 10.0))
+        db.session.commit()
+
+    page = auth_manager.get('/reports/branches').get_data(as_text=True)
+    assert 'Main Branch' in page and 'North Branch' in page
+    assert '$200.00' in page  # North Branch stock value
+    assert len(auth_manager.get('/sales_report/sales').get_json()['sales']) == 2
+
+    auth_manager.post('/store/select', data={'store_id': 2})
+    page = auth_manager.get('/stock_levels').get_data(as_text=True)
+    assert 'North Only Med' in page and 'Main Only Med' not in page
+    sales = auth_manager.get('/sales_report/sales').get_json()['sales']
+    assert [sale['sale_price'] for sale in sales] == [20.0]
+
+    auth_manager.post('/store/select', data={'store_id': ''})
+    assert len(auth_manager.get('/sales_report/sales').get_json()['sales']) == 2
+
+@pytest.mark.parametrize('username,expected', [
+    ('test_manager', 'Alert: 1 medicines with low stock and 1 out of stock!'),
+    ('north_manager', 'Alert: 0 medicines with low stock and 1 out of stock!'),
+])
+def test_stock_alert_flash_counts_only_the_branch(client, username, expected):
+    """A branch manager is flashed their own branch's alerts; head office gets every branch's."""
+    from app import run_stock_check
+    with app.app_context():
+        add_branch_medicines()
+        db.session.add(Medicine(store_id=2, name='North Empty Med', category='Vitamins', price=1.0, quantity=0,
+                                min_stock_level=5, expiry_date=date.today() + timedelta(days=200)))
+        db.session.add(User(username='north_manager', password='password', user_type='store_manager', store_id=2))
+        db.session.commit()
+        run_stock_check()
+        user_id = User.query.filter_by(username=username).one().id
+
+    with client.session_transaction() as sess:
+        sess['_user_id'] = user_id
+    page = client.get('/', follow_redirects=True).get_data(as_text=True)
+    assert expected in page
+
+def test_change_feed_is_scoped_to_the_branch(client):
+    """A branch manager follows only their own store's changes."""
+    from app import ChangeLogEntry
+    with app.app_context():
+        main_id, north_id = add_branch_medicines()
+        db.session.add(Sale(store_id=1, medicine_id=main_id, medicine_name='Main Only Med',
+                            medicine_category='Vitamins', quantity=1, sale_price=2.0))
+        db.session.commit()
+        assert [entry.store_id for entry in ChangeLogEntry.query.order_by(ChangeLogEntry.seq)] == [1, 2, 1]
+        branch_manager = User(username='north_manager', password='password', user_type='store_manager', store_id=2)
+        db.session.add(branch_manager)
+        db.session.commit()
+        branch_manager_id = branch_manager.id
+    with client.session_transaction() as sess:
+        sess['_user_id'] = branch_manager_id
+
+    _, changes = read_change_feed(client, 0)
+    assert [(change['table'], change['id']) for change in changes] == [('medicine', north_id)]
+    assert changes[0]['row']['store_id'] == 2
+
+def test_init_db_adds_store_columns_to_existing_tables(tmp_path):
+    """init-db migrates a pre-branch database and the store commands manage branches."""
+    import sqlite3
+    from app import create_app, Store
+    path = tmp_path / 'old.db'
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE medicine (id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, '
+                       'category VARCHAR(50) NOT NULL, price FLOAT NOT NULL, quantity INTEGER NOT NULL, '
+                       'min_stock_level INTEGER, expiry_date DATE NOT NULL, created_at DATETIME, updated_at DATETIME)')
+    connection.execute("INSERT INTO medicine (name, category, price, quantity, min_stock_level, expiry_date) "
+                       "VALUES ('Legacy Med', 'Vitamins', 1.0, 3, 1, '2030-01-01')")
+    connection.commit()
+    connection.close()
+
+    cli_app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    runner = cli_app.test_cli_runner()
+    assert 'initialized' in runner.invoke(args=['init-db']).output
+    assert 'Added store NORTH' in runner.invoke(args=['add-store', 'NORTH', 'North Branch']).output
+    assert 'North Branch' in runner.invoke(args=['assign-store', 'cashier', 'NORTH']).output
+
+    with cli_app.app_context():
+        assert Medicine.query.one().store_id == 1
+        assert [store.code for store in Store.query.order_by(Store.id)] == ['MAIN', 'NORTH']
+        assert User.query.filter_by(username='cashier').one().store_id == 2
+        db.engine.dispose()
+    cli_app.extensions['reports_engine'].dispose()
+
+# ==== TEST LIVE EVENTS ====
+
+def read_sse_frames(chunks, count):
+    """Parse the next `count` non-comment SSE frames from a streamed response."""
+    import json
+    frames = []
+    while len(frames) < count:
+        chunk = next(chunks)
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        fields = dict(line.split(': ', 1) for line in chunk.strip().splitlines() if not line.startswith(':'))
+        if 'event' in fields:
+            frames.append((fields['event'], json.loads(fields['data'])))
+    return frames
+
+def test_live_events_push_sales_and_alerts(auth_manager, monkeypatch):
+    """A sale is pushed to open streams, with the low-stock alert it caused."""
+    from app import sell_medicine
+    monkeypatch.setitem(app.config, 'SSE_KEEPALIVE_SECONDS', 0.05)
+    with app.app_context():
+        medicine = Medicine(name='Live Med', category='Vitamins', price=2.5, quantity=12,
+                            min_stock_level=10, expiry_date=date.today() + timedelta(days=90))
+        db.session.add(medicine)
+        db.session.commit()
+        medicine_id = medicine.id
+
+    response = auth_manager.get('/events', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    [(name, snapshot)] = read_sse_frames(chunks, 1)
+    assert name == 'snapshot'
+    assert snapshot['low_stock_count'] == 0 and snapshot['sales_today'] == 0
+
+    with app.app_context():
+        sell_medicine(medicine_id, 5)
+    frames = read_sse_frames(chunks, 2)
+    response.close()
+    assert ('sale', {'sale_id': 1, 'medicine_name': 'Live Med', 'quantity': 5, 'total': 12.5}) in frames
+    alert = dict(frames)['alert']
+    assert (alert['status'], alert['previous_status'], alert['quantity']) == ('low_stock', 'well_stocked', 7)
+
+def test_live_events_dropped_with_rolled_back_savepoint(client):
+    """Only writes that commit reach the streams."""
+    with app.app_context():
+        def sale(name):
+            return Sale(medicine_id=1, medicine_name=name, medicine_category='Vitamins', quantity=1, sale_price=1.0)
+        db.session.add(sale('Kept Before'))
+        db.session.flush()
+        savepoint = db.session.begin_nested()
+        db.session.add(sale('Rolled Back'))
+        db.session.flush()
+        savepoint.rollback()
+        db.session.add(sale('Kept After'))
+        db.session.commit()
+    events, missed = app.extensions['event_broker'].wait(0, 0)
+    assert not missed
+    assert [data['medicine_name'] for _, name, data, _ in events] == ['Kept Before', 'Kept After']
+
+def test_event_broker_reports_missed_events(client):
+    """Streams too far behind, or behind pruned events, are told to resync."""
+    from app import LiveEvent, prune_live_events
+    broker = EventBroker(app, history=2)
+    for number in range(3):
+        broker.publish('sale', {'number': number})
+    events, missed = broker.wait(0, 0)
+    assert missed and [data['number'] for _, _, data, _ in events] == [1, 2]
+    events, missed = broker.wait(2, 0)
+    assert not missed and [event_id for event_id, _, _, _ in events] == [3]
+
+    with app.app_context():
+        LiveEvent.query.filter(LiveEvent.id < 3).update({'created_at': datetime.datetime.utcnow() - timedelta(days=2)})
+        db.session.commit()
+        assert prune_live_events(retention_hours=24) == 2
+        assert [event.id for event in LiveEvent.query.all()] == [3]
+
+def test_live_events_reach_streams_in_other_processes(file_app):
+    """A sale committed by another worker process is delivered without waking this one."""
+    from app import create_app, sell_medicine
+    other_process = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': file_app.config['SQLALCHEMY_DATABASE_URI']})
+    broker = file_app.extensions['event_broker']
+    broker.poll_interval = 0.05
+    after_id = broker.last_id
+    try:
+        with other_process.app_context():
+            sell_medicine(1, 3)
+        events, missed = broker.wait(after_id, 5)
+    finally:
+        with other_process.app_context():
+            db.engine.dispose()
+        other_process.extensions['reports_engine'].dispose()
+        other_process.extensions['inventory_snapshot'].close()
+        other_process.extensions['event_broker'].close()
+    assert not missed
+    assert [(name, data['quantity']) for _, name, data, _ in events] == [('sale', 3)]
+
+def test_idle_event_polls_skip_the_query(file_app):
+    """Timed polls only read live_event after some connection has committed."""
+    import time
+    from sqlalchemy import event
+    from app import LiveEvent, live_event_row
+    broker = file_app.extensions['event_broker']
+    broker.poll_interval = 0.01
+    queries = []
+
+    def count_event_queries(conn, cursor, statement, parameters, context, executemany):
+        if 'FROM live_event' in statement:
+            queries.append(statement)
+    engine = file_app.extensions['reports_engine']
+    event.listen(engine, 'before_cursor_execute', count_event_queries)
+    try:
+        after_id = broker.last_id
+        broker.wait(after_id, 0.05)
+        queries.clear()
+        time.sleep(0.02)
+        assert broker.wait(after_id, 0.1) == ([], False)
+        assert queries == []
+
+        with file_app.app_context(), db.engine.begin() as connection:
+            connection.execute(LiveEvent.__table__.insert(), [live_event_row('sale', {'quantity': 1}, None)])
+        events, _ = broker.wait(after_id, 1)
+        assert [data for _, _, data, _ in events] == [{'quantity': 1}]
+        assert len(queries) == 1
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_event_queries)
+
+# ==== TEST FRAGMENT CACHE ====
+
+def test_inventory_table_fragment_follows_inventory_version(auth_pharmacist):
+    """The cached table is reused until a medicine changes."""
+    fragment_cache = app.extensions['fragment_cache']
+    with app.app_context():
+        medicine = Medicine(name='Cached Med', category='Vitamins', price=1.0, quantity=40,
+                            min_stock_level=5, expiry_date=date.today() + timedelta(days=60))
+        db.session.add(medicine)
+        db.session.commit()
+        medicine_id = medicine.id
+
+    first = auth_pharmacist.get('/index').get_data(as_text=True)
+    hits = fragment_cache.hits
+    second = auth_pharmacist.get('/index').get_data(as_text=True)
+    assert fragment_cache.hits > hits
+    assert '<td>40</td>' in first and first == second
+    assert f'/update_medicine/{medicine_id}' in second
+
+    with app.app_context():
+        db.session.get(Medicine, medicine_id).quantity = 33
+        db.session.commit()
+    assert '<td>33</td>' in auth_pharmacist.get('/index').get_data(as_text=True)
+
+def test_cache_tag_keys_on_its_arguments(client):
+    """Each distinct key renders once; the body does not run for a cached key."""
+    template = app.jinja_env.from_string(
+        "{% cache 'probe', role %}{{ role }}:{{ counter.append(1) or counter|length }}{% endcache %}")
+    counter = []
+    assert template.render(role='cashier', counter=counter) == 'cashier:1'
+    assert template.render(role='cashier', counter=counter) == 'cashier:1'
+    assert template.render(role='pharmacist', counter=counter) == 'pharmacist:2'
+    assert len(counter) == 2
+
+def test_jinja_bytecode_cache_persists_compiled_templates(tmp_path):
+    from app import create_app
+    cache_dir = tmp_path / 'jinja'
+    cached_app = create_app({'TESTING': True, 'JINJA_BYTECODE_CACHE_DIR': str(cache_dir)})
+    cached_app.jinja_env.get_template('login.html')
+    assert any(cache_dir.iterdir())
+
+# ==== TEST RESPONSE COMPRESSION ====
+
+def test_html_responses_gzipped_when_accepted(auth_pharmacist):
+    """Large pages are gzipped for clients that ask; others get identity bodies."""
+    import gzip
+    plain = auth_pharmacist.get('/index')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    compressed = auth_pharmacist.get('/index', headers={'Accept-Encoding': 'br, gzip;q=0.8'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert int(compressed.headers['Content-Length']) == len(compressed.data) < len(plain.data)
+    assert gzip.decompress(compressed.data) == plain.data
+
+    refused = auth_pharmacist.get('/index', headers={'Accept-Encoding': 'gzip;q=0'})
+    assert 'Content-Encoding' not in refused.headers
+
+def test_streamed_exports_gzipped_above_threshold(auth_manager, monkeypatch):
+    """Streamed bodies are compressed as they go, unless they end below the minimum size."""
+    import gzip
+    add_deficient_medicines()
+    plain = auth_manager.get('/reports/purchase_orders?format=csv').data
+    monkeypatch.setitem(app.config, 'COMPRESS_MIN_SIZE', 100)
+
+    response = auth_manager.get('/reports/purchase_orders?format=csv', headers={'Accept-Encoding': 'gzip'})
+    assert response.is_streamed and 'Content-Length' not in response.headers
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == plain
+
+    monkeypatch.setitem(app.config, 'COMPRESS_MIN_SIZE', len(plain) + 1)
+    small = auth_manager.get('/reports/purchase_orders?format=csv', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers and small.data == plain
+
+def test_event_streams_never_compressed(auth_manager, monkeypatch):
+    monkeypatch.setitem(app.config, 'SSE_MAX_STREAM_SECONDS', 0)
+    response = auth_manager.get('/events', headers={'Accept-Encoding': 'gzip'})
+    assert response.mimetype == 'text/event-stream'
+    assert 'Content-Encoding' not in response.headers
+
+# ==== TEST STATIC ASSETS ====
+
+def test_pages_link_fingerprinted_assets(auth_manager):
+    """Shared CSS and scripts are linked by content hash and cached for good."""
+    manifest = app.extensions['asset_manifest']
+    page = auth_manager.get('/index').get_data(as_text=True)
+    assert '<style>' not in page
+    for name in ('css/base.css', 'js/base.js', 'js/live-events.js'):
+        assert f'/assets/{manifest.files[name]}' in page
+
+    response = auth_manager.get(f"/assets/{manifest.files['css/base.css']}")
+    assert response.status_code == 200 and response.mimetype == 'text/css'
+    assert response.cache_control.immutable and response.cache_control.max_age == 365 * 24 * 3600
+    with open(os.path.join(app.static_folder, 'css', 'base.css'), 'rb') as source:
+        assert response.data == source.read()
+    response.close()
+
+    assert auth_manager.get('/assets/css/base.0123456789ab.css').status_code == 404
+
+def test_built_assets_served_precompressed(tmp_path):
+    """After build-assets the gzip variants are sent as they are to clients that accept them."""
+    import gzip
+    from app import create_app
+    build_dir = tmp_path / 'dist'
+    built_app = create_app({'TESTING': True, 'ASSET_BUILD_DIR': str(build_dir)})
+    result = built_app.test_cli_runner().invoke(args=['build-assets'])
+    assert 'Wrote 4 assets' in result.output
+
+    built_app = create_app({'TESTING': True, 'ASSET_BUILD_DIR': str(build_dir)})
+    hashed_name = built_app.extensions['asset_manifest'].files['js/base.js']
+    assert hashed_name == app.extensions['asset_manifest'].files['js/base.js']
+    client = built_app.test_client()
+    plain = client.get(f'/assets/{hashed_name}')
+    compressed = client.get(f'/assets/{hashed_name}', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.cache_control.immutable
+    assert gzip.decompress(compressed.data) == plain.data
+    assert compressed.data == (build_dir / f'{hashed_name}.gz').read_bytes()
+    plain.close()
+    compressed.close()
+
+# ==== TEST REPORT CHARTS ====
+
+def test_report_pages_load_charts_from_series_endpoints(auth_manager):
+    """The pages carry no chart data; each chart fetches its own series."""
+    with app.app_context():
+        db.session.add_all([
+            Medicine(name='Chart A', category='Vitamins', price=2.0, quantity=0, min_stock_level=5,
+                     expiry_date=date.today() + timedelta(days=90)),
+            Medicine(name='Chart B', category='Antibiotics', price=3.0, quantity=10, min_stock_level=5,
+                     expiry_date=date.today() + timedelta(days=90)),
+            Sale(medicine_id=2, medicine_name='Chart B', medicine_category='Antibiotics', quantity=2,
+                 sale_price=3.0, sale_date=datetime.datetime.now()),
+        ])
+        db.session.commit()
+
+    page = auth_manager.get('/sales_report').get_data(as_text=True)
+    assert '/reports/charts/daily_sales' in page and 'data-value="6.0"' in page
+    assert '/reports/charts/stock_status' in auth_manager.get('/reports/inventory_status').get_data(as_text=True)
+
+    daily = auth_manager.get('/reports/charts/daily_sales').get_json()
+    assert len(daily['labels']) == 7 and daily['values'][-1] == 6.0
+    assert auth_manager.get('/reports/charts/sales_by_category').get_json() == {
+        'labels': ['Antibiotics'], 'values': [6.0]}
+    assert auth_manager.get('/reports/charts/stock_status').get_json()['values'] == [1, 0, 1]
+    assert auth_manager.get('/reports/charts/value_by_category').get_json() == {
+        'labels': ['Antibiotics', 'Vitamins'], 'values': [30.0, 0.0]}
+    assert auth_manager.get('/reports/charts/nonsense').status_code == 404
+
+def test_chart_series_cached_until_a_commit_changes_them(auth_manager):
+    """Series are served from the cache, and only the ones a commit affects are recomputed."""
+    from app import sell_medicine
+    chart_cache = app.extensions['chart_cache']
+    with app.app_context():
+        medicine = Medicine(name='Cached Chart', category='Vitamins', price=5.0, quantity=10,
+                            min_stock_level=2, expiry_date=date.today() + timedelta(days=90))
+        db.session.add(medicine)
+        db.session.commit()
+        medicine_id = medicine.id
+
+    assert auth_manager.get('/reports/charts/medicines_by_category').get_json()['values'] == [1]
+    assert auth_manager.get('/reports/charts/top_products').get_json()['values'] == []
+    with patch('app.inventory_by_category', side_effect=AssertionError('recomputed')):
+        assert auth_manager.get('/reports/charts/stock_status').get_json()['values'] == [0, 0, 1]
+
+    with app.app_context():
+        sell_medicine(medicine_id, 3)
+    assert ('medicines_by_category', None) not in chart_cache._entries
+    assert auth_manager.get('/reports/charts/top_products').get_json() == {
+        'labels': ['Cached Chart'], 'values': [3]}
+    assert auth_manager.get('/reports/charts/value_by_category').get_json()['values'] == [35.0]
+
+def test_chart_series_denied_for_pharmacist(auth_pharmacist):
+    assert auth_pharmacist.get('/reports/charts/daily_sales').status_code == 403
+
+# ==== TEST SALES ANALYTICS ====
+
+def test_sales_analytics_buckets(auth_manager):
+    """Revenue, units and transactions per bucket, with empty buckets filled in."""
+    with app.app_context():
+        for when, quantity, category, medicine_id in [
+                (datetime.datetime(2024, 3, 4, 9, 15), 2, 'Vitamins', 1),     # Monday
+                (datetime.datetime(2024, 3, 4, 9, 45), 1, 'Antibiotics', 2),
+                (datetime.datetime(2024, 3, 10, 18, 0), 3, 'Vitamins', 1),    # Sunday
+                (datetime.datetime(2024, 4, 2, 12, 0), 4, 'Vitamins', 3)]:
+            db.session.add(Sale(medicine_id=medicine_id, medicine_name=f'Med {medicine_id}', medicine_category=category,
+                                quantity=quantity, sale_price=2.5, sale_date=when))
+        db.session.commit()
+
+    def analytics(**params):
+        response = auth_manager.get('/reports/analytics', query_string=params)
+        assert response.status_code == 200
+        return response.get_json()
+
+    data = analytics(start_date='2024-03-01', end_date='2024-04-30', granularity='week')
+    assert data['buckets'][0]['bucket'] == '2024-02-26'
+    week = {bucket['bucket']: bucket for bucket in data['buckets']}
+    assert week['2024-03-04'] == {'bucket': '2024-03-04', 'revenue': 15.0, 'units': 6, 'transactions': 3}
+    assert week['2024-03-11']['transactions'] == 0
+    assert data['totals'] == {'revenue': 25.0, 'units': 10, 'transactions': 4}
+
+    months = analytics(start_date='2024-03-01', end_date='2024-05-15', granularity='month')['buckets']
+    assert [(bucket['bucket'], bucket['units']) for bucket in months] == [
+        ('2024-03-01', 6), ('2024-04-01', 4), ('2024-05-01', 0)]
+
+    hours = analytics(start_date='2024-03-04', end_date='2024-03-04', granularity='hour')['buckets']
+    assert len(hours) == 24 and hours[9] == {'bucket': '2024-03-04 09:00', 'revenue': 7.5, 'units': 3, 'transactions': 2}
+
+    days = analytics(start_date='2024-03-01', end_date='2024-03-31', category='Vitamins')['buckets']
+    assert [bucket['bucket'] for bucket in days if bucket['units']] == ['2024-03-04', '2024-03-10']
+    assert analytics(start_date='2024-01-01', end_date='2024-12-31', granularity='month',
+                     medicine_id=1)['totals']['units'] == 5
+
+def test_sales_analytics_validation(auth_manager):
+    def status(**params):
+        return auth_manager.get('/reports/analytics', query_string=params).status_code
+    assert status(granularity='year') == 400
+    assert status(start_date='March') == 400
+    assert status(start_date='2024-03-02', end_date='2024-03-01') == 400
+    assert status(start_date='2020-01-01', end_date='2024-12-31', granularity='hour') == 400
+    assert status(start_date='2020-01-01', end_date='2024-12-31', granularity='day') == 200
+
+def test_sales_analytics_rejects_large_ranges_before_building_buckets(auth_manager):
+    """The bucket cap is checked arithmetically, so a huge range costs nothing to reject."""
+    from app import analytics_bucket_count, analytics_bucket_labels
+    for start, end in [(date(2024, 1, 31), date(2024, 3, 1)), (date(2023, 12, 31), date(2025, 1, 6)),
+                       (date(2024, 2, 29), date(2024, 2, 29))]:
+        for granularity in ('hour', 'day', 'week', 'month'):
+            assert analytics_bucket_count(start, end, granularity) == len(analytics_bucket_labels(start, end, granularity))
+
+    with patch('app.analytics_bucket_labels', side_effect=AssertionError('labels built')):
+        response = auth_manager.get('/reports/analytics', query_string={
+            'start_date': '0001-01-01', 'end_date': '9999-12-31', 'granularity': 'hour'})
+    assert response.status_code == 400
+
+def test_sales_analytics_denied_for_cashier(auth_cashier):
+    assert auth_cashier.get('/reports/analytics').status_code == 403
+
+# ==== TEST CUSTOMERS ====
+
+def test_sales_link_customers_case_insensitively(auth_pharmacist):
+    """Names differing only in case or spacing are one customer with running totals."""
+    from app import sell_medicine, Customer
+    with app.app_context():
+        medicine = Medicine(name='Loyalty Med', category='Vitamins', price=4.0, quantity=50,
+                            min_stock_level=5, expiry_date=date.today() + timedelta(days=90))
+        db.session.add(medicine)
+        db.session.commit()
+        for name, quantity in [('Alice Smith', 2), ('alice  SMITH ', 3), ('Bob', 1), ('', 4)]:
+            sell_medicine(medicine.id, quantity, name)
+
+        alice, bob = Customer.query.order_by(Customer.lifetime_revenue.desc()).all()
+        assert (alice.name, alice.lifetime_purchases, alice.lifetime_units, alice.lifetime_revenue) == \
+            ('Alice Smith', 2, 5, 20.0)
+        assert bob.lifetime_revenue == 4.0
+        assert Sale.query.filter_by(customer_id=None).one().customer_name is None
+        alice_id = alice.id
+
+    lookup = auth_pharmacist.get('/customers/lookup?q=ALI').get_json()['customers']
+    assert [(customer['id'], customer['lifetime_purchases']) for customer in lookup] == [(alice_id, 2)]
+    page = auth_pharmacist.get('/customers').get_data(as_text=True)
+    assert page.index('Alice Smith') < page.index('Bob')
+    assert 'Alice Smith' not in auth_pharmacist.get('/customers?q=b').get_data(as_text=True)
+
+    history = auth_pharmacist.get(f'/customers/{alice_id}')
+    assert history.status_code == 200 and history.data.count(b'Loyalty Med</td>') == 2
+    assert b'Lifetime totals across all branches' in history.data
+    sales = auth_pharmacist.get(f'/customers/{alice_id}/sales').get_json()['sales']
+    assert [sale['quantity'] for sale in sales] == [3, 2]
+    assert auth_pharmacist.get('/customers/999').status_code == 404
+
+def test_rebuild_customers_links_earlier_sales(client):
+    """Sales recorded before customers existed are linked and totalled by one rebuild."""
+    from app import Customer, rebuild_customers
+    with app.app_context():
+        db.session.execute(Sale.__table__.insert(), [
+            {'medicine_id': 1, 'medicine_name': 'Old Med', 'medicine_category': 'Vitamins', 'quantity': quantity,
+             'sale_price': 2.0, 'customer_name': name, 'sale_date': datetime.datetime(2024, 1, day)}
+            for day, (name, quantity) in enumerate([('Carol', 1), ('CAROL ', 2), ('Dan', 5), (None, 1), ('', 1)], 1)
+        ])
+        db.session.commit()
+        assert Sale.query.filter(Sale.customer_id.isnot(None)).count() == 0
+
+        assert rebuild_customers() == 2
+        carol = Customer.query.filter(Customer.name == 'carol').one()
+        assert (carol.lifetime_purchases, carol.lifetime_units, carol.lifetime_revenue) == (2, 3, 6.0)
+        assert carol.first_purchase_at == datetime.datetime(2024, 1, 1)
+        assert carol.last_purchase_at == datetime.datetime(2024, 1, 2)
+        assert Sale.query.filter_by(customer_id=carol.id).count() == 2
+        assert rebuild_customers() == 2
+        assert db.session.get(Customer, carol.id).lifetime_units == 3
+
+def test_seeded_sales_are_linked_to_customers(client):
+    """Sample sales are bulk inserted without flush hooks, so seeding links them afterwards."""
+    from app import Customer, seed_sample_data
+    with app.app_context():
+        seed_sample_data()
+        named = Sale.query.filter(Sale.customer_name.isnot(None), Sale.customer_name != '')
+        assert named.count() > 0
+        assert named.filter(Sale.customer_id.is_(None)).count() == 0
+        assert Customer.query.count() > 1
+        assert Customer.query.filter(Customer.lifetime_purchases > 0).count() == Customer.query.count()
+
+def test_customer_pages_permissions(auth_cashier):
+    """Cashiers can look customers up at the till but not see their spending or histories."""
+    from app import sell_medicine
+    with app.app_context():
+        medicine = Medicine(name='Loyalty Med', category='Vitamins', price=4.0, quantity=50,
+                            min_stock_level=5, expiry_date=date.today() + timedelta(days=90))
+        db.session.add(medicine)
+        db.session.commit()
+        sell_medicine(medicine.id, 1, 'Alice Smith')
+    lookup = auth_cashier.get('/customers/lookup?q=a')
+    assert lookup.status_code == 200
+    assert [set(customer) for customer in lookup.get_json()['customers']] == [{'id', 'name'}]
+    assert b'You do not have permission to view customers.' in \
+        auth_cashier.get('/customers', follow_redirects=True).data
+    assert auth_cashier.get('/customers/1/sales').status_code == 403
+
+# ==== TEST SALES ARCHIVE ====
+
+def test_archive_sales_moves_old_sales_to_attached_file(file_app, tmp_path):
+    """Old sales move to the archive file in chunks and reports still read them from there."""
+    from io import StringIO
+    import csv
+    from app import (ArchivedSale, archive_sales, archived_sale_table, report_session, sale_sources,
+                     sales_analytics, sales_history_page, write_sales_csv)
+    old_days = [datetime.datetime.now() - timedelta(days=400 + day) for day in range(5)]
+    with file_app.app_context():
+        db.session.add_all([Sale(medicine_id=1, medicine_name='Report Med', medicine_category='Vitamins',
+                                 quantity=1, sale_price=4.0, sale_date=sale_date) for sale_date in old_days])
+        db.session.add(Sale(medicine_id=1, medicine_name='Report Med', medicine_category='Vitamins',
+                            quantity=3, sale_price=4.0, sale_date=datetime.datetime.now()))
+        db.session.commit()
+
+        assert archive_sales(chunk_size=2) == 5
+        assert archive_sales(chunk_size=2) == 0
+        assert Sale.query.count() == 2
+        assert db.session.execute(db.select(db.func.count()).select_from(archived_sale_table)).scalar() == 5
+        assert (tmp_path / 'store_archive.db').exists()
+
+        with report_session() as reports:
+            assert sale_sources(reports, datetime.datetime.now() - timedelta(days=30)) == [Sale]
+            assert ArchivedSale in sale_sources(reports)
+
+            sales, cursor = sales_history_page(reports, {}, limit=3)
+            assert [sale.quantity for sale in sales] == [3, 2, 1]
+            sales, cursor = sales_history_page(reports, {}, cursor, limit=3)
+            assert [sale.sale_date for sale in sales] == old_days[1:4] and cursor is not None
+            sales, cursor = sales_history_page(reports, {}, cursor, limit=3)
+            assert [sale.sale_date for sale in sales] == old_days[4:] and cursor is None
+
+            buckets = sales_analytics(reports, (old_days[-1] - timedelta(days=1)).date(),
+                                      datetime.date.today(), 'month')
+            assert sum(bucket['transactions'] for bucket in buckets) == 7
+            assert sum(bucket['units'] for bucket in buckets) == 10
+
+        output = StringIO()
+        write_sales_csv(csv.writer(output), lambda done, total: None)
+        rows = list(csv.reader(StringIO(output.getvalue())))
+        assert len(rows) == 8 and rows[1][4] == '3'
+
+def test_sales_mid_archive_are_counted_once(file_app):
+    """A chunk copied to the archive but not yet deleted from the hot table is not double counted."""
+    from io import StringIO
+    import csv
+    from app import archived_sale_table, report_session, sales_analytics, write_sales_csv
+    old_day = datetime.datetime.now() - timedelta(days=400)
+    with file_app.app_context():
+        db.session.add(Sale(medicine_id=1, medicine_name='Report Med', medicine_category='Vitamins',
+                            quantity=5, sale_price=4.0, sale_date=old_day))
+        db.session.commit()
+        # What readers see between archive_sales() copying a chunk and deleting it
+        db.session.execute(archived_sale_table.insert().from_select(
+            [column.name for column in Sale.__table__.columns],
+            db.select(*Sale.__table__.columns).where(Sale.sale_date < datetime.datetime.now() - timedelta(days=365))))
+        db.session.commit()
+
+        with report_session() as reports:
+            buckets = sales_analytics(reports, old_day.date(), datetime.date.today(), 'month')
+        assert sum(bucket['transactions'] for bucket in buckets) == 2
+        assert sum(bucket['units'] for bucket in buckets) == 7
+        output = StringIO()
+        write_sales_csv(csv.writer(output), lambda done, total: None)
+        assert len(output.getvalue().splitlines()) == 3
+
+def test_archive_sales_keeps_newest_sale_hot(client):
+    """Even when every sale is old, the newest stays in the hot table so its id is never reused."""
+    from app import archive_sales, rebuild_sales_counters, MedicineSalesCounter
+    with app.app_context():
+        db.session.execute(Sale.__table__.insert(), [
+            {'medicine_id': 1, 'medicine_name': 'Old Med', 'medicine_category': 'Vitamins', 'quantity': 2,
+             'sale_price': 1.5, 'sale_date': datetime.datetime(2020, 1, day)}
+            for day in range(1, 5)
+        ])
+        db.session.commit()
+
+        assert archive_sales() == 3
+        assert [sale.id for sale in Sale.query.all()] == [4]
+        new_sale = Sale(medicine_id=1, medicine_name='Old Med', medicine_category='Vitamins',
+                        quantity=1, sale_price=1.5)
+        db.session.add(new_sale)
+        db.session.commit()
+        assert new_sale.id == 5
+
+        # Rebuilt counters still cover the archived sales
+        rebuild_sales_counters()
+        assert db.session.get(MedicineSalesCounter, 1).lifetime_units == 9
+
+# ==== TEST ONLINE BACKUPS ====
+
+def test_backup_database_copies_live_database(file_app, tmp_path):
+    """Stepped backups and VACUUM INTO snapshots copy the database and its archive to standalone files."""
+    import sqlite3
+    import stat
+    from app import backup_database
+
+    backups = tmp_path / 'backups'
+    file_app.config['BACKUP_PAGES_PER_STEP'] = 1
+    with file_app.app_context():
+        report = backup_database(directory=str(backups))
+        assert report['kind'] == 'backup' and report['restarts'] == 0
+        assert report['steps'] >= report['pages'] > 2
+        path, archive_path = report['paths']
+        assert archive_path == path[:-len('.db')] + '_archive.db'
+        copy = sqlite3.connect(path)
+        assert copy.execute('SELECT medicine_name FROM sale').fetchall() == [('Report Med',)]
+        assert copy.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+        copy.close()
+
+        result = file_app.test_cli_runner().invoke(args=['backup-db', '--snapshot', '--dir', str(backups)])
+        assert 'Wrote snapshot' in result.output
+        snapshots = sorted(backups.glob('store-snapshot-*.db'))
+        assert len(snapshots) == 2
+        assert not os.stat(snapshots[0]).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+        assert not list(backups.glob('*.partial'))
+
+def test_backup_database_keeps_newest_backups(file_app, tmp_path):
+    """Only the newest BACKUP_KEEP backups of each kind are kept, archives included."""
+    from app import backup_database
+
+    backups = tmp_path / 'backups'
+    file_app.config['BACKUP_KEEP'] = 2
+    with file_app.app_context():
+        paths = [backup_database(directory=str(backups))['paths'] for _ in range(3)]
+        snapshot = backup_database(snapshot=True, directory=str(backups))['paths']
+    assert sorted(str(path) for path in backups.iterdir()) == sorted(paths[1] + paths[2] + snapshot)
+
+# ==== TEST PERIODIC JOBS ====
+
+def test_leased_workers_run_once_per_interval_across_processes(client):
+    """A restarted or second worker skips a job that ran recently or is held elsewhere."""
+    from app import BackgroundWorker, JobRun
+
+    class CountingWorker(BackgroundWorker):
+        name = 'counting-job'
+        leased = True
+        runs = 0
+
+        def run_once(self):
+            CountingWorker.runs += 1
+
+    with app.app_context():
+        first, restarted = CountingWorker(app, 3600), CountingWorker(app, 3600)
+        assert first.run_if_due() == 3600
+        assert 3590 < restarted.run_if_due() <= 3600
+        assert CountingWorker.runs == 1
+
+        job = db.session.get(JobRun, 'counting-job')
+        job.last_run_at = datetime.datetime.utcnow() - timedelta(hours=2)
+        job.holder, job.lease_expires_at = first.holder, datetime.datetime.utcnow() + timedelta(minutes=5)
+        db.session.commit()
+        assert restarted.run_if_due() == 3600
+        assert CountingWorker.runs == 1
+
+        job.lease_expires_at = datetime.datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        restarted.run_if_due()
+        assert CountingWorker.runs == 2
+        db.session.expire_all()
+        job = db.session.get(JobRun, 'counting-job')
+        assert job.holder is None and job.last_run_at > datetime.datetime.utcnow() - timedelta(minutes=1)